@@ -3,15 +3,24 @@ Application Factory Module for the Image Storage Application.
 
 This module contains the application factory function that creates and configures
 the Flask application. It handles:
-- Database initialization
+- Database initialization and engine tuning
+- Request and SQL instrumentation
+- Storage backend setup
 - Blueprint registration
+- CLI command registration
+- Taxonomy and page cache setup
+- Background job workers
 - Upload directory creation
-- Initial data seeding
+
+The factory performs no database I/O, so worker processes start quickly
+and never race each other over schema changes. The schema is managed by
+the migrations in migrations/ ('flask db upgrade') and the default
+categories are created once by 'flask seed'.
 """
 
 from flask import Flask
 from config import Config
-from app.models import db
+from app.database import init_database
 
 def create_app(config_class=Config):
     """
@@ -19,10 +28,9 @@ def create_app(config_class=Config):
     
     This factory function creates a new Flask application instance with the
     specified configuration. It initializes all necessary components including:
-    - Database connection
+    - Database connection and migrations
     - Upload directory
     - Blueprint routes
-    - Default categories and subcategories
     
     Args:
         config_class: Configuration class to use (defaults to Config)
@@ -33,51 +41,62 @@ def create_app(config_class=Config):
     app = Flask(__name__)
     app.config.from_object(config_class)
 
-    # Initialize database
-    db.init_app(app)
+    # Initialize database with pooling and SQLite pragmas for the deployment;
+    # each request's session is removed when its app context is torn down.
+    # Also registers the 'flask db' migration commands
+    init_database(app)
+
+    # Record request latency, SQL statements and sizes for /metrics
+    from app.metrics import init_metrics
+    init_metrics(app)
+
+    # Keep originals and renditions on local disk or in object storage
+    from app.storage_backends import init_storage
+    init_storage(app)
+
+    # Validate form uploads while the request body is parsed
+    from app.storage import UploadRequest
+    app.request_class = UploadRequest
 
     # Create upload directory if it doesn't exist
     import os
     os.makedirs(app.config['UPLOAD_FOLDER'], exist_ok=True)
+    os.makedirs(app.config['RENDITION_FOLDER'], exist_ok=True)
+    os.makedirs(app.config['TRANSFORM_CACHE_FOLDER'], exist_ok=True)
 
     # Register blueprints
     from app.routes import bp as main_bp
     app.register_blueprint(main_bp)
+    
+    from app.uploads import bp as uploads_bp
+    app.register_blueprint(uploads_bp)
+    
+    from app.media import bp as media_bp
+    app.register_blueprint(media_bp)
+    
+    from app.transforms import bp as transforms_bp
+    app.register_blueprint(transforms_bp)
+    
+    from app.api import bp as api_bp
+    app.register_blueprint(api_bp)
 
-    # Create database tables
-    with app.app_context():
-        db.create_all()
-        
-        # Seed initial categories and subcategories if not exists
-        from app.models import Category, Subcategory
-        
-        # Check and create default categories if they don't exist
-        default_categories = [
-            'Personal', 'Work', 'Art', 'Photography', 'Design'
-        ]
-        
-        for cat_name in default_categories:
-            existing_cat = Category.query.filter_by(name=cat_name).first()
-            if not existing_cat:
-                new_cat = Category(name=cat_name)
-                db.session.add(new_cat)
-                
-                # Add some default subcategories for each category
-                if cat_name == 'Personal':
-                    subcats = ['Family', 'Friends', 'Events', 'Travel']
-                elif cat_name == 'Work':
-                    subcats = ['Projects', 'Meetings', 'Documents', 'Screenshots']
-                elif cat_name == 'Art':
-                    subcats = ['Digital', 'Traditional', 'Sketches', 'Paintings']
-                elif cat_name == 'Photography':
-                    subcats = ['Landscape', 'Portrait', 'Street', 'Nature']
-                else:  # Design
-                    subcats = ['UI/UX', 'Graphics', 'Logos', 'Mockups']
-                
-                for subcat_name in subcats:
-                    new_subcat = Subcategory(name=subcat_name, parent_category=new_cat)
-                    db.session.add(new_subcat)
-        
-        db.session.commit()
+    from app.export import bp as export_bp
+    app.register_blueprint(export_bp)
+
+    # Cache the category taxonomy used by form choice lists
+    from app.taxonomy import init_taxonomy_cache
+    init_taxonomy_cache(app)
+
+    # Cache rendered gallery, details and category pages
+    from app.page_cache import init_page_cache
+    init_page_cache(app)
+
+    # Process uploads in the background
+    from app.jobs import init_job_queue
+    init_job_queue(app)
+
+    # Register CLI commands
+    from app.cli import register_commands
+    register_commands(app)
 
     return app
@@ -0,0 +1,480 @@
+"""
+JSON API Module for the Image Storage Application.
+
+This module provides the versioned JSON API under /api/v1 for automation
+that would otherwise scrape the HTML pages. Responses only load and return
+the fields a client asks for. It handles:
+- Listing images with keyset cursor pagination
+- Ranked full-text search using the same filters as the search page
+- Fetching, updating and deleting single images
+- Batch get/update/delete by ID list, each in a single set-based transaction
+- Listing the category taxonomy
+"""
+
+from collections import namedtuple
+
+from flask import Blueprint, current_app, request, jsonify, url_for
+
+from app.models import db, Subcategory, Image, Blob
+from app.bulk import delete_images, update_images
+from app.media import image_url, rendition_url
+from app.pagination import keyset_paginate, decode_cursor
+from app.search import filter_images, RANGE_FILTERS
+from app.taxonomy import get_taxonomy
+
+bp = Blueprint('api', __name__, url_prefix='/api/v1')
+
+# Columns and relationships a field needs loaded, and how to serialize it
+Field = namedtuple('Field', 'columns relations getter')
+
+FIELDS = {
+    'id': Field((), (), lambda image: image.id),
+    'name': Field((Image.name,), (), lambda image: image.name),
+    'description': Field((Image.description,), (), lambda image: image.description),
+    'prompt': Field((Image.prompt,), (), lambda image: image.prompt),
+    'filename': Field((Image.filename,), (), lambda image: image.filename),
+    'upload_date': Field((), (), lambda image: image.upload_date.isoformat()),
+    'category_id': Field((Image.category_id,), (), lambda image: image.category_id),
+    'category': Field((Image.category_id,), ('category',), lambda image: image.category.name),
+    'subcategory_id': Field((Image.subcategory_id,), (), lambda image: image.subcategory_id),
+    'subcategory': Field((Image.subcategory_id,), ('subcategory',), lambda image: image.subcategory.name),
+    'sha256': Field((Image.blob_id,), ('blob',), lambda image: image.blob.sha256 if image.blob else None),
+    'size': Field((Image.blob_id,), ('blob',), lambda image: image.blob.size if image.blob else None),
+    'width': Field((Image.width,), (), lambda image: image.width),
+    'height': Field((Image.height,), (), lambda image: image.height),
+    'format': Field((Image.format,), (), lambda image: image.format),
+    'file_size': Field((Image.file_size,), (), lambda image: image.file_size),
+    'color_mode': Field((Image.color_mode,), (), lambda image: image.color_mode),
+    'generation_params': Field((Image.generation_params,), (), lambda image: image.generation_info),
+    'url': Field((), (), lambda image: url_for('main.image_details', image_id=image.id)),
+    'image_url': Field((Image.blob_id, Image.filename), ('blob',), image_url),
+    'thumb_url': Field((Image.blob_id, Image.filename), ('renditions',),
+                       lambda image: rendition_url(image, 'thumb')),
+    'preview_url': Field((Image.blob_id, Image.filename), ('renditions',),
+                         lambda image: rendition_url(image, 'preview')),
+}
+
+# Eager-loading options for the relationships fields depend on
+LOADERS = {
+    'category': lambda: db.joinedload(Image.category),
+    'subcategory': lambda: db.joinedload(Image.subcategory),
+    'blob': lambda: db.joinedload(Image.blob),
+    'renditions': lambda: db.joinedload(Image.blob).selectinload(Blob.renditions),
+}
+
+# Attributes clients may change through PATCH and batch updates
+UPDATABLE = {'name', 'description', 'prompt', 'category_id', 'subcategory_id'}
+
+
+class APIError(Exception):
+    """Invalid request, reported to the client as a JSON error."""
+
+    def __init__(self, message, status=400, **extra):
+        super().__init__(message)
+        self.message = message
+        self.status = status
+        self.extra = extra
+
+
+@bp.errorhandler(APIError)
+def handle_api_error(error):
+    """Return a JSON error response for an APIError."""
+    return jsonify({'error': error.message, **error.extra}), error.status
+
+
+def requested_fields():
+    """
+    Parse the `fields` argument into a list of field names.
+
+    Returns:
+        list: Requested field names, or all fields when none are given
+    """
+    raw = request.args.get('fields') or (request.get_json(silent=True) or {}).get('fields')
+    if not raw:
+        return list(FIELDS)
+    fields = raw if isinstance(raw, list) else str(raw).split(',')
+    fields = [str(field).strip() for field in fields if str(field).strip()]
+    unknown = [field for field in fields if field not in FIELDS]
+    if unknown:
+        raise APIError(f'Unknown fields: {", ".join(unknown)}', allowed=list(FIELDS))
+    return fields
+
+
+def metadata_filters():
+    """
+    Read the metadata filters from the query string.
+
+    Returns:
+        dict: Keyword arguments for filter_images()
+    """
+    filters = {
+        'image_format': request.args.get('format'),
+        'color_mode': request.args.get('color_mode'),
+        'orientation': request.args.get('orientation'),
+    }
+    for name in RANGE_FILTERS:
+        if request.args.get(name):
+            value = request.args.get(name, type=int)
+            if value is None:
+                raise APIError(f'{name} must be an integer')
+            filters[name] = value
+    return filters
+
+
+def image_query(fields):
+    """
+    Build an Image query loading only what the given fields need.
+
+    Args:
+        fields (list): Field names that will be serialized
+
+    Returns:
+        Query: Image query with load_only and eager-loading options
+    """
+    columns = {Image.id, Image.upload_date}
+    relations = set()
+    for field in fields:
+        columns.update(FIELDS[field].columns)
+        relations.update(FIELDS[field].relations)
+    if 'renditions' in relations:
+        relations.discard('blob')
+
+    options = [db.load_only(*columns)] + [LOADERS[relation]() for relation in sorted(relations)]
+    return Image.query.options(*options)
+
+
+def serialize(image, fields):
+    """
+    Serialize an image to a dict holding the requested fields.
+
+    Args:
+        image (Image): Image to serialize
+        fields (list): Field names to include
+
+    Returns:
+        dict: Field name mapped to its value
+    """
+    return {field: FIELDS[field].getter(image) for field in fields}
+
+
+def page_size():
+    """
+    Return the `limit` argument, bounded by API_MAX_PAGE_SIZE.
+
+    Returns:
+        int: Number of images per page
+    """
+    limit = request.args.get('limit', current_app.config['IMAGES_PER_PAGE'], type=int)
+    max_limit = current_app.config['API_MAX_PAGE_SIZE']
+    if not 1 <= limit <= max_limit:
+        raise APIError(f'limit must be between 1 and {max_limit}')
+    return limit
+
+
+def batch_ids(data):
+    """
+    Validate the `ids` list of a batch request.
+
+    Args:
+        data (dict): JSON request body
+
+    Returns:
+        list: Distinct image IDs in request order
+    """
+    ids = data.get('ids')
+    max_size = current_app.config['API_MAX_BATCH_SIZE']
+    if not isinstance(ids, list) or not ids or not all(isinstance(i, int) for i in ids):
+        raise APIError('ids must be a non-empty list of image IDs')
+    if len(ids) > max_size:
+        raise APIError(f'At most {max_size} IDs can be sent per batch')
+    return list(dict.fromkeys(ids))
+
+
+def validate_changes(data):
+    """
+    Validate the attributes of an update request.
+
+    Changing the subcategory alone also moves the image to that
+    subcategory's category; changing the category requires a subcategory
+    belonging to it.
+
+    Args:
+        data (dict): Attribute names mapped to new values
+
+    Returns:
+        dict: Validated column values to apply
+    """
+    if not isinstance(data, dict) or not data:
+        raise APIError(f'Send at least one of: {", ".join(sorted(UPDATABLE))}')
+    unknown = set(data) - UPDATABLE
+    if unknown:
+        raise APIError(f'Cannot update: {", ".join(sorted(unknown))}')
+
+    changes = {}
+    if 'name' in data:
+        name = str(data['name'] or '').strip()
+        if not 3 <= len(name) <= 200:
+            raise APIError('Name must be between 3 and 200 characters')
+        changes['name'] = name
+    if 'description' in data:
+        description = str(data['description'] or '')
+        if len(description) > 1000:
+            raise APIError('Description cannot exceed 1000 characters')
+        changes['description'] = description
+    if 'prompt' in data:
+        prompt = str(data['prompt'] or '')
+        if len(prompt) > 500:
+            raise APIError('Prompt cannot exceed 500 characters')
+        changes['prompt'] = prompt
+
+    if 'category_id' in data and 'subcategory_id' not in data:
+        raise APIError('subcategory_id is required when changing category_id')
+    if 'subcategory_id' in data:
+        subcategory = db.session.get(Subcategory, data['subcategory_id']) \
+            if isinstance(data['subcategory_id'], int) else None
+        if subcategory is None:
+            raise APIError('Unknown subcategory')
+        if data.get('category_id', subcategory.category_id) != subcategory.category_id:
+            raise APIError('Subcategory does not belong to the category')
+        changes['category_id'] = subcategory.category_id
+        changes['subcategory_id'] = subcategory.id
+    return changes
+
+
+@bp.route('/images', methods=['GET'])
+def list_images():
+    """
+    List images newest first with keyset cursor pagination.
+
+    Query parameters: `fields`, `limit`, `cursor` (from `next_cursor` of the
+    previous page), `category_id`, `subcategory_id` and the metadata filters
+    (`format`, `color_mode`, `orientation`, `min_width`, `max_size`, ...).
+
+    Returns:
+        str: JSON with `items` and `next_cursor`
+    """
+    fields = requested_fields()
+    cursor = request.args.get('cursor')
+    if cursor and decode_cursor(cursor) is None:
+        raise APIError('Invalid cursor')
+
+    query, _ = filter_images(
+        image_query(fields),
+        category_id=request.args.get('category_id', type=int),
+        subcategory_id=request.args.get('subcategory_id', type=int),
+        **metadata_filters()
+    )
+    page = keyset_paginate(query, cursor, page_size())
+    return jsonify({
+        'items': [serialize(image, fields) for image in page.items],
+        'next_cursor': page.next_cursor
+    })
+
+
+@bp.route('/images/search', methods=['GET'])
+def search_images():
+    """
+    Search images, best matches first.
+
+    Query parameters: `q` (full-text search), `category_id`,
+    `subcategory_id`, the metadata filters, `fields`, `limit` and `page`.
+
+    Returns:
+        str: JSON with `items`, `page` and `next_page`
+    """
+    fields = requested_fields()
+    limit = page_size()
+    page = request.args.get('page', 1, type=int)
+    if page < 1:
+        raise APIError('page must be a positive integer')
+
+    query, rank_order = filter_images(
+        image_query(fields),
+        text=request.args.get('q', '')[:200],
+        category_id=request.args.get('category_id', type=int),
+        subcategory_id=request.args.get('subcategory_id', type=int),
+        **metadata_filters()
+    )
+    # Fetch one extra row instead of running a COUNT query
+    items = query.order_by(*rank_order, Image.upload_date.desc(), Image.id.desc()) \
+        .offset((page - 1) * limit).limit(limit + 1).all()
+    return jsonify({
+        'items': [serialize(image, fields) for image in items[:limit]],
+        'page': page,
+        'next_page': page + 1 if len(items) > limit else None
+    })
+
+
+@bp.route('/images/<int:image_id>', methods=['GET'])
+def get_image(image_id):
+    """
+    Fetch one image.
+
+    Args:
+        image_id (int): ID of the image
+
+    Returns:
+        str: JSON image with the requested `fields`
+    """
+    fields = requested_fields()
+    image = image_query(fields).filter(Image.id == image_id).first()
+    if image is None:
+        raise APIError('Image not found', 404)
+    return jsonify(serialize(image, fields))
+
+
+@bp.route('/images/<int:image_id>', methods=['PATCH'])
+def update_image(image_id):
+    """
+    Update an image's metadata.
+
+    Expects a JSON body with any of `name`, `description`, `prompt`,
+    `category_id` and `subcategory_id`.
+
+    Args:
+        image_id (int): ID of the image
+
+    Returns:
+        str: JSON of the updated image
+    """
+    fields = requested_fields()
+    image = db.session.get(Image, image_id)
+    if image is None:
+        raise APIError('Image not found', 404)
+    changes = validate_changes(request.get_json(silent=True))
+
+    try:
+        for attribute, value in changes.items():
+            setattr(image, attribute, value)
+        db.session.commit()
+    except Exception as e:
+        db.session.rollback()
+        raise APIError(f'Error updating image: {str(e)}', 500)
+
+    image = image_query(fields).filter(Image.id == image_id).first()
+    return jsonify(serialize(image, fields))
+
+
+@bp.route('/images/<int:image_id>', methods=['DELETE'])
+def delete_image(image_id):
+    """
+    Delete an image.
+
+    Args:
+        image_id (int): ID of the image
+
+    Returns:
+        str: Empty response (204)
+    """
+    image = db.session.get(Image, image_id)
+    if image is None:
+        raise APIError('Image not found', 404)
+
+    try:
+        image.delete_file()
+        db.session.delete(image)
+        db.session.commit()
+        return '', 204
+    except Exception as e:
+        db.session.rollback()
+        raise APIError(f'Error deleting image: {str(e)}', 500)
+
+
+@bp.route('/images/batch/get', methods=['POST'])
+def batch_get_images():
+    """
+    Fetch several images by ID.
+
+    Expects a JSON body with `ids` and optionally `fields`.
+
+    Returns:
+        str: JSON with `items` in request order and the `missing` IDs
+    """
+    data = request.get_json(silent=True) or {}
+    ids = batch_ids(data)
+    fields = requested_fields()
+    found = {image.id: image for image in image_query(fields).filter(Image.id.in_(ids))}
+    return jsonify({
+        'items': [serialize(found[i], fields) for i in ids if i in found],
+        'missing': [i for i in ids if i not in found]
+    })
+
+
+@bp.route('/images/batch/update', methods=['POST'])
+def batch_update_images():
+    """
+    Apply the same changes to several images in one transaction.
+
+    Expects a JSON body with `ids` and `changes` (as for PATCH). Nothing is
+    changed if any ID does not exist.
+
+    Returns:
+        str: JSON with the number of `updated` images
+    """
+    data = request.get_json(silent=True) or {}
+    ids = batch_ids(data)
+    changes = validate_changes(data.get('changes'))
+
+    try:
+        existing = {i for (i,) in db.session.query(Image.id).filter(Image.id.in_(ids))}
+        missing = [i for i in ids if i not in existing]
+        if missing:
+            raise APIError('Images not found', 404, missing=missing)
+
+        updated = update_images(ids, changes)
+        db.session.commit()
+        return jsonify({'updated': updated})
+    except APIError:
+        db.session.rollback()
+        raise
+    except Exception as e:
+        db.session.rollback()
+        raise APIError(f'Error updating images: {str(e)}', 500)
+
+
+@bp.route('/images/batch/delete', methods=['POST'])
+def batch_delete_images():
+    """
+    Delete several images in one transaction.
+
+    Expects a JSON body with `ids`. Nothing is deleted if any ID does not
+    exist. Files no longer used by any image are removed in the background.
+
+    Returns:
+        str: JSON with the number of `deleted` images
+    """
+    data = request.get_json(silent=True) or {}
+    ids = batch_ids(data)
+
+    try:
+        existing = {i for (i,) in db.session.query(Image.id).filter(Image.id.in_(ids))}
+        missing = [i for i in ids if i not in existing]
+        if missing:
+            raise APIError('Images not found', 404, missing=missing)
+
+        deleted = delete_images(ids)
+        db.session.commit()
+        return jsonify({'deleted': deleted})
+    except APIError:
+        db.session.rollback()
+        raise
+    except Exception as e:
+        db.session.rollback()
+        raise APIError(f'Error deleting images: {str(e)}', 500)
+
+
+@bp.route('/categories', methods=['GET'])
+def list_categories():
+    """
+    List all categories with their subcategories.
+
+    Returns:
+        str: JSON list of categories, each with its `subcategories`
+    """
+    taxonomy = get_taxonomy()
+    return jsonify([{
+        'id': category_id,
+        'name': name,
+        'subcategories': [{'id': sub_id, 'name': sub_name}
+                          for sub_id, sub_name in taxonomy.subcategory_choices(category_id)]
+    } for category_id, name in taxonomy.categories])
@@ -0,0 +1,147 @@
+"""
+Bulk Operations Module for the Image Storage Application.
+
+This module changes many images at once with set-based SQL instead of
+loading, changing and committing them one by one. It handles:
+- Moving images between categories and editing their fields with UPDATEs
+- Deleting images and releasing their blobs with a few statements per batch
+- Moving every image out of a category before the category is deleted
+- Keeping the category and subcategory counters and the prompt index in
+  step with both
+- Removing blobs left without references and the files of deleted legacy
+  images in background jobs
+"""
+
+from flask import current_app
+from sqlalchemy import case
+
+from app.jobs import enqueue, job_handler
+from app.models import db, Blob, Image
+from app.prompt_index import record_prompt_changes
+from app.stats import image_groups, record_bulk_delete, record_bulk_update
+from app.storage_backends import LocalStorage
+
+# IDs per statement, well below the bound parameter limits of every database
+BATCH_SIZE = 500
+
+
+def _batches(values):
+    """Split a list into BATCH_SIZE slices."""
+    for offset in range(0, len(values), BATCH_SIZE):
+        yield values[offset:offset + BATCH_SIZE]
+
+
+def update_images(ids, changes):
+    """
+    Apply the same column values to many images.
+
+    Every batch of IDs is changed by one UPDATE; the search index triggers
+    still fire per row. Moves also update the category and subcategory
+    counters, from one grouped query per batch. Committing is left to the
+    caller.
+
+    Args:
+        ids (list): Image IDs
+        changes (dict): Column names mapped to their new values
+
+    Returns:
+        int: Number of images updated
+    """
+    moves = 'category_id' in changes or 'subcategory_id' in changes
+    updated = 0
+    for batch in _batches(ids):
+        groups = image_groups(Image.id.in_(batch)) if moves else None
+        updated += Image.query.filter(Image.id.in_(batch)).update(changes, synchronize_session=False)
+        if groups:
+            record_bulk_update(groups, changes)
+        if 'prompt' in changes:
+            record_prompt_changes(dict.fromkeys(batch, changes['prompt']))
+    return updated
+
+
+def move_category_images(category_id, subcategory):
+    """
+    Move every image of a category into a subcategory of another category.
+
+    Args:
+        category_id (int): Category whose images are moved
+        subcategory (Subcategory): Destination subcategory
+
+    Returns:
+        int: Number of images moved
+    """
+    changes = {'category_id': subcategory.category_id, 'subcategory_id': subcategory.id}
+    groups = image_groups(Image.category_id == category_id)
+    moved = Image.query.filter(Image.category_id == category_id).update(changes, synchronize_session=False)
+    record_bulk_update(groups, changes)
+    return moved
+
+
+def delete_images(ids):
+    """
+    Delete many images and release the blobs they reference.
+
+    For every batch of IDs the references per blob are counted by one
+    grouped query, the images removed by one DELETE and the blob reference
+    counts decremented by one UPDATE. The category and subcategory counters
+    are adjusted from a second grouped query. Blobs left without references
+    and the files of legacy images are removed later by delete_blobs and
+    delete_files jobs, which are committed in the same transaction as the
+    deletes. Committing is left to the caller.
+
+    Args:
+        ids (list): Image IDs
+
+    Returns:
+        int: Number of images deleted
+    """
+    deleted = 0
+    files = []
+    orphan_ids = []
+    for batch in _batches(ids):
+        references = dict(db.session.query(Image.blob_id, db.func.count(Image.id))
+                          .filter(Image.id.in_(batch), Image.blob_id.isnot(None))
+                          .group_by(Image.blob_id))
+        # Uploads from before content-addressed storage own their file
+        files += [filename for (filename,) in db.session.query(Image.filename)
+                  .filter(Image.id.in_(batch), Image.blob_id.is_(None))]
+        groups = image_groups(Image.id.in_(batch))
+        deleted += Image.query.filter(Image.id.in_(batch)).delete(synchronize_session=False)
+        if groups:
+            record_bulk_delete(groups)
+        record_prompt_changes(dict.fromkeys(batch))
+        if not references:
+            continue
+
+        blob_ids = list(references)
+        Blob.query.filter(Blob.id.in_(blob_ids)).update(
+            {'refcount': Blob.refcount - case(references, value=Blob.id)}, synchronize_session=False)
+        orphan_ids += [blob_id for (blob_id,) in db.session.query(Blob.id)
+                       .filter(Blob.id.in_(blob_ids), Blob.refcount <= 0)]
+
+    # Removed by delete_blobs_job in app.storage, which rechecks every blob
+    # under a row lock so a re-upload of the same contents keeps its file
+    for batch in _batches(orphan_ids):
+        enqueue('delete_blobs', blob_ids=batch)
+    for batch in _batches(files):
+        enqueue('delete_files', files=[['legacy', filename] for filename in batch])
+    return deleted
+
+
+@job_handler('delete_files')
+def delete_files_job(job):
+    """
+    Remove the files of deleted legacy images.
+
+    Every file is checked right before it is deleted; files that a legacy
+    image with the same filename still uses are kept.
+
+    Args:
+        job (Job): The delete_files job
+    """
+    store = LocalStorage(current_app.config['UPLOAD_FOLDER'])
+    for _, filename in job.data['files']:
+        in_use = db.session.query(Image.query.filter(
+            Image.filename == filename, Image.blob_id.is_(None)).exists()).scalar()
+        if not in_use:
+            store.delete(filename)
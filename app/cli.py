@@ -0,0 +1,208 @@
+"""
+Command Line Interface Module for the Image Storage Application.
+
+This module defines the `flask` CLI commands registered by the application
+factory. It provides:
+- Rendition maintenance commands
+- Storage maintenance commands
+- Image import commands
+- Background job commands
+- Seeding of the default categories
+"""
+
+import signal
+
+import click
+from flask import current_app
+from flask.cli import AppGroup, with_appcontext
+
+renditions_cli = AppGroup('renditions', help='Manage generated image renditions.')
+storage_cli = AppGroup('storage', help='Manage content-addressed file storage.')
+images_cli = AppGroup('images', help='Bulk image operations.')
+jobs_cli = AppGroup('jobs', help='Run and inspect background jobs.')
+
+
+@renditions_cli.command('backfill')
+@click.option('--workers', type=int, default=None, help='Worker processes (defaults to CPU count).')
+@click.option('--force', is_flag=True, help='Regenerate existing renditions as well.')
+def backfill_renditions_command(workers, force):
+    """Generate missing thumbnail and preview renditions."""
+    from app.renditions import backfill_renditions
+
+    processed, failed = backfill_renditions(workers=workers, force=force, echo=click.echo)
+    click.echo(f'Generated renditions for {processed} files ({failed} failed).')
+
+
+@storage_cli.command('migrate')
+def migrate_storage_command():
+    """Move files stored under their original name into content storage."""
+    from app.storage import migrate_legacy_images
+
+    migrated, missing = migrate_legacy_images(echo=click.echo)
+    click.echo(f'Migrated {migrated} images ({missing} files missing).')
+    if migrated:
+        click.echo("Run 'flask renditions backfill' to generate their renditions.")
+        click.echo("The original files are removed by jobs in the web server's job workers, "
+                   "or now with 'flask jobs work --burst'.")
+
+
+@storage_cli.command('purge-uploads')
+@click.option('--max-age', type=int, default=None, help='Age in seconds (defaults to UPLOAD_SESSION_TTL).')
+def purge_uploads_command(max_age):
+    """Delete chunked uploads that were abandoned."""
+    from app.uploads import purge_stale_uploads
+
+    purged = purge_stale_uploads(max_age)
+    click.echo(f'Purged {purged} stale uploads.')
+
+
+@images_cli.command('import')
+@click.argument('directory', type=click.Path(exists=True, file_okay=False))
+@click.option('--workers', type=int, default=None, help='Worker processes (defaults to CPU count).')
+@click.option('--batch-size', type=int, default=500, show_default=True, help='Files per database transaction.')
+def import_images_command(directory, workers, batch_size):
+    """
+    Import all images below DIRECTORY.
+
+    Top-level folders become categories and their subfolders subcategories.
+    Interrupted imports can be re-run; files already imported are skipped.
+    """
+    from app.importer import import_directory
+
+    stats = import_directory(directory, workers=workers, batch_size=batch_size, echo=click.echo)
+    seconds = stats['seconds'] or 1e-9
+    click.echo(
+        f"Imported {stats['imported']} images ({stats['duplicates']} duplicates, "
+        f"{stats['skipped']} previously imported, {stats['failed']} failed) in {stats['seconds']:.1f}s: "
+        f"{(stats['imported'] + stats['duplicates']) / seconds:.1f} files/s, "
+        f"{stats['bytes'] / seconds / 1024 / 1024:.1f} MB/s."
+    )
+
+
+@images_cli.command('backfill-metadata')
+@click.option('--batch-size', type=int, default=200, show_default=True, help='Images per job.')
+def backfill_metadata_command(batch_size):
+    """Queue metadata extraction for images stored without it."""
+    from app.metadata import queue_metadata_backfill
+
+    images, jobs = queue_metadata_backfill(batch_size)
+    click.echo(f'Queued {jobs} jobs for {images} images.')
+    if jobs:
+        click.echo("They run in the web server's job workers, or now with 'flask jobs work --burst'.")
+
+
+@images_cli.command('backfill-hashes')
+@click.option('--batch-size', type=int, default=200, show_default=True, help='Images per job.')
+def backfill_hashes_command(batch_size):
+    """Queue perceptual hashing for images stored without a hash."""
+    from app.similarity import queue_hash_backfill
+
+    images, jobs = queue_hash_backfill(batch_size)
+    click.echo(f'Queued {jobs} jobs for {images} images.')
+    if jobs:
+        click.echo("They run in the web server's job workers, or now with 'flask jobs work --burst'.")
+
+
+@images_cli.command('cluster-duplicates')
+@click.option('--max-distance', type=int, default=None,
+              help='Largest hash distance counted as a duplicate (defaults to DUPLICATE_MAX_DISTANCE).')
+def cluster_duplicates_command(max_distance):
+    """Group near-duplicate images by perceptual hash."""
+    from app.similarity import cluster_duplicates
+
+    groups, images = cluster_duplicates(max_distance, echo=click.echo)
+    click.echo(f'Found {groups} groups of near-duplicates covering {images} images.')
+
+
+@images_cli.command('reconcile-stats')
+def reconcile_stats_command():
+    """Queue a repair of the category and subcategory image counters."""
+    from app.jobs import enqueue
+    from app.models import db
+
+    enqueue('reconcile_stats')
+    db.session.commit()
+    click.echo('Queued a reconcile_stats job.')
+    click.echo("It runs in the web server's job workers, or now with 'flask jobs work --burst'.")
+
+
+@images_cli.command('rebuild-prompt-index')
+def rebuild_prompt_index_command():
+    """Rebuild this host's prompt similarity index from the database."""
+    from app.prompt_index import rebuild_prompt_index
+
+    indexed = rebuild_prompt_index()
+    click.echo(f'Indexed {indexed} prompts.')
+
+
+@jobs_cli.command('work')
+@click.option('--threads', type=int, default=None, help='Worker threads (defaults to JOB_WORKER_THREADS).')
+@click.option('--burst', is_flag=True, help='Exit once no job is due instead of waiting for more.')
+def work_jobs_command(threads, burst):
+    """Run background jobs until interrupted."""
+    from app.jobs import WorkerPool
+
+    app = current_app._get_current_object()
+    pool = WorkerPool(app, threads or app.config['JOB_WORKER_THREADS'], burst=burst)
+    # Finish the jobs in progress on SIGTERM, like Ctrl+C
+    signal.signal(signal.SIGTERM, lambda *_: pool.stop(0))
+    pool.start()
+    click.echo(f'Worker {pool.name} running {pool.threads} threads.')
+    try:
+        pool.join()
+    except KeyboardInterrupt:
+        click.echo('Finishing jobs in progress...')
+        pool.stop()
+    click.echo(f'Processed {pool.processed} jobs.')
+
+
+@jobs_cli.command('status')
+def job_status_command():
+    """Show the number of jobs in each state."""
+    from app.jobs import job_counts
+
+    counts = job_counts()
+    for status in ('queued', 'running', 'succeeded', 'failed'):
+        click.echo(f'{status:<10} {counts.get(status, 0)}')
+
+
+@jobs_cli.command('retry')
+@click.option('--kind', default=None, help='Only retry jobs of this kind.')
+def retry_jobs_command(kind):
+    """Queue failed jobs again."""
+    from app.jobs import retry_failed_jobs
+
+    click.echo(f'Requeued {retry_failed_jobs(kind)} failed jobs.')
+
+
+@jobs_cli.command('purge')
+@click.option('--max-age', type=int, default=None, help='Age in seconds (defaults to JOB_RETENTION).')
+def purge_jobs_command(max_age):
+    """Delete old succeeded jobs."""
+    from app.jobs import purge_finished_jobs
+
+    click.echo(f'Deleted {purge_finished_jobs(max_age)} finished jobs.')
+
+
+@click.command('seed')
+@with_appcontext
+def seed_command():
+    """Create the default categories and subcategories that are missing."""
+    from app.seed import seed_taxonomy
+
+    categories, subcategories = seed_taxonomy()
+    click.echo(f'Created {categories} categories and {subcategories} subcategories.')
+
+
+def register_commands(app):
+    """
+    Register all CLI command groups with the application.
+
+    Args:
+        app (Flask): Application to register the commands on
+    """
+    app.cli.add_command(renditions_cli)
+    app.cli.add_command(storage_cli)
+    app.cli.add_command(images_cli)
+    app.cli.add_command(jobs_cli)
+    app.cli.add_command(seed_command)
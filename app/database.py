@@ -0,0 +1,118 @@
+"""
+Database Engine Setup for the Image Storage Application.
+
+This module configures the SQLAlchemy engine for the deployment's database.
+It handles:
+- Connection pool sizing, pre-ping and recycling for server databases
+  (PostgreSQL, MySQL)
+- SQLite pragmas (WAL journal, synchronous mode, busy timeout, memory map)
+  applied to every new connection
+- Versioned schema migrations (Flask-Migrate/Alembic) in migrations/
+
+Sessions need no handling in views: Flask-SQLAlchemy removes the request's
+session when its application context is torn down, which rolls back any
+uncommitted work and returns the connection to the pool.
+"""
+
+import os
+from functools import partial
+
+from flask_migrate import Migrate
+from sqlalchemy import event
+from sqlalchemy.engine import make_url
+
+from app.models import db
+
+MIGRATIONS_FOLDER = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), 'migrations')
+
+
+
+def _include_object(obj, name, type_, reflected, compare_to):
+    """Keep the full-text index, which has no model, out of autogenerated migrations."""
+    if type_ == 'table':
+        return not name.startswith('image_fts')
+    if type_ in ('column', 'index'):
+        return name not in ('search_vector', 'ix_image_search_vector')
+    return True
+
+
+# Batch mode lets migrations alter SQLite tables, which lack most ALTER TABLE forms
+migrate = Migrate(directory=MIGRATIONS_FOLDER, render_as_batch=True, include_object=_include_object)
+
+
+def engine_options(config):
+    """
+    Build the engine options for the configured database URI.
+
+    Server databases get a sized pool whose connections are pinged before use
+    and recycled before server-side idle timeouts drop them. File-backed SQLite
+    gets a pool large enough for every server thread; in-memory SQLite keeps
+    Flask-SQLAlchemy's single shared connection. Entries already present in
+    SQLALCHEMY_ENGINE_OPTIONS take precedence.
+
+    Args:
+        config (Config): Application configuration
+
+    Returns:
+        dict: Keyword arguments for create_engine()
+    """
+    url = make_url(config['SQLALCHEMY_DATABASE_URI'])
+    options = {}
+
+    if url.get_backend_name() != 'sqlite':
+        options.update(
+            pool_size=config['DATABASE_POOL_SIZE'],
+            max_overflow=config['DATABASE_MAX_OVERFLOW'],
+            pool_timeout=config['DATABASE_POOL_TIMEOUT'],
+            pool_recycle=config['DATABASE_POOL_RECYCLE'],
+            pool_pre_ping=True
+        )
+    elif url.database and url.database != ':memory:':
+        options.update(
+            pool_size=config['DATABASE_POOL_SIZE'],
+            max_overflow=config['DATABASE_MAX_OVERFLOW'],
+            pool_timeout=config['DATABASE_POOL_TIMEOUT']
+        )
+
+    options.update(config.get('SQLALCHEMY_ENGINE_OPTIONS') or {})
+    return options
+
+
+def apply_sqlite_pragmas(pragmas, dbapi_connection, connection_record):
+    """
+    Apply the configured pragmas to a new SQLite connection.
+
+    Args:
+        pragmas (dict): Pragma name mapped to its value
+        dbapi_connection: Raw sqlite3 connection
+        connection_record: Pool record of the connection (unused)
+    """
+    cursor = dbapi_connection.cursor()
+    try:
+        for name, value in pragmas.items():
+            cursor.execute(f'PRAGMA {name}={value}')
+    finally:
+        cursor.close()
+
+
+def init_database(app):
+    """
+    Initialize Flask-SQLAlchemy with engines tuned for the configured database.
+
+    No connection is opened here; the schema is created and upgraded by
+    'flask db upgrade'.
+
+    Args:
+        app (Flask): Application to initialize
+    """
+    app.config['SQLALCHEMY_ENGINE_OPTIONS'] = engine_options(app.config)
+    db.init_app(app)
+    migrate.init_app(app, db)
+
+    pragmas = app.config.get('SQLITE_PRAGMAS') or {}
+    if pragmas:
+        with app.app_context():
+            engines = list(db.engines.values())
+        for engine in engines:
+            if engine.dialect.name == 'sqlite':
+                event.listen(engine, 'connect', partial(apply_sqlite_pragmas, pragmas))
@@ -0,0 +1,321 @@
+"""
+Export Module for the Image Storage Application.
+
+This module streams the original files of many images as one ZIP or tar
+archive. The archive is produced by a generator while it is downloaded, so
+memory use does not grow with the number or size of the images. It handles:
+- Selecting images by category, subcategory or the search page filters
+- Reading the matching rows in keyset batches, one short transaction each
+- Writing ZIP entries stored as-is for already-compressed formats and
+  deflated otherwise, or tar entries with their headers built up front
+- A manifest (CSV or JSON) with the name, description, prompt and upload
+  date of every exported file
+"""
+
+import csv
+import io
+import json
+import os
+import tarfile
+import tempfile
+import time
+import zipfile
+from datetime import datetime
+
+from flask import Blueprint, Response, abort, current_app, request, stream_with_context
+from werkzeug.datastructures import MultiDict
+from werkzeug.utils import secure_filename
+
+from app.forms import SearchForm
+from app.models import db, Blob, Category, Image, Subcategory
+from app.routes import search_filters
+from app.search import filter_images
+from app.storage_backends import LocalStorage, get_storage
+
+bp = Blueprint('export', __name__)
+
+# Rows fetched per query while the archive is written
+BATCH_SIZE = 500
+
+# Bytes read from a file per write; the response yields after every one
+CHUNK_SIZE = 64 * 1024
+
+# Formats that are compressed already; deflating them again costs CPU for nothing
+STORED_EXTENSIONS = {'jpg', 'jpeg', 'png', 'gif', 'webp', 'avif', 'heic', 'heif'}
+
+MANIFEST_FIELDS = ('file', 'name', 'description', 'prompt', 'upload_date', 'category', 'subcategory')
+
+# The manifest is kept in memory up to this size, then spooled to disk
+MANIFEST_SPOOL_SIZE = 1024 * 1024
+
+
+class _Pipe:
+    """Write-only file object whose contents are drained by the response generator."""
+
+    def __init__(self):
+        self._chunks = []
+
+    def write(self, data):
+        self._chunks.append(bytes(data))
+        return len(data)
+
+    def flush(self):
+        pass
+
+    def drain(self):
+        """Return and forget everything written since the last drain."""
+        data = b''.join(self._chunks)
+        self._chunks.clear()
+        return data
+
+
+def export_rows(filters):
+    """
+    Yield the images matching search filters in batches of BATCH_SIZE.
+
+    Only the columns the archive needs are selected, and every batch is
+    read in its own transaction, so a long download neither holds ORM
+    objects nor keeps a read transaction open.
+
+    Args:
+        filters (dict): Keyword arguments for filter_images()
+
+    Yields:
+        Row: Image columns with the blob key parts and taxonomy names
+    """
+    query = db.session.query(
+        Image.id, Image.name, Image.description, Image.prompt, Image.upload_date, Image.filename,
+        Blob.sha256, Blob.extension,
+        Category.name.label('category'), Subcategory.name.label('subcategory')
+    ).select_from(Image) \
+        .outerjoin(Blob, Image.blob_id == Blob.id) \
+        .join(Category, Image.category_id == Category.id) \
+        .join(Subcategory, Image.subcategory_id == Subcategory.id)
+    query, _ = filter_images(query, **filters)
+
+    last_id = 0
+    while True:
+        rows = query.filter(Image.id > last_id).order_by(Image.id).limit(BATCH_SIZE).all()
+        db.session.commit()
+        if not rows:
+            return
+        yield from rows
+        last_id = rows[-1].id
+
+
+def archive_path(row):
+    """Return the path of an image inside the archive: category/subcategory/id-filename."""
+    parts = [secure_filename(row.category) or 'category', secure_filename(row.subcategory) or 'subcategory',
+             f'{row.id}-{secure_filename(row.filename) or "image"}']
+    return '/'.join(parts)
+
+
+def _open_file(row):
+    """Return a context manager yielding a local path of an image's file."""
+    if row.sha256 is not None:
+        return get_storage().local_path(Blob.key_for(row.sha256, row.extension))
+    return LocalStorage(current_app.config['UPLOAD_FOLDER']).local_path(row.filename)
+
+
+class _Manifest:
+    """
+    Manifest rows collected while the images are written.
+
+    Attributes:
+        kind (str): 'csv' or 'json'
+        filename (str): Name of the manifest inside the archive
+    """
+
+    def __init__(self, kind):
+        self.kind = kind
+        self.filename = f'manifest.{kind}'
+        self._file = tempfile.SpooledTemporaryFile(max_size=MANIFEST_SPOOL_SIZE)
+        self._rows = 0
+        if kind == 'csv':
+            self._write_csv(MANIFEST_FIELDS)
+        else:
+            self._file.write(b'[')
+
+    def _write_csv(self, values):
+        line = io.StringIO()
+        csv.writer(line).writerow(values)
+        self._file.write(line.getvalue().encode('utf-8'))
+
+    def add(self, path, row):
+        """Record an exported file."""
+        values = (path, row.name, row.description or '', row.prompt or '',
+                  row.upload_date.isoformat() if row.upload_date else '', row.category, row.subcategory)
+        if self.kind == 'csv':
+            self._write_csv(values)
+        else:
+            prefix = b',\n' if self._rows else b'\n'
+            self._file.write(prefix + json.dumps(dict(zip(MANIFEST_FIELDS, values))).encode('utf-8'))
+        self._rows += 1
+
+    def finish(self):
+        """
+        Complete the manifest and rewind it for reading.
+
+        Returns:
+            tuple: (file object positioned at the start, size in bytes)
+        """
+        if self.kind == 'json':
+            self._file.write(b'\n]\n')
+        size = self._file.tell()
+        self._file.seek(0)
+        return self._file, size
+
+    def close(self):
+        self._file.close()
+
+
+def _read_chunks(file):
+    while True:
+        chunk = file.read(CHUNK_SIZE)
+        if not chunk:
+            return
+        yield chunk
+
+
+def _zip_info(path, modified, compress):
+    # ZIP timestamps cannot predate 1980
+    date_time = max(modified or datetime.utcnow(), datetime(1980, 1, 1)).timetuple()[:6]
+    info = zipfile.ZipInfo(path, date_time=date_time)
+    info.compress_type = zipfile.ZIP_DEFLATED if compress else zipfile.ZIP_STORED
+    info.external_attr = 0o644 << 16
+    return info
+
+
+def stream_zip(rows, manifest):
+    """
+    Generate a ZIP archive of the images in `rows` followed by the manifest.
+
+    The archive is written to a non-seekable pipe, so sizes and checksums
+    follow each entry in a data descriptor. ZIP64 is enabled for every
+    entry because sizes are not known up front. Only the central directory,
+    a small record per entry, is held until the end.
+
+    Args:
+        rows (iterable): Rows from export_rows()
+        manifest (_Manifest): Manifest to fill and append
+
+    Yields:
+        bytes: Archive data
+    """
+    pipe = _Pipe()
+    with zipfile.ZipFile(pipe, 'w') as archive:
+        for row in rows:
+            path = archive_path(row)
+            extension = (row.extension or row.filename.rsplit('.', 1)[-1]).lower()
+            info = _zip_info(path, row.upload_date, extension not in STORED_EXTENSIONS)
+            try:
+                with _open_file(row) as local_path, open(local_path, 'rb') as source:
+                    with archive.open(info, 'w', force_zip64=True) as entry:
+                        for chunk in _read_chunks(source):
+                            entry.write(chunk)
+                            yield pipe.drain()
+            except FileNotFoundError:
+                current_app.logger.warning('Export skipped image %d: file %s is missing', row.id, path)
+                continue
+            manifest.add(path, row)
+            yield pipe.drain()
+
+        source, _ = manifest.finish()
+        with archive.open(_zip_info(manifest.filename, datetime.utcnow(), True), 'w') as entry:
+            for chunk in _read_chunks(source):
+                entry.write(chunk)
+                yield pipe.drain()
+    yield pipe.drain()
+
+
+def _tar_header(path, size, modified):
+    info = tarfile.TarInfo(path)
+    info.size = size
+    info.mode = 0o644
+    info.mtime = time.mktime((modified or datetime.utcnow()).timetuple())
+    return info.tobuf(tarfile.PAX_FORMAT, 'utf-8', 'surrogateescape')
+
+
+def _tar_padding(size):
+    return b'\0' * (-size % tarfile.BLOCKSIZE)
+
+
+def stream_tar(rows, manifest):
+    """
+    Generate an uncompressed tar archive of the images in `rows` followed by the manifest.
+
+    Headers are built from the file sizes before each file is copied, so
+    nothing but the current chunk is held in memory.
+
+    Args:
+        rows (iterable): Rows from export_rows()
+        manifest (_Manifest): Manifest to fill and append
+
+    Yields:
+        bytes: Archive data
+    """
+    for row in rows:
+        path = archive_path(row)
+        try:
+            with _open_file(row) as local_path, open(local_path, 'rb') as source:
+                # Stored files never change, so the size read here is the size copied
+                size = os.fstat(source.fileno()).st_size
+                yield _tar_header(path, size, row.upload_date)
+                yield from _read_chunks(source)
+                yield _tar_padding(size)
+        except FileNotFoundError:
+            current_app.logger.warning('Export skipped image %d: file %s is missing', row.id, path)
+            continue
+        manifest.add(path, row)
+
+    source, size = manifest.finish()
+    yield _tar_header(manifest.filename, size, datetime.utcnow())
+    yield from _read_chunks(source)
+    yield _tar_padding(size)
+    # End-of-archive marker: two empty blocks
+    yield b'\0' * (2 * tarfile.BLOCKSIZE)
+
+
+ARCHIVES = {
+    'zip': (stream_zip, 'application/zip'),
+    'tar': (stream_tar, 'application/x-tar'),
+}
+
+
+@bp.route('/export', methods=['GET'])
+def export_images():
+    """
+    Download the original files of matching images as one archive.
+
+    Query parameters: the search page filters (`search_query`, `category`,
+    `subcategory`, `image_format`, `min_width`, ...), `archive` ('zip' or
+    'tar', default 'zip') and `manifest` ('csv' or 'json', default 'csv').
+    Without filters every image is exported.
+
+    Returns:
+        Response: Streamed archive download
+    """
+    archive = request.args.get('archive', 'zip')
+    manifest_kind = request.args.get('manifest', 'csv')
+    if archive not in ARCHIVES or manifest_kind not in ('csv', 'json'):
+        abort(400)
+
+    form = SearchForm(MultiDict(request.args), meta={'csrf': False})
+    filters = search_filters(form)
+    generate, mimetype = ARCHIVES[archive]
+
+    def body():
+        manifest = _Manifest(manifest_kind)
+        try:
+            for data in generate(export_rows(filters), manifest):
+                if data:
+                    yield data
+        finally:
+            manifest.close()
+
+    filename = f'images-{datetime.utcnow():%Y%m%d-%H%M%S}.{archive}'
+    response = Response(stream_with_context(body()), mimetype=mimetype)
+    response.headers['Content-Disposition'] = f'attachment; filename="{filename}"'
+    response.headers['X-Accel-Buffering'] = 'no'
+    response.cache_control.no_store = True
+    return response
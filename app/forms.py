@@ -1,24 +1,14 @@
 from flask_wtf import FlaskForm
 from flask_wtf.file import FileField, FileAllowed, FileRequired
-from wtforms import StringField, TextAreaField, SelectField, SubmitField, ValidationError
-from wtforms.validators import DataRequired, Length
-import os
-from flask import current_app
-from werkzeug.utils import secure_filename
-from .models import Image
+from wtforms import StringField, TextAreaField, SelectField, SubmitField, IntegerField, FloatField
+from wtforms.validators import DataRequired, Length, Optional, NumberRange
 
-def validate_unique_file(form, field):
-    if field.data:
-        filename = secure_filename(field.data.filename)
-        filepath = os.path.join(current_app.config['UPLOAD_FOLDER'], filename)
-        
-        # Check filesystem
-        if os.path.exists(filepath):
-            raise ValidationError('A file with this name already exists. Please rename your file.')
-        
-        # Check database
-        if Image.query.filter_by(filename=filename).first():
-            raise ValidationError('This image has already been uploaded. Please choose a different file.')
+FORMAT_CHOICES = [('', 'Any Format'), ('png', 'PNG'), ('jpeg', 'JPEG'), ('gif', 'GIF'),
+                  ('webp', 'WebP'), ('svg', 'SVG')]
+COLOR_MODE_CHOICES = [('', 'Any Color Mode'), ('RGB', 'RGB'), ('RGBA', 'RGBA (transparent)'),
+                      ('L', 'Grayscale'), ('P', 'Palette'), ('CMYK', 'CMYK')]
+ORIENTATION_CHOICES = [('', 'Any Orientation'), ('landscape', 'Landscape'),
+                       ('portrait', 'Portrait'), ('square', 'Square')]
 
 class ImageUploadForm(FlaskForm):
     name = StringField('Image Name', validators=[
@@ -36,8 +26,7 @@ class ImageUploadForm(FlaskForm):
     image = FileField('Upload Image', validators=[
         FileRequired(),
         FileAllowed(['jpg', 'png', 'jpeg', 'gif', 'webp', 'svg'], 
-                    'Only image files (jpg, png, jpeg, gif, webp, svg) are allowed!'),
-        validate_unique_file
+                    'Only image files (jpg, png, jpeg, gif, webp, svg) are allowed!')
     ])
     submit = SubmitField('Upload Image')
 
@@ -60,8 +49,17 @@ class SearchForm(FlaskForm):
     search_query = StringField('Search Images', validators=[
         Length(max=200, message='Search query cannot exceed 200 characters')
     ])
-    category = SelectField('Category', coerce=int)
-    subcategory = SelectField('Subcategory', coerce=int)
+    category = SelectField('Category', coerce=int, default=0)
+    subcategory = SelectField('Subcategory', coerce=int, default=0)
+    image_format = SelectField('Format', choices=FORMAT_CHOICES, default='')
+    color_mode = SelectField('Color Mode', choices=COLOR_MODE_CHOICES, default='')
+    orientation = SelectField('Orientation', choices=ORIENTATION_CHOICES, default='')
+    min_width = IntegerField('Min Width (px)', validators=[Optional(), NumberRange(min=1)])
+    max_width = IntegerField('Max Width (px)', validators=[Optional(), NumberRange(min=1)])
+    min_height = IntegerField('Min Height (px)', validators=[Optional(), NumberRange(min=1)])
+    max_height = IntegerField('Max Height (px)', validators=[Optional(), NumberRange(min=1)])
+    min_size = FloatField('Min File Size (MB)', validators=[Optional(), NumberRange(min=0)])
+    max_size = FloatField('Max File Size (MB)', validators=[Optional(), NumberRange(min=0)])
     submit = SubmitField('Search')
 
 class CategoryForm(FlaskForm):
@@ -0,0 +1,316 @@
+"""
+Bulk Import Module for the Image Storage Application.
+
+This module ingests whole directory trees of images, mapping the folder
+layout `<root>/<Category>/<Subcategory>/...` onto the category taxonomy.
+It handles:
+- Scanning a directory for importable files
+- Hashing, validating, storing, rendering and reading metadata of files
+  across a process pool; SVGs are stored sanitized
+- Inserting Image rows in batched transactions
+- Skipping files recorded by an earlier (possibly interrupted) run
+"""
+
+import itertools
+import os
+import tempfile
+import time
+from collections import Counter
+from concurrent.futures import ProcessPoolExecutor
+
+from flask import current_app
+from PIL import Image as PILImage
+from werkzeug.utils import secure_filename
+
+from app.metadata import extract_metadata
+from app.models import db, Blob, Category, Subcategory, Image, ImportedFile
+from app.renditions import (is_raster, record_renditions, rendition_filename, staging_folder,
+                            store_renditions)
+from app.similarity import image_hash, to_signed
+from app.storage import file_extension, hash_file, rewrite_file
+from app.storage_backends import storage_from_settings
+from app.validation import UploadValidator, validation_limits
+
+# Taxonomy used for files that sit above the category/subcategory folders
+DEFAULT_CATEGORY = 'Imported'
+DEFAULT_SUBCATEGORY = 'General'
+
+
+def scan_directory(root, allowed_extensions):
+    """
+    Find importable files below a directory.
+
+    Args:
+        root (str): Directory to scan
+        allowed_extensions (set): File extensions to import
+
+    Yields:
+        tuple: (path, category name, subcategory name, size, mtime)
+    """
+    root = os.path.abspath(root)
+    for dirpath, dirnames, filenames in os.walk(root):
+        # Skip hidden folders and walk in a stable order
+        dirnames[:] = sorted(d for d in dirnames if not d.startswith('.'))
+
+        relative = os.path.relpath(dirpath, root)
+        parts = [] if relative == '.' else relative.split(os.sep)
+        category = parts[0] if parts else DEFAULT_CATEGORY
+        subcategory = parts[1] if len(parts) > 1 else DEFAULT_SUBCATEGORY
+
+        for name in sorted(filenames):
+            if name.startswith('.') or file_extension(name) not in allowed_extensions:
+                continue
+            path = os.path.join(dirpath, name)
+            stat = os.stat(path)
+            yield path, category[:100], subcategory[:100], stat.st_size, stat.st_mtime
+
+
+def process_file(path, options):
+    """
+    Hash, validate, store, render and read the metadata of one file.
+
+    Runs in a worker process and builds its own storage backends from plain
+    settings. Files are validated as uploads are and stored under the
+    extension of their actual format; a sanitized copy of an SVG is written
+    to the staging folder and stored instead of the file itself. Files and
+    renditions that are already stored (e.g. from an interrupted run) are
+    reused.
+
+    Args:
+        path (str): File to process
+        options (tuple): (originals settings, renditions settings, rendition
+            sizes, quality, staging folder, validation limits)
+
+    Returns:
+        dict: sha256, size, extension, renditions and metadata, or an error message
+    """
+    originals, renditions_settings, sizes, quality, staging, limits = options
+    sanitized = None
+    try:
+        validator = UploadValidator(file_extension(path), limits)
+        sha256, size = hash_file(path, validator.feed)
+        info = validator.finish()
+        extension = info.extension
+        if info.document is not None:
+            with tempfile.NamedTemporaryFile(dir=staging, suffix='.svg', delete=False) as tmp:
+                sanitized = tmp.name
+            sha256, size = rewrite_file(sanitized, info.document)
+            path = sanitized
+
+        storage_key = Blob.key_for(sha256, extension)
+        store = storage_from_settings(originals)
+        if not store.exists(storage_key):
+            store.put_file(path, storage_key, move=False)
+
+        # The source file has the same contents as the stored one
+        metadata = extract_metadata(path, extension)
+        renditions = []
+        if is_raster(extension):
+            metadata['perceptual_hash'] = to_signed(image_hash(path))
+            rendition_store = storage_from_settings(renditions_settings)
+            missing = [kind for kind in sizes
+                       if not rendition_store.exists(rendition_filename(storage_key, kind))]
+            if missing:
+                renditions = store_renditions(path, storage_key, missing, sizes, quality,
+                                              renditions_settings, staging)
+            # Renditions left by an earlier run only need their dimensions
+            for kind in sizes:
+                if kind not in missing:
+                    with rendition_store.local_path(rendition_filename(storage_key, kind)) as rendition_path:
+                        with PILImage.open(rendition_path) as img:
+                            renditions.append((kind, img.width, img.height))
+
+        return {'sha256': sha256, 'size': size, 'extension': extension, 'renditions': renditions,
+                'metadata': metadata, 'error': None}
+    except Exception as e:
+        return {'error': str(e)}
+    finally:
+        if sanitized is not None and os.path.exists(sanitized):
+            os.remove(sanitized)
+
+
+def _resolve_taxonomy(pairs):
+    """
+    Look up or create the categories and subcategories for imported folders.
+
+    Args:
+        pairs (set): (category name, subcategory name) tuples
+
+    Returns:
+        dict: (category name, subcategory name) mapped to (category_id, subcategory_id)
+    """
+    categories = {c.name: c for c in Category.query.filter(
+        Category.name.in_({category for category, _ in pairs}))}
+    for category_name, _ in pairs:
+        if category_name not in categories:
+            categories[category_name] = Category(name=category_name)
+            db.session.add(categories[category_name])
+    db.session.flush()
+
+    subcategories = {(s.category_id, s.name): s for s in Subcategory.query.filter(
+        Subcategory.category_id.in_([c.id for c in categories.values()]))}
+    taxonomy = {}
+    for category_name, subcategory_name in pairs:
+        category = categories[category_name]
+        subcategory = subcategories.get((category.id, subcategory_name))
+        if subcategory is None:
+            subcategory = Subcategory(name=subcategory_name, category_id=category.id)
+            subcategories[(category.id, subcategory_name)] = subcategory
+            db.session.add(subcategory)
+            db.session.flush()
+        taxonomy[(category_name, subcategory_name)] = (category.id, subcategory.id)
+    db.session.commit()
+    return taxonomy
+
+
+def _commit_batch(batch, taxonomy):
+    """
+    Insert the images for one batch of processed files in a single transaction.
+
+    Files whose contents already exist in the same subcategory are recorded
+    as imported without creating another Image.
+
+    Args:
+        batch (list): (scan entry, process_file result) tuples
+        taxonomy (dict): Mapping returned by _resolve_taxonomy
+
+    Returns:
+        tuple: (number of images created, number of duplicates skipped)
+    """
+    digests = {result['sha256'] for _, result in batch}
+    paths = [entry[0] for entry, _ in batch]
+    blobs = {b.sha256: b for b in Blob.query.options(db.selectinload(Blob.renditions))
+             .filter(Blob.sha256.in_(digests))}
+    ledger = {row.source_path: row for row in ImportedFile.query.filter(ImportedFile.source_path.in_(paths))}
+    existing = set(db.session.query(Blob.sha256, Image.subcategory_id).select_from(Image)
+                   .join(Blob, Image.blob_id == Blob.id).filter(Blob.sha256.in_(digests)))
+
+    references = Counter()
+    created = []
+    for (path, category, subcategory, size, mtime), result in batch:
+        category_id, subcategory_id = taxonomy[(category, subcategory)]
+        sha256 = result['sha256']
+
+        blob = blobs.get(sha256)
+        if blob is None:
+            blob = Blob(sha256=sha256, extension=result['extension'], size=result['size'], refcount=0)
+            db.session.add(blob)
+            blobs[sha256] = blob
+        if not blob.renditions:
+            record_renditions(blob, result['renditions'])
+
+        image = None
+        if (sha256, subcategory_id) not in existing:
+            filename = secure_filename(os.path.basename(path)) or f'{sha256}.{result["extension"]}'
+            name = os.path.splitext(os.path.basename(path))[0].replace('_', ' ').replace('-', ' ').strip()
+            image = Image(
+                name=(name or filename)[:200],
+                filename=filename[:300],
+                description='',
+                prompt='',
+                category_id=category_id,
+                subcategory_id=subcategory_id,
+                blob=blob,
+                **result['metadata']
+            )
+            db.session.add(image)
+            existing.add((sha256, subcategory_id))
+            references[sha256] += 1
+
+        record = ledger.get(path)
+        if record is None:
+            record = ImportedFile(source_path=path)
+            db.session.add(record)
+        record.size = size
+        record.mtime = mtime
+        created.append((record, image))
+
+    # Take all new references in one statement per blob
+    for sha256, count in references.items():
+        blob = blobs[sha256]
+        if blob.id is None:
+            blob.refcount = count
+        else:
+            blob.refcount = Blob.refcount + count
+
+    db.session.flush()
+    for record, image in created:
+        if image is not None:
+            record.image_id = image.id
+    db.session.commit()
+
+    images = sum(references.values())
+    return images, len(batch) - images
+
+
+def import_directory(root, workers=None, batch_size=500, echo=print):
+    """
+    Import every image below a directory.
+
+    Hashing, validation, copying into content storage and rendition
+    generation run in a process pool; rows are inserted `batch_size` at a
+    time. Re-running an import skips files that are already recorded with
+    the same size and modification time.
+
+    Args:
+        root (str): Directory to import
+        workers (int, optional): Number of worker processes (defaults to CPU count)
+        batch_size (int): Number of files per database transaction
+        echo (callable): Function used to report progress
+
+    Returns:
+        dict: Counts of imported, duplicate, skipped and failed files,
+            plus bytes processed and elapsed seconds
+    """
+    entries = list(scan_directory(root, current_app.config['ALLOWED_EXTENSIONS']))
+    done = {path: (size, mtime) for path, size, mtime in
+            db.session.query(ImportedFile.source_path, ImportedFile.size, ImportedFile.mtime)}
+    pending = [entry for entry in entries if done.get(entry[0]) != (entry[3], entry[4])]
+    stats = {'imported': 0, 'duplicates': 0, 'skipped': len(entries) - len(pending),
+             'failed': 0, 'bytes': 0, 'seconds': 0.0}
+    echo(f'Found {len(entries)} files, {stats["skipped"]} already imported.')
+    if not pending:
+        return stats
+
+    taxonomy = _resolve_taxonomy({(entry[1], entry[2]) for entry in pending})
+    settings = current_app.extensions['storage_settings']
+    options = (
+        settings['originals'],
+        settings['renditions'],
+        current_app.config['RENDITION_SIZES'],
+        current_app.config['RENDITION_QUALITY'],
+        staging_folder(),
+        validation_limits(),
+    )
+
+    started = time.perf_counter()
+    processed = 0
+    batch = []
+
+    def flush_batch():
+        images, duplicates = _commit_batch(batch, taxonomy)
+        stats['imported'] += images
+        stats['duplicates'] += duplicates
+        elapsed = time.perf_counter() - started
+        echo(f'{processed}/{len(pending)} files, {processed / elapsed:.1f} files/s, '
+             f'{stats["bytes"] / elapsed / 1024 / 1024:.1f} MB/s')
+        batch.clear()
+
+    with ProcessPoolExecutor(max_workers=workers) as pool:
+        results = pool.map(process_file, [entry[0] for entry in pending],
+                           itertools.repeat(options), chunksize=8)
+        for entry, result in zip(pending, results):
+            processed += 1
+            if result['error']:
+                stats['failed'] += 1
+                echo(f'Skipping {entry[0]}: {result["error"]}')
+                continue
+            stats['bytes'] += result['size']
+            batch.append((entry, result))
+            if len(batch) >= batch_size:
+                flush_batch()
+        if batch:
+            flush_batch()
+
+    stats['seconds'] = time.perf_counter() - started
+    return stats
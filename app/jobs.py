@@ -0,0 +1,409 @@
+"""
+Background Job Module for the Image Storage Application.
+
+Work too slow to run inside a request, such as rendering an upload's
+thumbnails, is recorded as a row in the job table and carried out by worker
+threads afterwards. Since jobs live in the database they survive restarts,
+and any number of worker processes can share the queue. It handles:
+- Registering job handlers by kind
+- Enqueueing jobs in the caller's transaction
+- Claiming due jobs atomically, so each job runs on exactly one worker
+- Retrying failed jobs with exponential backoff
+- Recording heartbeats of running jobs and requeueing those whose worker died
+- Running a pool of worker threads, standalone or inside the web process
+"""
+
+import atexit
+import json
+import os
+import socket
+import threading
+from contextlib import contextmanager
+from datetime import datetime, timedelta
+
+from flask import current_app
+from sqlalchemy import event
+
+from app.models import db, Job
+
+# Job kind mapped to the function that runs it
+HANDLERS = {}
+
+# Set when a commit enqueued jobs, so idle workers in this process start at once
+_wakeup = threading.Event()
+_start_lock = threading.Lock()
+
+
+def job_handler(kind):
+    """
+    Register a function as the handler for a job kind.
+
+    The handler is called with the Job inside an application context. Its
+    database changes are committed together with the job's success; raising
+    rolls them back and schedules a retry.
+
+    Args:
+        kind (str): Job kind the function handles
+
+    Returns:
+        callable: Decorator registering the function
+    """
+    def decorator(func):
+        HANDLERS[kind] = func
+        return func
+    return decorator
+
+
+def enqueue(kind, image_id=None, **payload):
+    """
+    Add a job to the session; it becomes visible to workers on commit.
+
+    Args:
+        kind (str): Registered job kind
+        image_id (int, optional): Image the job works on
+        **payload: JSON-serializable handler arguments
+
+    Returns:
+        Job: The new, uncommitted job
+    """
+    job = Job(kind=kind, image_id=image_id, payload=json.dumps(payload),
+              max_attempts=current_app.config['JOB_MAX_ATTEMPTS'])
+    db.session.add(job)
+    db.session.info['jobs_enqueued'] = True
+    return job
+
+
+def claim_job(worker_id):
+    """
+    Atomically claim the next due job.
+
+    Candidates are read without locks and then claimed with a conditional
+    UPDATE, so when two workers race for the same job only one of them
+    changes a row; the other moves on to the next candidate.
+
+    Args:
+        worker_id (str): Identifier recorded on the claimed job
+
+    Returns:
+        Job: The claimed job, now 'running', or None if nothing is due
+    """
+    now = datetime.utcnow()
+    candidates = db.session.query(Job.id) \
+        .filter(Job.status == 'queued', Job.run_after <= now) \
+        .order_by(Job.run_after, Job.id) \
+        .limit(10).all()
+    db.session.rollback()
+
+    for (job_id,) in candidates:
+        claimed = Job.query.filter(Job.id == job_id, Job.status == 'queued').update({
+            'status': 'running',
+            'locked_by': worker_id,
+            'locked_at': now,
+            'heartbeat_at': now,
+            'attempts': Job.attempts + 1
+        }, synchronize_session=False)
+        db.session.commit()
+        if claimed:
+            return db.session.get(Job, job_id)
+    return None
+
+
+def run_job(job):
+    """
+    Run a claimed job and record its outcome.
+
+    Args:
+        job (Job): Job returned by claim_job()
+
+    Returns:
+        bool: Whether the job succeeded
+    """
+    job_id, kind = job.id, job.kind
+    try:
+        handler = HANDLERS.get(kind)
+        if handler is None:
+            raise LookupError(f'No handler registered for job kind {kind!r}')
+        with _heartbeat(job_id, job.locked_by):
+            handler(job)
+
+        job.status = 'succeeded'
+        job.error = None
+        job.locked_by = None
+        job.finished_at = datetime.utcnow()
+        db.session.commit()
+        return True
+    except Exception as e:
+        db.session.rollback()
+        current_app.logger.warning('Job %s (%s) failed: %s', job_id, kind, e)
+        _record_failure(job_id, e)
+        return False
+
+
+@contextmanager
+def _heartbeat(job_id, worker_id):
+    """
+    Keep refreshing a running job's heartbeat until the block exits.
+
+    The heartbeat is written from a separate thread and session, so it keeps
+    going while the handler is busy and never commits the handler's changes.
+    """
+    app = current_app._get_current_object()
+    interval = app.config['JOB_HEARTBEAT_INTERVAL']
+    done = threading.Event()
+
+    def beat():
+        while not done.wait(interval):
+            try:
+                with app.app_context():
+                    Job.query.filter(Job.id == job_id, Job.status == 'running',
+                                     Job.locked_by == worker_id) \
+                        .update({'heartbeat_at': datetime.utcnow()}, synchronize_session=False)
+                    db.session.commit()
+            except Exception as e:
+                app.logger.warning('Heartbeat of job %s failed: %s', job_id, e)
+
+    thread = threading.Thread(target=beat, name=f'job-heartbeat-{job_id}', daemon=True)
+    thread.start()
+    try:
+        yield
+    finally:
+        done.set()
+        thread.join()
+
+
+def _record_failure(job_id, error):
+    """Schedule a retry with exponential backoff, or mark the job failed."""
+    job = db.session.get(Job, job_id)
+    now = datetime.utcnow()
+    job.error = f'{type(error).__name__}: {error}'
+    job.locked_by = None
+    if job.attempts >= job.max_attempts:
+        job.status = 'failed'
+        job.finished_at = now
+    else:
+        delay = current_app.config['JOB_RETRY_BACKOFF'] * 2 ** (job.attempts - 1)
+        job.status = 'queued'
+        job.run_after = now + timedelta(seconds=delay)
+    db.session.commit()
+
+
+def requeue_stale_jobs(timeout=None):
+    """
+    Return jobs whose worker disappeared mid-run to the queue.
+
+    Workers refresh the heartbeat of the jobs they run, so a job still
+    'running' without a heartbeat for `timeout` seconds is assumed abandoned
+    by a worker that crashed or was killed, however long it has been
+    running. It is retried unless it has used up its attempts.
+
+    Args:
+        timeout (float, optional): Seconds without a heartbeat, defaults to JOB_TIMEOUT
+
+    Returns:
+        int: Number of jobs requeued or failed
+    """
+    timeout = timeout or current_app.config['JOB_TIMEOUT']
+    now = datetime.utcnow()
+    last_seen = db.func.coalesce(Job.heartbeat_at, Job.locked_at)
+    stale = Job.query.filter(Job.status == 'running',
+                             last_seen < now - timedelta(seconds=timeout))
+
+    failed = stale.filter(Job.attempts >= Job.max_attempts).update({
+        'status': 'failed',
+        'error': 'Worker stopped while running the job',
+        'locked_by': None,
+        'finished_at': now
+    }, synchronize_session=False)
+    requeued = stale.update({
+        'status': 'queued',
+        'locked_by': None,
+        'run_after': now
+    }, synchronize_session=False)
+    db.session.commit()
+    return failed + requeued
+
+
+def retry_failed_jobs(kind=None):
+    """
+    Queue failed jobs again with a fresh set of attempts.
+
+    Args:
+        kind (str, optional): Only retry jobs of this kind
+
+    Returns:
+        int: Number of jobs requeued
+    """
+    query = Job.query.filter(Job.status == 'failed')
+    if kind:
+        query = query.filter(Job.kind == kind)
+    count = query.update({
+        'status': 'queued',
+        'attempts': 0,
+        'run_after': datetime.utcnow(),
+        'finished_at': None
+    }, synchronize_session=False)
+    db.session.commit()
+    return count
+
+
+def purge_finished_jobs(max_age=None):
+    """
+    Delete succeeded jobs older than `max_age` seconds.
+
+    Failed jobs are kept so they can be inspected and retried.
+
+    Args:
+        max_age (int, optional): Age in seconds, defaults to JOB_RETENTION
+
+    Returns:
+        int: Number of jobs deleted
+    """
+    max_age = max_age or current_app.config['JOB_RETENTION']
+    cutoff = datetime.utcnow() - timedelta(seconds=max_age)
+    count = Job.query.filter(Job.status == 'succeeded', Job.finished_at < cutoff) \
+        .delete(synchronize_session=False)
+    db.session.commit()
+    return count
+
+
+def latest_job(image_id, kind):
+    """
+    Return the most recent job of a kind for an image.
+
+    Args:
+        image_id (int): ID of the image
+        kind (str): Job kind
+
+    Returns:
+        Job: Latest matching job, or None
+    """
+    return Job.query.filter_by(image_id=image_id, kind=kind).order_by(Job.id.desc()).first()
+
+
+def job_counts():
+    """
+    Count jobs by status.
+
+    Returns:
+        dict: Status mapped to the number of jobs in it
+    """
+    return dict(db.session.query(Job.status, db.func.count(Job.id)).group_by(Job.status).all())
+
+
+class WorkerPool:
+    """
+    Threads that claim and run due jobs until stopped.
+
+    Handlers mostly wait on Pillow and disk I/O, which release the GIL, so a
+    few threads per process keep several cores busy. Run more worker
+    processes to scale further.
+
+    Attributes:
+        app (Flask): Application whose context the threads run in
+        threads (int): Number of worker threads
+        burst (bool): Exit once no job is due instead of polling forever
+    """
+
+    def __init__(self, app, threads, burst=False):
+        self.app = app
+        self.threads = threads
+        self.burst = burst
+        self.name = f'{socket.gethostname()}:{os.getpid()}'
+        self.processed = 0
+        self._stop = threading.Event()
+        self._workers = []
+        self._lock = threading.Lock()
+
+    def start(self):
+        """Start the worker threads."""
+        with self.app.app_context():
+            requeue_stale_jobs()
+        for index in range(self.threads):
+            thread = threading.Thread(target=self._work, args=(f'{self.name}/{index}',),
+                                      name=f'job-worker-{index}', daemon=True)
+            thread.start()
+            self._workers.append(thread)
+
+    def join(self):
+        """Wait for the worker threads to exit."""
+        for thread in self._workers:
+            thread.join()
+
+    def stop(self, timeout=None):
+        """
+        Ask the threads to exit after their current job and wait for them.
+
+        Args:
+            timeout (float, optional): Seconds to wait for each thread
+        """
+        self._stop.set()
+        _wakeup.set()
+        for thread in self._workers:
+            thread.join(timeout)
+
+    def _work(self, worker_id):
+        poll_interval = self.app.config['JOB_POLL_INTERVAL']
+        stale_check_every = max(1, int(60 / poll_interval))
+        idle_polls = 0
+        while not self._stop.is_set():
+            try:
+                with self.app.app_context():
+                    job = claim_job(worker_id)
+                    if job is not None:
+                        run_job(job)
+                        with self._lock:
+                            self.processed += 1
+                        continue
+                    idle_polls += 1
+                    if idle_polls % stale_check_every == 0:
+                        requeue_stale_jobs()
+            except Exception as e:
+                # Keep the thread alive through database outages
+                self.app.logger.error('Job worker %s error: %s', worker_id, e)
+
+            if self.burst:
+                return
+            _wakeup.wait(poll_interval)
+            _wakeup.clear()
+
+
+def init_job_queue(app):
+    """
+    Set up in-process job workers for the application.
+
+    With JOB_RUN_IN_APP enabled, every web process starts JOB_WORKER_THREADS
+    worker threads on its first request. This happens after any fork, so
+    preloading servers give each worker its own threads. CLI commands never
+    start them; use 'flask jobs work' for dedicated worker processes.
+
+    Args:
+        app (Flask): Application to set up
+    """
+    if not app.config['JOB_RUN_IN_APP'] or app.testing:
+        return
+
+    @app.before_request
+    def _start_embedded_workers():
+        pool = app.extensions.get('job_workers')
+        if pool is not None and pool.name.endswith(f':{os.getpid()}'):
+            return
+        with _start_lock:
+            pool = app.extensions.get('job_workers')
+            if pool is None or not pool.name.endswith(f':{os.getpid()}'):
+                pool = WorkerPool(app, app.config['JOB_WORKER_THREADS'])
+                app.extensions['job_workers'] = pool
+                pool.start()
+                atexit.register(pool.stop, 5)
+
+
+@event.listens_for(db.session, 'after_commit')
+def _wake_workers(session):
+    """Wake idle workers in this process once enqueued jobs are committed."""
+    if session.info.pop('jobs_enqueued', False):
+        _wakeup.set()
+
+
+@event.listens_for(db.session, 'after_rollback')
+def _forget_rolled_back_jobs(session):
+    """Drop the enqueue flag of a rolled back transaction."""
+    session.info.pop('jobs_enqueued', None)
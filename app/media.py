@@ -0,0 +1,191 @@
+"""
+Media Module for the Image Storage Application.
+
+This module serves uploaded images and their renditions with HTTP caching
+headers. Content-addressed files never change under their URL, so they are
+sent with a strong ETag (the SHA-256 of the contents) and a one-year
+`immutable` Cache-Control; repeat views are then answered from the browser
+cache without a request at all. When files are kept in object storage,
+URLs point straight at the bucket (or its CDN) instead. It handles:
+- Serving originals, renditions and legacy (filename-addressed) uploads
+- Redirecting to object storage URLs for files not kept on local disk
+- Conditional GETs (If-None-Match / If-Modified-Since) answered with 304s
+- Range requests answered with 206 partial content
+- Building versioned media URLs for templates
+"""
+
+import os
+import re
+
+from flask import Blueprint, current_app, redirect, request, send_file, abort, url_for
+from werkzeug.utils import safe_join
+
+from app.models import db, Image
+from app.storage_backends import get_storage
+
+bp = Blueprint('media', __name__, url_prefix='/media')
+
+# Sharded blob key, e.g. 'ab/cd/abcdef....png'
+BLOB_KEY_PATTERN = re.compile(r'^[0-9a-f]{2}/[0-9a-f]{2}/([0-9a-f]{64})\.[a-z0-9]+$')
+# Rendition key, e.g. 'ab/cd/abcdef....png.thumb.webp'
+RENDITION_KEY_PATTERN = re.compile(r'^[0-9a-f]{2}/[0-9a-f]{2}/[0-9a-f]{64}\.[a-z0-9]+\.[a-z]+\.webp$')
+
+
+def send_stored(store, key, etag=True, immutable=False, version=None):
+    """
+    Send a file from a storage backend.
+
+    Local files are sent by send_media(); files in object storage are
+    redirected to their direct URL.
+
+    Args:
+        store (LocalStorage or S3Storage): Backend holding the file
+        key (str): Storage key
+        etag (str or bool): Explicit ETag, or True to derive one from the file
+        immutable (bool): Whether the URL is versioned and may be cached forever
+        version (str, optional): Version passed on to public object URLs
+
+    Returns:
+        Response: File response or redirect
+    """
+    if store.local:
+        return send_media(store.path(key), etag=etag, immutable=immutable)
+    return redirect(store.url(key, version))
+
+
+def send_media(path, etag=True, immutable=False):
+    """
+    Send a media file as a conditional, range-capable response.
+
+    Args:
+        path (str): File to send
+        etag (str or bool): Explicit ETag, or True to derive one from the file
+        immutable (bool): Whether the URL is versioned and may be cached forever
+
+    Returns:
+        Response: File response, or 304/206/416 as the request headers dictate
+    """
+    if path is None or not os.path.isfile(path):
+        abort(404)
+
+    max_age = current_app.config['MEDIA_CACHE_MAX_AGE'] if immutable else 0
+    response = send_file(path, conditional=True, etag=etag, max_age=max_age)
+    if immutable:
+        response.cache_control.immutable = True
+    else:
+        # Unversioned URLs must be revalidated, which the ETag makes cheap
+        response.cache_control.no_cache = True
+
+    # Uploaded SVGs may contain scripts; never let them run on this origin
+    response.headers['X-Content-Type-Options'] = 'nosniff'
+    response.headers['Content-Security-Policy'] = "default-src 'none'; style-src 'unsafe-inline'; sandbox"
+    return response
+
+
+@bp.route('/<path:key>')
+def blob_file(key):
+    """
+    Serve an original image by its content-addressed storage key.
+
+    Args:
+        key (str): Blob storage key
+
+    Returns:
+        Response: Image file with the content hash as its ETag
+    """
+    match = BLOB_KEY_PATTERN.match(key)
+    if match is None:
+        abort(404)
+    return send_stored(get_storage(), key, etag=match.group(1), immutable=True)
+
+
+@bp.route('/renditions/<path:key>')
+def rendition_file(key):
+    """
+    Serve a generated rendition.
+
+    Rendition URLs carry the rendered dimensions as a version, so a rendition
+    regenerated at another size gets a new URL.
+
+    Args:
+        key (str): Rendition key in the renditions store
+
+    Returns:
+        Response: WebP rendition
+    """
+    if RENDITION_KEY_PATTERN.match(key) is None:
+        abort(404)
+    return send_stored(get_storage('renditions'), key, immutable='v' in request.args,
+                       version=request.args.get('v'))
+
+
+@bp.route('/legacy/<filename>')
+def legacy_file(filename):
+    """
+    Serve an image uploaded before content-addressed storage.
+
+    Such files are stored under their original name, which can be reused
+    after a delete and re-upload, so they are only cached forever when the
+    URL is versioned with the image ID. Only files directly in the upload
+    folder that a legacy image still references are served; blobs, chunked
+    uploads in progress and the transform cache live in its subfolders.
+
+    Args:
+        filename (str): Filename inside the upload folder
+
+    Returns:
+        Response: Image file
+    """
+    legacy = db.session.query(Image.query.filter(
+        Image.filename == filename, Image.blob_id.is_(None)).exists()).scalar()
+    if not legacy:
+        abort(404)
+    path = safe_join(current_app.config['UPLOAD_FOLDER'], filename)
+    return send_media(path, immutable='v' in request.args)
+
+
+@bp.app_template_global()
+def image_url(image):
+    """
+    Template helper returning the cacheable URL of an original image.
+
+    Files in object storage get their direct (public or presigned) URL, so
+    browsers download them without going through the application.
+
+    Args:
+        image (Image): Image to build the URL for
+
+    Returns:
+        str: URL of the original file
+    """
+    if image.blob is None:
+        return url_for('media.legacy_file', filename=image.filename, v=image.id)
+    store = get_storage()
+    if not store.local:
+        return store.url(image.blob.storage_key)
+    return url_for('media.blob_file', key=image.blob.storage_key)
+
+
+@bp.app_template_global()
+def rendition_url(image, kind):
+    """
+    Template helper returning the URL of an image rendition.
+
+    Falls back to the original upload when the rendition has not been
+    generated (e.g. for SVG files or images awaiting a backfill).
+
+    Args:
+        image (Image): Image to build the URL for
+        kind (str): Rendition kind, e.g. 'thumb' or 'preview'
+
+    Returns:
+        str: URL of the rendition or the original file
+    """
+    rendition = image.get_rendition(kind)
+    if rendition is None:
+        return image_url(image)
+    version = f'{rendition.width}x{rendition.height}'
+    store = get_storage('renditions')
+    if not store.local:
+        return store.url(rendition.filename, version)
+    return url_for('media.rendition_file', key=rendition.filename, v=version)
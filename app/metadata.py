@@ -0,0 +1,175 @@
+"""
+Image Metadata Module for the Image Storage Application.
+
+This module reads the technical metadata stored on Image rows from the
+original file once, at ingest, so searches can filter on it without
+opening any files. It handles:
+- Reading dimensions, format and color mode from the image header
+- Extracting generation parameters embedded by AI image tools
+- Backfilling metadata for images stored before it was extracted
+"""
+
+import json
+import os
+
+from flask import current_app
+from PIL import Image as PILImage
+
+from app.jobs import enqueue, job_handler
+from app.models import db, Image
+from app.storage import file_extension
+
+# EXIF tag whose values 5-8 mean the image is stored rotated by 90 degrees
+ORIENTATION_TAG = 0x0112
+
+# PNG text chunks written by common generators (AUTOMATIC1111, ComfyUI, NovelAI, ...)
+GENERATION_INFO_KEYS = ('parameters', 'prompt', 'workflow', 'Comment', 'Description', 'Software')
+
+# EXIF tags carrying parameters in JPEG/WebP output
+EXIF_IFD = 0x8769
+USER_COMMENT_TAG = 0x9286
+IMAGE_DESCRIPTION_TAG = 0x010E
+
+# Embedded workflows can be large; keep each stored value bounded
+MAX_GENERATION_PARAM_LENGTH = 32 * 1024
+
+# Columns filled in by apply_metadata()
+METADATA_COLUMNS = ('width', 'height', 'format', 'file_size', 'color_mode', 'generation_params')
+
+
+def _decode_user_comment(value):
+    """Decode an EXIF UserComment, which starts with an 8 byte charset marker."""
+    if isinstance(value, str):
+        return value
+    marker, text = value[:8], value[8:]
+    if marker.startswith(b'UNICODE'):
+        # Writers disagree on byte order; a BOM or leading NUL tells them apart
+        encoding = 'utf-16-be' if text[:1] == b'\x00' or text[:2] == b'\xfe\xff' else 'utf-16-le'
+        return text.decode(encoding, errors='replace').lstrip('\ufeff')
+    return text.decode('utf-8', errors='replace')
+
+
+def generation_params(img):
+    """
+    Collect generation parameters embedded in an opened image.
+
+    Only metadata that Pillow has already parsed with the header is read;
+    the pixel data is never decoded.
+
+    Args:
+        img (PIL.Image.Image): Image opened with Pillow
+
+    Returns:
+        dict: Source key mapped to its text, empty if nothing is embedded
+    """
+    params = {}
+    for key in GENERATION_INFO_KEYS:
+        value = img.info.get(key)
+        if isinstance(value, bytes):
+            value = value.decode('utf-8', errors='replace')
+        if isinstance(value, str) and value.strip():
+            params[key] = value.strip()
+
+    exif = img.getexif()
+    description = exif.get(IMAGE_DESCRIPTION_TAG)
+    if isinstance(description, str) and description.strip():
+        params.setdefault('Description', description.strip())
+    comment = exif.get_ifd(EXIF_IFD).get(USER_COMMENT_TAG)
+    if comment:
+        text = _decode_user_comment(comment).strip('\x00 ')
+        if text:
+            params.setdefault('parameters', text)
+    return params
+
+
+def extract_metadata(path, extension):
+    """
+    Read an image file's metadata without decoding its pixels.
+
+    Only touches the filesystem, so it can run in worker processes. Vector
+    images only get their format and size.
+
+    Args:
+        path (str): Path to the image
+        extension (str): File extension without the dot
+
+    Returns:
+        dict: Values for the Image metadata columns
+    """
+    metadata = {column: None for column in METADATA_COLUMNS}
+    metadata['file_size'] = os.path.getsize(path)
+    if extension == 'svg':
+        metadata['format'] = 'svg'
+        return metadata
+
+    with PILImage.open(path) as img:
+        width, height = img.size
+        if img.getexif().get(ORIENTATION_TAG) in (5, 6, 7, 8):
+            width, height = height, width
+        params = generation_params(img)
+        metadata.update(
+            width=width,
+            height=height,
+            format=(img.format or extension).lower(),
+            color_mode=img.mode
+        )
+    if params:
+        metadata['generation_params'] = json.dumps(
+            {key: value[:MAX_GENERATION_PARAM_LENGTH] for key, value in params.items()})
+    return metadata
+
+
+def apply_metadata(image, path=None):
+    """
+    Extract an image's metadata from its stored file onto the row.
+
+    Args:
+        image (Image): Image whose file is in storage
+        path (str, optional): Local path to the file, defaults to a local
+            copy of the stored file
+    """
+    if path is None:
+        with image.local_path() as path:
+            return apply_metadata(image, path)
+    for column, value in extract_metadata(path, file_extension(image.storage_key)).items():
+        setattr(image, column, value)
+
+
+def queue_metadata_backfill(batch_size=200):
+    """
+    Enqueue extract_metadata jobs for images without metadata.
+
+    Args:
+        batch_size (int): Images handled per job
+
+    Returns:
+        tuple: (number of images, number of jobs enqueued)
+    """
+    image_ids = [image_id for (image_id,) in db.session.query(Image.id)
+                 .filter(Image.format.is_(None)).order_by(Image.id)]
+    jobs = 0
+    for offset in range(0, len(image_ids), batch_size):
+        enqueue('extract_metadata', image_ids=image_ids[offset:offset + batch_size])
+        jobs += 1
+    db.session.commit()
+    return len(image_ids), jobs
+
+
+@job_handler('extract_metadata')
+def extract_metadata_job(job):
+    """
+    Fill in the metadata of a batch of existing images.
+
+    Images whose file is missing or unreadable are logged and skipped so
+    one bad file does not make the whole batch retry.
+
+    Args:
+        job (Job): The extract_metadata job
+    """
+    images = Image.query.options(db.joinedload(Image.blob)) \
+        .filter(Image.id.in_(job.data['image_ids'])).all()
+    for image in images:
+        try:
+            apply_metadata(image)
+        except Exception as e:
+            current_app.logger.warning('Could not read metadata of image %s: %s', image.id, e)
@@ -0,0 +1,341 @@
+"""
+Metrics Module for the Image Storage Application.
+
+This module instruments every request and exposes the measurements in the
+Prometheus text format at /metrics. Metrics live in the memory of each
+worker process. It handles:
+- Per-endpoint request counts and latency histograms
+- SQL statement counts and time per request, via SQLAlchemy engine events
+- Bytes served and sizes of stored uploads
+- Errors that views report as flash messages instead of error responses
+- Page cache counters
+- An opt-in log of slow requests with their SQL statements and, optionally,
+  a cProfile dump
+"""
+
+import cProfile
+import os
+import threading
+import time
+from datetime import datetime
+
+from flask import current_app, g, has_request_context, message_flashed, request
+from sqlalchemy import event
+
+from app.models import db
+
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+QUERY_COUNT_BUCKETS = (0, 1, 2, 5, 10, 20, 50, 100, 200)
+UPLOAD_SIZE_BUCKETS = tuple(kb * 1024 for kb in (64, 256, 1024, 4096, 16384, 65536, 262144, 1048576))
+
+# Statements kept per request for the slow-request log
+MAX_LOGGED_STATEMENTS = 200
+
+# Only one cProfile profiler can be active at a time (per interpreter since
+# Python 3.12), so concurrent requests are profiled one at a time
+_profile_lock = threading.Lock()
+
+
+def _escape(value):
+    """Escape a label value for the text exposition format."""
+    return str(value).replace('\\', '\\\\').replace('\n', '\\n').replace('"', '\\"')
+
+
+def _format_labels(names, values, extra=()):
+    pairs = [f'{name}="{_escape(value)}"' for name, value in (*zip(names, values), *extra)]
+    return '{' + ','.join(pairs) + '}' if pairs else ''
+
+
+def _format_value(value):
+    return repr(float(value)) if isinstance(value, float) else str(value)
+
+
+class Counter:
+    """
+    Monotonically increasing value per label combination.
+
+    Attributes:
+        name (str): Metric name
+        help (str): Description shown in the exposition
+        labels (tuple): Label names
+    """
+
+    kind = 'counter'
+
+    def __init__(self, name, help, labels=()):
+        self.name = name
+        self.help = help
+        self.labels = labels
+        self._values = {}
+        self._lock = threading.Lock()
+
+    def inc(self, *label_values, amount=1):
+        """Add `amount` to the series of the given label values."""
+        with self._lock:
+            self._values[label_values] = self._values.get(label_values, 0) + amount
+
+    def samples(self):
+        """Yield (name, labels, value) for every series."""
+        with self._lock:
+            items = list(self._values.items())
+        for label_values, value in items:
+            yield self.name, _format_labels(self.labels, label_values), value
+
+
+class Histogram:
+    """
+    Distribution of observed values in cumulative buckets per label combination.
+
+    Attributes:
+        name (str): Metric name
+        help (str): Description shown in the exposition
+        labels (tuple): Label names
+        buckets (tuple): Upper bounds of the buckets, ascending
+    """
+
+    kind = 'histogram'
+
+    def __init__(self, name, help, labels=(), buckets=LATENCY_BUCKETS):
+        self.name = name
+        self.help = help
+        self.labels = labels
+        self.buckets = buckets
+        self._series = {}
+        self._lock = threading.Lock()
+
+    def observe(self, value, *label_values):
+        """Record one value in the series of the given label values."""
+        with self._lock:
+            series = self._series.get(label_values)
+            if series is None:
+                series = self._series[label_values] = [[0] * len(self.buckets), 0, 0]
+            counts = series[0]
+            for position, bound in enumerate(self.buckets):
+                if value <= bound:
+                    counts[position] += 1
+                    break
+            series[1] += 1
+            series[2] += value
+
+    def samples(self):
+        """Yield (name, labels, value) for the buckets, count and sum of every series."""
+        with self._lock:
+            items = [(label_values, list(counts), count, total)
+                     for label_values, (counts, count, total) in self._series.items()]
+        for label_values, counts, count, total in items:
+            cumulative = 0
+            for bound, bucket_count in zip(self.buckets, counts):
+                cumulative += bucket_count
+                yield (f'{self.name}_bucket',
+                       _format_labels(self.labels, label_values, (('le', _format_value(float(bound))),)),
+                       cumulative)
+            yield f'{self.name}_bucket', _format_labels(self.labels, label_values, (('le', '+Inf'),)), count
+            yield f'{self.name}_count', _format_labels(self.labels, label_values), count
+            yield f'{self.name}_sum', _format_labels(self.labels, label_values), total
+
+
+REQUESTS = Counter('http_requests_total', 'HTTP requests handled', ('endpoint', 'method', 'status'))
+REQUEST_LATENCY = Histogram('http_request_duration_seconds', 'Time spent handling a request',
+                            ('endpoint', 'method'))
+RESPONSE_BYTES = Counter('http_response_bytes_total', 'Response body bytes with a known length',
+                         ('endpoint',))
+REQUEST_QUERIES = Histogram('http_request_sql_queries', 'SQL statements executed per request',
+                            ('endpoint',), QUERY_COUNT_BUCKETS)
+SQL_QUERIES = Counter('sql_queries_total', 'SQL statements executed during requests', ('endpoint',))
+SQL_SECONDS = Counter('sql_query_seconds_total', 'Time spent executing SQL statements during requests',
+                      ('endpoint',))
+UPLOAD_SIZES = Histogram('upload_size_bytes', 'Size of stored uploads', (), UPLOAD_SIZE_BUCKETS)
+FLASHED_ERRORS = Counter('flashed_errors_total', 'Errors reported to the user as flash messages',
+                         ('endpoint',))
+SLOW_REQUESTS = Counter('slow_requests_total', 'Requests slower than SLOW_REQUEST_THRESHOLD', ('endpoint',))
+
+METRICS = (REQUESTS, REQUEST_LATENCY, RESPONSE_BYTES, REQUEST_QUERIES, SQL_QUERIES, SQL_SECONDS,
+           UPLOAD_SIZES, FLASHED_ERRORS, SLOW_REQUESTS)
+
+
+def observe_upload(size):
+    """
+    Record the size of a stored upload.
+
+    Args:
+        size (int): Size of the uploaded file in bytes
+    """
+    UPLOAD_SIZES.observe(size)
+
+
+def _endpoint():
+    """Return the endpoint label of the current request; unmatched URLs share one."""
+    return request.endpoint or 'unmatched'
+
+
+def _page_cache_samples():
+    """Return gauge and counter lines for the page cache, if it is enabled."""
+    cache = current_app.extensions.get('page_cache')
+    if cache is None:
+        return []
+    stats = cache.stats()
+    lines = []
+    for key in ('hits', 'misses', 'bypasses', 'evictions', 'invalidations'):
+        lines += [f'# HELP page_cache_{key}_total Page cache {key}',
+                  f'# TYPE page_cache_{key}_total counter',
+                  f'page_cache_{key}_total {stats[key]}']
+    for key, help in (('entries', 'Pages held in the page cache'), ('bytes', 'Memory used by cached pages')):
+        lines += [f'# HELP page_cache_{key} {help}',
+                  f'# TYPE page_cache_{key} gauge',
+                  f'page_cache_{key} {stats[key]}']
+    return lines
+
+
+def render_metrics():
+    """
+    Render every metric in the Prometheus text exposition format.
+
+    Returns:
+        str: Exposition text
+    """
+    lines = []
+    for metric in METRICS:
+        lines.append(f'# HELP {metric.name} {metric.help}')
+        lines.append(f'# TYPE {metric.name} {metric.kind}')
+        for name, labels, value in metric.samples():
+            lines.append(f'{name}{labels} {_format_value(value)}')
+    lines += _page_cache_samples()
+    return '\n'.join(lines) + '\n'
+
+
+def metrics_view():
+    """
+    Expose the metrics of this worker process to Prometheus.
+
+    Returns:
+        Response: text/plain exposition
+    """
+    response = current_app.response_class(render_metrics(), mimetype='text/plain; version=0.0.4')
+    response.cache_control.no_store = True
+    return response
+
+
+def _before_request():
+    g.metrics_started = time.perf_counter()
+    g.sql_count = 0
+    g.sql_seconds = 0.0
+    slow_log = current_app.config['SLOW_REQUEST_THRESHOLD'] is not None
+    g.sql_statements = [] if slow_log else None
+    g.profiler = None
+    if slow_log and current_app.config['SLOW_REQUEST_PROFILE_DIR'] and _profile_lock.acquire(blocking=False):
+        g.profiler = cProfile.Profile()
+        g.profiler.enable()
+
+
+def _after_request(response):
+    started = g.pop('metrics_started', None)
+    if started is None:
+        return response
+    duration = time.perf_counter() - started
+    profiler = g.pop('profiler', None)
+    if profiler is not None:
+        profiler.disable()
+        _profile_lock.release()
+
+    endpoint = _endpoint()
+    REQUESTS.inc(endpoint, request.method, str(response.status_code))
+    REQUEST_LATENCY.observe(duration, endpoint, request.method)
+    if response.content_length is not None:
+        RESPONSE_BYTES.inc(endpoint, amount=response.content_length)
+    REQUEST_QUERIES.observe(g.sql_count, endpoint)
+    SQL_QUERIES.inc(endpoint, amount=g.sql_count)
+    SQL_SECONDS.inc(endpoint, amount=g.sql_seconds)
+
+    threshold = current_app.config['SLOW_REQUEST_THRESHOLD']
+    if threshold is not None and duration >= threshold:
+        SLOW_REQUESTS.inc(endpoint)
+        _log_slow_request(duration, response, profiler)
+    return response
+
+
+def _teardown_request(exception):
+    # Stop a profiler left running when the request failed before after_request
+    profiler = g.pop('profiler', None)
+    if profiler is not None:
+        profiler.disable()
+        _profile_lock.release()
+
+
+def _log_slow_request(duration, response, profiler):
+    """Log a slow request with its statements and save its profile, if one was taken."""
+    statements = '\n'.join(f'  {seconds * 1000:8.1f}ms  {statement}'
+                           for statement, seconds in g.sql_statements or ())
+    profile_path = None
+    if profiler is not None:
+        name = f"{datetime.utcnow():%Y%m%dT%H%M%S.%f}-{_endpoint().replace('.', '_')}.prof"
+        profile_path = os.path.join(current_app.config['SLOW_REQUEST_PROFILE_DIR'], name)
+        try:
+            os.makedirs(os.path.dirname(profile_path), exist_ok=True)
+            profiler.dump_stats(profile_path)
+        except OSError as e:
+            current_app.logger.warning('Could not save profile %s: %s', profile_path, e)
+            profile_path = None
+
+    current_app.logger.warning(
+        'Slow request: %s %s -> %s in %.3fs, %d SQL statements in %.3fs%s%s',
+        request.method, request.full_path.rstrip('?'), response.status_code, duration,
+        g.sql_count, g.sql_seconds,
+        f', profile saved to {profile_path}' if profile_path else '',
+        f'\n{statements}' if statements else '')
+
+
+def _before_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+    conn.info.setdefault('metrics_started', []).append(time.perf_counter())
+
+
+def _after_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+    stack = conn.info.get('metrics_started')
+    if not stack:
+        return
+    seconds = time.perf_counter() - stack.pop()
+    # Job worker threads run queries outside any request
+    if not has_request_context() or 'sql_count' not in g:
+        return
+    g.sql_count += 1
+    g.sql_seconds += seconds
+    if g.sql_statements is not None and len(g.sql_statements) < MAX_LOGGED_STATEMENTS:
+        g.sql_statements.append((' '.join(statement.split()), seconds))
+
+
+def _handle_sql_error(exception_context):
+    stack = exception_context.connection.info.get('metrics_started') if exception_context.connection else None
+    if stack:
+        stack.pop()
+
+
+def _count_flashed_error(app, message, category):
+    if category in ('error', 'danger') and has_request_context():
+        FLASHED_ERRORS.inc(_endpoint())
+
+
+def init_metrics(app):
+    """
+    Instrument the application's requests and database engines.
+
+    Registers the request hooks, the SQL statement listeners and, unless
+    METRICS_ENABLED is off, the /metrics endpoint.
+
+    Args:
+        app (Flask): Application to instrument
+    """
+    if not app.config['METRICS_ENABLED']:
+        return
+
+    app.before_request(_before_request)
+    app.after_request(_after_request)
+    app.teardown_request(_teardown_request)
+    message_flashed.connect(_count_flashed_error, app)
+
+    with app.app_context():
+        engines = list(db.engines.values())
+    for engine in engines:
+        event.listen(engine, 'before_cursor_execute', _before_cursor_execute)
+        event.listen(engine, 'after_cursor_execute', _after_cursor_execute)
+        event.listen(engine, 'handle_error', _handle_sql_error)
+
+    app.add_url_rule('/metrics', 'metrics', metrics_view)
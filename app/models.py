@@ -5,12 +5,22 @@ This module defines the SQLAlchemy models that represent the database structure:
 - Category: Represents main image categories
 - Subcategory: Represents subcategories within main categories
 - Image: Represents stored images and their metadata
+- Blob: Represents a content-addressed file shared by identical images
+- Rendition: Represents resized derivatives (thumbnails, previews) of a blob
+- UploadSession: Represents a resumable chunked upload in progress
+- UploadChunk: Represents a verified chunk received for an upload session
+- ImportedFile: Represents a source file already ingested by the bulk importer
+- Job: Represents a unit of background work, such as processing an upload
 """
 
+from flask import current_app
 from flask_sqlalchemy import SQLAlchemy
 from datetime import datetime
+import json
 import os
 
+from app.storage_backends import LocalStorage, get_storage
+
 db = SQLAlchemy()
 
 class Category(db.Model):
@@ -20,12 +30,21 @@ class Category(db.Model):
     Attributes:
         id (int): Primary key
         name (str): Unique category name
+        image_count (int): Number of images in the category
+        total_bytes (int): Combined file size of those images
+        latest_upload (datetime): Upload date of the newest image, if any
         subcategories (relationship): One-to-many relationship with Subcategory
         images (relationship): One-to-many relationship with Image
+
+    The image statistics are maintained by app/stats.py in the transaction
+    that changes the images.
     """
     id = db.Column(db.Integer, primary_key=True)
     name = db.Column(db.String(100), unique=True, nullable=False)
-    subcategories = db.relationship('Subcategory', backref='parent_category', lazy='dynamic', order_by='Subcategory.name')
+    image_count = db.Column(db.Integer, nullable=False, default=0, server_default='0')
+    total_bytes = db.Column(db.BigInteger, nullable=False, default=0, server_default='0')
+    latest_upload = db.Column(db.DateTime)
+    subcategories = db.relationship('Subcategory', backref='parent_category', lazy=True, order_by='Subcategory.name')
     images = db.relationship('Image', backref='category', lazy=True)
 
 class Subcategory(db.Model):
@@ -36,11 +55,17 @@ class Subcategory(db.Model):
         id (int): Primary key
         name (str): Subcategory name
         category_id (int): Foreign key to parent Category
+        image_count (int): Number of images in the subcategory
+        total_bytes (int): Combined file size of those images
+        latest_upload (datetime): Upload date of the newest image, if any
         images (relationship): One-to-many relationship with Image
     """
     id = db.Column(db.Integer, primary_key=True)
     name = db.Column(db.String(100), nullable=False)
-    category_id = db.Column(db.Integer, db.ForeignKey('category.id'), nullable=False)
+    category_id = db.Column(db.Integer, db.ForeignKey('category.id'), nullable=False, index=True)
+    image_count = db.Column(db.Integer, nullable=False, default=0, server_default='0')
+    total_bytes = db.Column(db.BigInteger, nullable=False, default=0, server_default='0')
+    latest_upload = db.Column(db.DateTime)
     images = db.relationship('Image', backref='subcategory', lazy=True)
 
 class Image(db.Model):
@@ -50,12 +75,29 @@ class Image(db.Model):
     Attributes:
         id (int): Primary key
         name (str): Image display name
-        filename (str): Actual filename on disk
+        filename (str): Sanitized filename the image was uploaded as
         description (str): Optional image description
         prompt (str): Optional AI prompt used to generate the image
         upload_date (datetime): When the image was uploaded
         category_id (int): Foreign key to Category
         subcategory_id (int): Foreign key to Subcategory
+        blob_id (int): Foreign key to the Blob holding the file contents
+            (None for images stored before content-addressed storage)
+        width (int): Upright width of the original in pixels
+        height (int): Upright height of the original in pixels
+        format (str): Detected file format, e.g. 'png' or 'jpeg'
+        file_size (int): Size of the original in bytes
+        color_mode (str): Pillow color mode, e.g. 'RGB' or 'RGBA'
+        generation_params (str): JSON object of generation parameters
+            embedded by AI tools (e.g. the PNG 'parameters' chunk), if any
+        perceptual_hash (int): 64-bit difference hash of the picture, stored
+            signed; close hashes mean visually similar images
+        duplicate_group (int): Lowest image ID of the near-duplicate group
+            the image belongs to, None if it has no near-duplicates
+
+    The metadata columns are read from the file once by a background job
+    after upload; they are None until then (width, height and color mode
+    stay None for vector images).
     """
     id = db.Column(db.Integer, primary_key=True)
     name = db.Column(db.String(200), nullable=False)
@@ -67,27 +109,410 @@ class Image(db.Model):
     # Foreign Keys
     category_id = db.Column(db.Integer, db.ForeignKey('category.id'), nullable=False)
     subcategory_id = db.Column(db.Integer, db.ForeignKey('subcategory.id'), nullable=False)
+    blob_id = db.Column(db.Integer, db.ForeignKey('blob.id'), index=True)
 
-    def get_filepath(self):
+    # Metadata read from the file by the process_image job
+    width = db.Column(db.Integer, index=True)
+    height = db.Column(db.Integer, index=True)
+    format = db.Column(db.String(10))
+    file_size = db.Column(db.BigInteger, index=True)
+    color_mode = db.Column(db.String(10))
+    generation_params = db.Column(db.Text)
+    perceptual_hash = db.Column(db.BigInteger)
+
+    # Set by 'flask images cluster-duplicates'
+    duplicate_group = db.Column(db.Integer, index=True)
+
+    blob = db.relationship('Blob', backref=db.backref('images', lazy=True))
+
+    __table_args__ = (
+        # Serves newest-first listings and keyset pagination
+        db.Index('ix_image_upload_date_id', 'upload_date', 'id'),
+        # Serve newest-first listings of one category or subcategory, and
+        # lookups and counts by category
+        db.Index('ix_image_category_upload_date_id', 'category_id', 'upload_date', 'id'),
+        db.Index('ix_image_subcategory_upload_date_id', 'subcategory_id', 'upload_date', 'id'),
+        # Serves format filters, alone or combined with a width range
+        db.Index('ix_image_format_width', 'format', 'width'),
+    )
+
+    @classmethod
+    def card_query(cls):
+        """
+        Return an Image query that eager-loads everything an image card renders.
+        
+        Category, subcategory and blob are joined into the same SELECT and
+        renditions are fetched with one extra IN query, so rendering a page of
+        cards costs a constant number of queries instead of 1 + 4N.
+        
+        Returns:
+            Query: Image query with eager-loading options applied
+        """
+        return cls.query.options(
+            db.joinedload(cls.category),
+            db.joinedload(cls.subcategory),
+            db.joinedload(cls.blob).selectinload(Blob.renditions)
+        )
+
+    @property
+    def orientation(self):
+        """str: 'landscape', 'portrait' or 'square', or None without dimensions."""
+        if not self.width or not self.height:
+            return None
+        if self.width == self.height:
+            return 'square'
+        return 'landscape' if self.width > self.height else 'portrait'
+
+    @property
+    def generation_info(self):
+        """dict: Decoded generation parameters, empty if there are none."""
+        return json.loads(self.generation_params) if self.generation_params else {}
+
+    @property
+    def storage_key(self):
         """
-        Return the full file path for the image.
+        str: Path of the image file relative to the upload folder.
+        
+        Content-addressed images live under their sharded hash path; images
+        uploaded before that are still found under their original filename.
+        """
+        if self.blob is not None:
+            return self.blob.storage_key
+        return self.filename
+
+    def local_path(self):
+        """
+        Return a context manager yielding a local path of the image file.
+        
+        Files kept in object storage are downloaded to a temporary file for
+        the duration of the block; legacy uploads are read from the upload
+        folder.
         
         Returns:
-            str: Path to the image file relative to the application root
+            contextmanager: Yields the path to the image file
         """
-        return os.path.join('static', 'uploads', self.filename)
+        if self.blob is not None:
+            return self.blob.local_path()
+        return LocalStorage(current_app.config['UPLOAD_FOLDER']).local_path(self.filename)
+
+    def get_rendition(self, kind):
+        """
+        Return the rendition of the given kind, if it has been generated.
+        
+        Args:
+            kind (str): Rendition kind, e.g. 'thumb' or 'preview'
+            
+        Returns:
+            Rendition: Matching rendition, or None if it does not exist
+        """
+        if self.blob is None:
+            return None
+        return self.blob.get_rendition(kind)
 
     def delete_file(self):
         """
-        Delete the image file from the filesystem.
+        Release the image file; call it together with deleting the image.
+        
+        The underlying blob is shared by every image with identical contents,
+        so its file and renditions are only removed once the last image
+        referencing it is deleted. Files are removed by jobs enqueued in the
+        same transaction, so nothing is deleted unless it commits.
+        """
+        if self.blob is not None:
+            self.blob.release()
+            return
+
+        # Imported here because app.jobs imports this module
+        from app.jobs import enqueue
+        enqueue('delete_files', files=[['legacy', self.filename]])
+
+    def __repr__(self):
+        """String representation of the Image model."""
+        return f'<Image {self.name}>'
+
+class Blob(db.Model):
+    """
+    Blob model representing a stored file, addressed by its content hash.
+    
+    Identical uploads share one Blob, so the bytes are stored once no matter
+    how many Image rows reference them.
+    
+    Attributes:
+        id (int): Primary key
+        sha256 (str): Hex SHA-256 digest of the file contents
+        extension (str): Lower-case file extension without the dot
+        size (int): File size in bytes
+        refcount (int): Number of Image rows referencing this blob
+        created_at (datetime): When the contents were first stored
+        renditions (relationship): One-to-many relationship with Rendition
+    """
+    id = db.Column(db.Integer, primary_key=True)
+    sha256 = db.Column(db.String(64), unique=True, nullable=False)
+    extension = db.Column(db.String(10), nullable=False)
+    size = db.Column(db.BigInteger, nullable=False)
+    refcount = db.Column(db.Integer, nullable=False, default=0)
+    created_at = db.Column(db.DateTime, default=datetime.utcnow)
+
+    renditions = db.relationship('Rendition', backref='blob', lazy=True, cascade='all, delete-orphan')
+
+    @staticmethod
+    def key_for(sha256, extension):
+        """
+        Build the sharded storage key for a content hash.
+        
+        Args:
+            sha256 (str): Hex SHA-256 digest
+            extension (str): File extension without the dot
+            
+        Returns:
+            str: Relative path such as 'ab/cd/abcdef....png'
+        """
+        return f'{sha256[:2]}/{sha256[2:4]}/{sha256}.{extension}'
+
+    @property
+    def storage_key(self):
+        """str: Key of the blob file in the originals storage backend."""
+        return self.key_for(self.sha256, self.extension)
+
+    def local_path(self):
+        """
+        Return a context manager yielding a local path of the blob file.
         
-        This method removes the actual image file from disk when an Image record
-        is deleted from the database.
+        Returns:
+            contextmanager: Yields the path, which is a temporary download
+                when the file is kept in object storage
+        """
+        return get_storage().local_path(self.storage_key)
+
+    def get_rendition(self, kind):
         """
+        Return the rendition of the given kind, if it has been generated.
+        
+        Args:
+            kind (str): Rendition kind, e.g. 'thumb' or 'preview'
+            
+        Returns:
+            Rendition: Matching rendition, or None if it does not exist
+        """
+        for rendition in self.renditions:
+            if rendition.kind == kind:
+                return rendition
+        return None
+
+    def release(self):
+        """
+        Drop one reference to the blob.
+        
+        The counter is decremented in SQL so concurrent releases cannot lose
+        updates. When the last reference goes away the row is kept without
+        references and a delete_blobs job is enqueued in the same
+        transaction; it removes the row and the files once that transaction
+        has committed, unless an identical upload took the blob over.
+        """
+        self.refcount = Blob.refcount - 1
+        db.session.flush()
+        db.session.refresh(self, ['refcount'])
+        if self.refcount <= 0:
+            # Imported here because app.jobs imports this module
+            from app.jobs import enqueue
+            enqueue('delete_blobs', blob_ids=[self.id])
+
+    def __repr__(self):
+        """String representation of the Blob model."""
+        return f'<Blob {self.sha256[:12]}>'
+
+class Rendition(db.Model):
+    """
+    Rendition model representing a resized derivative of a blob.
+    
+    Renditions are generated from the original upload at a fixed width so the
+    gallery and search grids never have to ship full-size originals.
+    
+    Attributes:
+        id (int): Primary key
+        blob_id (int): Foreign key to the source Blob
+        kind (str): Rendition kind, e.g. 'thumb' or 'preview'
+        filename (str): Key in the renditions storage backend
+        width (int): Rendered width in pixels
+        height (int): Rendered height in pixels
+    """
+    id = db.Column(db.Integer, primary_key=True)
+    blob_id = db.Column(db.Integer, db.ForeignKey('blob.id'), nullable=False, index=True)
+    kind = db.Column(db.String(20), nullable=False)
+    filename = db.Column(db.String(300), nullable=False)
+    width = db.Column(db.Integer, nullable=False)
+    height = db.Column(db.Integer, nullable=False)
+
+    __table_args__ = (db.UniqueConstraint('blob_id', 'kind'),)
+
+    def delete_file(self):
+        """Delete the rendition file from the renditions storage backend."""
+        get_storage('renditions').delete(self.filename)
+
+    def __repr__(self):
+        """String representation of the Rendition model."""
+        return f'<Rendition {self.kind} of blob {self.blob_id}>'
+
+class UploadSession(db.Model):
+    """
+    UploadSession model representing a resumable chunked upload.
+    
+    The session records everything needed to create the Image once all
+    chunks have arrived, so an interrupted upload can be resumed from
+    another request or after a server restart.
+    
+    Attributes:
+        id (str): Random hex identifier handed to the client
+        filename (str): Sanitized original filename
+        total_size (int): Expected file size in bytes
+        chunk_size (int): Size of every chunk except possibly the last
+        sha256 (str): Optional expected digest of the whole file
+        name (str): Display name of the image to create
+        description (str): Optional image description
+        prompt (str): Optional AI prompt used to generate the image
+        category_id (int): Foreign key to Category
+        subcategory_id (int): Foreign key to Subcategory
+        created_at (datetime): When the upload was started
+        updated_at (datetime): When the last chunk was received
+        chunks (relationship): One-to-many relationship with UploadChunk
+    """
+    id = db.Column(db.String(32), primary_key=True)
+    filename = db.Column(db.String(300), nullable=False)
+    total_size = db.Column(db.BigInteger, nullable=False)
+    chunk_size = db.Column(db.Integer, nullable=False)
+    sha256 = db.Column(db.String(64))
+    name = db.Column(db.String(200), nullable=False)
+    description = db.Column(db.Text)
+    prompt = db.Column(db.Text)
+    category_id = db.Column(db.Integer, db.ForeignKey('category.id'), nullable=False)
+    subcategory_id = db.Column(db.Integer, db.ForeignKey('subcategory.id'), nullable=False)
+    created_at = db.Column(db.DateTime, default=datetime.utcnow)
+    updated_at = db.Column(db.DateTime, default=datetime.utcnow, onupdate=datetime.utcnow)
+
+    chunks = db.relationship('UploadChunk', backref='session', lazy=True, cascade='all, delete-orphan',
+                             order_by='UploadChunk.index')
+
+    @property
+    def chunk_count(self):
+        """int: Number of chunks the file is split into."""
+        return max(1, -(-self.total_size // self.chunk_size))
+
+    def expected_chunk_length(self, index):
+        """
+        Return the number of bytes chunk `index` must contain.
+        
+        Args:
+            index (int): Zero-based chunk index
+            
+        Returns:
+            int: Expected chunk length in bytes
+        """
+        return min(self.chunk_size, self.total_size - index * self.chunk_size)
+
+    def get_filepath(self):
+        """
+        Return the path of the partially received file.
+        
+        Returns:
+            str: Path inside the upload folder's temporary directory
+        """
+        return os.path.join(current_app.config['UPLOAD_FOLDER'], 'tmp', f'upload-{self.id}.part')
+
+    def delete_file(self):
+        """Delete the partially received file from the filesystem."""
         filepath = self.get_filepath()
         if os.path.exists(filepath):
             os.remove(filepath)
 
     def __repr__(self):
-        """String representation of the Image model."""
-        return f'<Image {self.name}>'
+        """String representation of the UploadSession model."""
+        return f'<UploadSession {self.id}>'
+
+class UploadChunk(db.Model):
+    """
+    UploadChunk model recording a chunk that was written and verified.
+    
+    Attributes:
+        session_id (str): Foreign key to the UploadSession
+        index (int): Zero-based chunk index
+        sha256 (str): Verified hex SHA-256 digest of the chunk
+    """
+    session_id = db.Column(db.String(32), db.ForeignKey('upload_session.id'), primary_key=True)
+    index = db.Column(db.Integer, primary_key=True, autoincrement=False)
+    sha256 = db.Column(db.String(64), nullable=False)
+
+class ImportedFile(db.Model):
+    """
+    ImportedFile model recording a file ingested by the bulk importer.
+    
+    Rows are committed in the same transaction as the Image they produced,
+    so an interrupted import can be re-run and will skip exactly the files
+    that made it into the library.
+    
+    Attributes:
+        id (int): Primary key
+        source_path (str): Absolute path of the imported file
+        size (int): File size in bytes when it was imported
+        mtime (float): File modification time when it was imported
+        image_id (int): ID of the Image created for the file
+        imported_at (datetime): When the file was imported
+    """
+    id = db.Column(db.Integer, primary_key=True)
+    source_path = db.Column(db.String(1024), unique=True, nullable=False)
+    size = db.Column(db.BigInteger, nullable=False)
+    mtime = db.Column(db.Float, nullable=False)
+    image_id = db.Column(db.Integer)
+    imported_at = db.Column(db.DateTime, default=datetime.utcnow)
+
+class Job(db.Model):
+    """
+    Job model representing a unit of background work.
+    
+    Jobs are rows rather than in-memory tasks, so queued work survives
+    restarts and can be picked up by any worker process sharing the database.
+    
+    Attributes:
+        id (int): Primary key
+        kind (str): Name of the registered handler that runs the job
+        image_id (int): Image the job works on, if any (not a foreign key, so
+            deleting the image never fails on its queued jobs)
+        payload (str): JSON-encoded handler arguments
+        status (str): 'queued', 'running', 'succeeded' or 'failed'
+        attempts (int): Number of times the job has been started
+        max_attempts (int): Attempts before the job is marked failed
+        run_after (datetime): Earliest time the job may (re)start
+        locked_by (str): Worker running the job
+        locked_at (datetime): When that worker claimed it
+        heartbeat_at (datetime): When that worker last reported the job still running
+        error (str): Error of the last failed attempt
+        created_at (datetime): When the job was enqueued
+        finished_at (datetime): When the job succeeded or finally failed
+    """
+    id = db.Column(db.Integer, primary_key=True)
+    kind = db.Column(db.String(50), nullable=False)
+    image_id = db.Column(db.Integer, index=True)
+    payload = db.Column(db.Text, nullable=False, default='{}')
+    status = db.Column(db.String(20), nullable=False, default='queued')
+    attempts = db.Column(db.Integer, nullable=False, default=0)
+    max_attempts = db.Column(db.Integer, nullable=False, default=3)
+    run_after = db.Column(db.DateTime, nullable=False, default=datetime.utcnow)
+    locked_by = db.Column(db.String(100))
+    locked_at = db.Column(db.DateTime)
+    heartbeat_at = db.Column(db.DateTime)
+    error = db.Column(db.Text)
+    created_at = db.Column(db.DateTime, default=datetime.utcnow)
+    finished_at = db.Column(db.DateTime)
+
+    __table_args__ = (
+        # Serves the workers' "next due job" lookup
+        db.Index('ix_job_status_run_after', 'status', 'run_after'),
+    )
+
+    @property
+    def data(self):
+        """dict: Decoded handler arguments."""
+        return json.loads(self.payload or '{}')
+
+    def __repr__(self):
+        """String representation of the Job model."""
+        return f'<Job {self.id} {self.kind} {self.status}>'
@@ -0,0 +1,296 @@
+"""
+Page Cache Module for the Image Storage Application.
+
+This module keeps rendered HTML of the read-heavy pages (gallery, image
+details, categories) in memory, so repeat visits are answered without
+querying the database or rendering templates. Cached pages are tied to a
+generation number held by a version store; every commit that changes
+images, files or categories bumps the generation, which drops all cached
+pages at once. It handles:
+- Caching GET responses keyed by endpoint, URL arguments and query string
+- Bounding the cache by memory, evicting the least recently used pages
+- Bumping the generation whenever content changes are committed
+- Sharing the generation between worker processes through Redis (optional)
+- Counting hits, misses, bypasses and evictions
+"""
+
+import threading
+import time
+from collections import OrderedDict
+from functools import wraps
+
+from flask import current_app, g, request, session
+from sqlalchemy import event
+
+from app.models import db, Blob, Category, Image, Rendition, Subcategory
+from app.taxonomy import LocalVersionStore, RedisVersionStore
+
+# Models whose changes show up on cached pages
+CACHED_MODELS = (Image, Category, Subcategory, Blob, Rendition)
+
+# Rough per-entry bookkeeping cost added to the body size
+ENTRY_OVERHEAD = 256
+
+
+class CachedPage:
+    """
+    A rendered response kept in the cache.
+
+    Attributes:
+        body (bytes): Response body
+        status (int): HTTP status code
+        mimetype (str): Response MIME type
+        size (int): Bytes charged against the memory budget
+        stored_at (float): Monotonic time the page was stored
+    """
+
+    __slots__ = ('body', 'status', 'mimetype', 'size', 'stored_at')
+
+    def __init__(self, body, status, mimetype, size):
+        self.body = body
+        self.status = status
+        self.mimetype = mimetype
+        self.size = size
+        self.stored_at = time.monotonic()
+
+
+class PageCache:
+    """
+    LRU cache of rendered pages bounded by a memory budget.
+
+    Attributes:
+        store: Version store (LocalVersionStore or RedisVersionStore) holding
+            the content generation
+        max_bytes (int): Memory budget for cached bodies
+        ttl (int): Seconds after which a page is rendered again regardless of
+            the generation
+    """
+
+    def __init__(self, store, max_bytes, ttl):
+        self.store = store
+        self.max_bytes = max_bytes
+        self.ttl = ttl
+        self.size = 0
+        self.hits = self.misses = self.bypasses = self.evictions = self.invalidations = 0
+        self._entries = OrderedDict()
+        self._generation = None
+        self._lock = threading.Lock()
+
+    def lookup(self, key):
+        """
+        Return the cached page for a key, if it is still current.
+
+        Args:
+            key (tuple): Cache key built by page_key()
+
+        Returns:
+            tuple: (CachedPage or None, generation the page was looked up at)
+        """
+        generation = self.store.get()
+        with self._lock:
+            if generation is None:
+                # The shared generation is unavailable, so nothing can be trusted
+                self.bypasses += 1
+                return None, None
+            self._sync(generation)
+            entry = self._entries.get(key)
+            if entry is not None and time.monotonic() - entry.stored_at >= self.ttl:
+                self._discard(key)
+                entry = None
+            if entry is None:
+                self.misses += 1
+                return None, generation
+            self._entries.move_to_end(key)
+            self.hits += 1
+            return entry, generation
+
+    def store_page(self, key, generation, response):
+        """
+        Cache a rendered response.
+
+        Pages rendered while the content changed, or larger than a quarter of
+        the budget, are not kept.
+
+        Args:
+            key (tuple): Cache key built by page_key()
+            generation (int): Generation returned by lookup() before rendering
+            response (Response): Rendered response
+        """
+        body = response.get_data()
+        size = len(body) + len(repr(key)) + ENTRY_OVERHEAD
+        if size > self.max_bytes // 4:
+            return
+        with self._lock:
+            if generation != self._generation:
+                return
+            if key in self._entries:
+                self._discard(key)
+            self._entries[key] = CachedPage(body, response.status_code, response.mimetype, size)
+            self.size += size
+            while self.size > self.max_bytes:
+                self._discard(next(iter(self._entries)))
+                self.evictions += 1
+
+    def record_bypass(self):
+        """Count a request that could not use the cache."""
+        with self._lock:
+            self.bypasses += 1
+
+    def invalidate(self):
+        """Bump the shared generation and drop this process's pages."""
+        generation = self.store.bump()
+        with self._lock:
+            self._entries.clear()
+            self.size = 0
+            self._generation = generation
+            self.invalidations += 1
+
+    def stats(self):
+        """
+        Return the cache counters.
+
+        Returns:
+            dict: Hits, misses, bypasses, evictions, invalidations, hit ratio,
+                number of entries and bytes used
+        """
+        with self._lock:
+            lookups = self.hits + self.misses
+            return {
+                'hits': self.hits,
+                'misses': self.misses,
+                'bypasses': self.bypasses,
+                'evictions': self.evictions,
+                'invalidations': self.invalidations,
+                'hit_ratio': round(self.hits / lookups, 4) if lookups else None,
+                'entries': len(self._entries),
+                'bytes': self.size,
+                'max_bytes': self.max_bytes
+            }
+
+    def _sync(self, generation):
+        """Drop every page when another process moved the generation on."""
+        if generation != self._generation:
+            self._entries.clear()
+            self.size = 0
+            self._generation = generation
+
+    def _discard(self, key):
+        self.size -= self._entries.pop(key).size
+
+
+def init_page_cache(app):
+    """
+    Create the application's page cache, unless PAGE_CACHE_ENABLED is off.
+
+    A Redis version store is used when PAGE_CACHE_REDIS_URL is set, so a
+    change committed by any process clears the pages of all of them;
+    otherwise other processes render fresh pages once theirs are
+    PAGE_CACHE_TTL seconds old.
+
+    Args:
+        app (Flask): Application to attach the cache to
+    """
+    if not app.config['PAGE_CACHE_ENABLED']:
+        return
+    url = app.config.get('PAGE_CACHE_REDIS_URL')
+    store = RedisVersionStore(url, key='image-storage:page-generation') if url else LocalVersionStore()
+    app.extensions['page_cache'] = PageCache(store, app.config['PAGE_CACHE_MAX_BYTES'],
+                                             app.config['PAGE_CACHE_TTL'])
+
+
+def page_key():
+    """Build the cache key of the current request."""
+    return (request.endpoint,
+            tuple(sorted((request.view_args or {}).items())),
+            tuple(sorted(request.args.items(multi=True))))
+
+
+def cached_page(view):
+    """
+    Serve a GET view from the page cache, rendering it on a miss.
+
+    Only successful HTML responses are cached. Requests with flashed
+    messages waiting to be shown bypass the cache, since the page would
+    include (and consume) them, as do views that flash or change the session
+    while rendering, or that call skip_page_cache().
+
+    Args:
+        view (callable): View function to wrap
+
+    Returns:
+        callable: Wrapped view function
+    """
+    @wraps(view)
+    def wrapper(*args, **kwargs):
+        cache = current_app.extensions.get('page_cache')
+        if cache is None:
+            return view(*args, **kwargs)
+        if request.method != 'GET' or session.get('_flashes'):
+            cache.record_bypass()
+            return view(*args, **kwargs)
+
+        key = page_key()
+        entry, generation = cache.lookup(key)
+        if entry is not None:
+            response = current_app.response_class(entry.body, status=entry.status, mimetype=entry.mimetype)
+            response.headers['X-Cache'] = 'HIT'
+            return response
+
+        response = current_app.make_response(view(*args, **kwargs))
+        if (generation is not None and response.status_code == 200 and response.mimetype == 'text/html'
+                and not response.direct_passthrough and not session.modified
+                and not g.get('skip_page_cache')):
+            cache.store_page(key, generation, response)
+            response.headers['X-Cache'] = 'MISS'
+        return response
+    return wrapper
+
+
+def skip_page_cache():
+    """
+    Keep the page rendered by the current request out of the cache.
+
+    For pages about to change without a commit that invalidates the cache
+    in every process, e.g. images still being processed: without a shared
+    generation, other processes would keep serving their copy for up to
+    PAGE_CACHE_TTL seconds.
+    """
+    g.skip_page_cache = True
+
+
+def invalidate_pages():
+    """Drop all cached pages, e.g. after changing files outside the database."""
+    cache = current_app.extensions.get('page_cache')
+    if cache is not None:
+        cache.invalidate()
+
+
+@event.listens_for(db.session, 'before_flush')
+def _track_page_changes(session, flush_context, instances):
+    """Remember when a flush writes rows shown on cached pages."""
+    for obj in (*session.new, *session.dirty, *session.deleted):
+        if isinstance(obj, CACHED_MODELS):
+            session.info['pages_changed'] = True
+            return
+
+
+@event.listens_for(db.session, 'do_orm_execute')
+def _track_bulk_page_changes(orm_execute_state):
+    """Remember bulk UPDATE and DELETE statements on rows shown on cached pages."""
+    if orm_execute_state.is_update or orm_execute_state.is_delete:
+        mapper = orm_execute_state.bind_mapper
+        if mapper is not None and issubclass(mapper.class_, CACHED_MODELS):
+            orm_execute_state.session.info['pages_changed'] = True
+
+
+@event.listens_for(db.session, 'after_commit')
+def _invalidate_pages_on_commit(session):
+    """Invalidate the page cache once a content change is committed."""
+    if session.info.pop('pages_changed', False):
+        invalidate_pages()
+
+
+@event.listens_for(db.session, 'after_rollback')
+def _forget_rolled_back_page_changes(session):
+    """Drop the change flag of a rolled back transaction."""
+    session.info.pop('pages_changed', None)
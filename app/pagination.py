@@ -0,0 +1,91 @@
+"""
+Pagination Module for the Image Storage Application.
+
+This module provides keyset (cursor) pagination over images ordered newest
+first. Unlike OFFSET pagination, fetching a deep page costs the same as the
+first one because the query seeks straight to the cursor position through
+the composite (upload_date, id) index. It handles:
+- Encoding and decoding opaque page cursors
+- Fetching one page of results after a cursor
+"""
+
+import base64
+from datetime import datetime
+
+import sqlalchemy as sa
+
+from app.models import Image
+
+
+class KeysetPage:
+    """
+    One page of keyset-paginated results.
+
+    Attributes:
+        items (list): Images on this page
+        per_page (int): Maximum number of images per page
+        has_next (bool): Whether more images follow this page
+        next_cursor (str): Cursor for the following page, or None
+    """
+
+    def __init__(self, items, per_page, has_next):
+        self.items = items
+        self.per_page = per_page
+        self.has_next = has_next
+        self.next_cursor = encode_cursor(items[-1]) if has_next else None
+
+
+def encode_cursor(image):
+    """
+    Build the cursor pointing just past an image.
+
+    Args:
+        image (Image): Last image of the current page
+
+    Returns:
+        str: URL-safe opaque cursor
+    """
+    raw = f'{image.upload_date.isoformat()}|{image.id}'
+    return base64.urlsafe_b64encode(raw.encode()).decode().rstrip('=')
+
+
+def decode_cursor(cursor):
+    """
+    Parse a cursor produced by encode_cursor.
+
+    Args:
+        cursor (str): Opaque cursor from a request
+
+    Returns:
+        tuple: (upload_date, id) of the last seen image, or None if invalid
+    """
+    try:
+        raw = base64.urlsafe_b64decode(cursor + '=' * (-len(cursor) % 4)).decode()
+        upload_date, image_id = raw.split('|')
+        return datetime.fromisoformat(upload_date), int(image_id)
+    except (ValueError, UnicodeDecodeError):
+        return None
+
+
+def keyset_paginate(query, cursor, per_page):
+    """
+    Fetch the page of an Image query that follows a cursor.
+
+    Results are ordered by (upload_date, id) descending; an empty or invalid
+    cursor yields the first page.
+
+    Args:
+        query (Query): Filtered Image query without ORDER BY
+        cursor (str): Cursor from the previous page, or None
+        per_page (int): Number of images per page
+
+    Returns:
+        KeysetPage: The requested page
+    """
+    position = decode_cursor(cursor) if cursor else None
+    if position is not None:
+        query = query.filter(sa.tuple_(Image.upload_date, Image.id) < position)
+
+    # Fetch one extra row to learn whether another page follows
+    items = query.order_by(Image.upload_date.desc(), Image.id.desc()).limit(per_page + 1).all()
+    return KeysetPage(items[:per_page], per_page, len(items) > per_page)
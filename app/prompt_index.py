@@ -0,0 +1,508 @@
+"""
+Prompt Index Module for the Image Storage Application.
+
+This module finds images whose prompts resemble each other. Every prompt is
+turned into a fixed-length vector of hashed word, word-pair and character
+trigram counts, computed locally without any trained model. The vectors
+are stored as int8 rows of a NumPy matrix in a file that every process on
+the host memory-maps, so the index is loaded once by the operating
+system and updates made by one process are seen by all others. It handles:
+- Vectorizing prompts with the hashing trick
+- Storing vectors in a memory-mapped matrix addressed by image ID
+- Top-k cosine similarity queries over the matrix in vectorized blocks,
+  with the candidates reranked exactly
+- Updating the index after commits that add, edit or delete prompts
+- Rebuilding the index from the database, from the CLI or in a
+  background thread of a process that found it missing
+"""
+
+import math
+import os
+import re
+import threading
+import zlib
+from collections import Counter
+
+import numpy as np
+from flask import current_app
+from sqlalchemy import event, inspect
+
+from app.models import db, Image
+
+try:
+    import fcntl
+except ImportError:
+    # Windows runs a single server process (waitress); threads share _lock
+    fcntl = None
+
+# Rows scored per matrix product; bounds the float32 copy a query makes
+QUERY_BLOCK_ROWS = 8192
+
+# Unit vector components are stored as int8 multiples of 1/QUANTIZATION_SCALE
+QUANTIZATION_SCALE = 127
+
+# Candidates fetched per wanted match and reranked with exact vectors
+CANDIDATE_FACTOR = 4
+
+# The matrix grows in steps of this many rows as image IDs increase
+GROWTH_ROWS = 4096
+
+# Prompts vectorized and written per batch while rebuilding
+REBUILD_BATCH_SIZE = 2000
+
+# Feature weights: whole words and word pairs count more than spelling fragments
+WORD_WEIGHT, PAIR_WEIGHT, TRIGRAM_WEIGHT = 1.0, 1.0, 0.5
+
+TOKEN_PATTERN = re.compile(r'\w+')
+
+_lock = threading.Lock()
+
+
+def prompt_features(prompt):
+    """
+    Split a prompt into weighted features.
+
+    Args:
+        prompt (str): Prompt text
+
+    Returns:
+        Counter: Feature strings mapped to their weighted counts
+    """
+    words = TOKEN_PATTERN.findall((prompt or '').lower())
+    features = Counter()
+    for word in words:
+        features['w:' + word] += WORD_WEIGHT
+        padded = f' {word} '
+        for start in range(len(padded) - 2):
+            features['c:' + padded[start:start + 3]] += TRIGRAM_WEIGHT
+    for first, second in zip(words, words[1:]):
+        features[f'p:{first} {second}'] += PAIR_WEIGHT
+    return features
+
+
+def vectorize(prompt, dimensions):
+    """
+    Turn a prompt into a unit-length hashed feature vector.
+
+    Every feature is hashed with CRC-32 (stable across processes, unlike
+    hash()) to one of `dimensions` slots with a sign, so colliding features
+    tend to cancel out instead of adding up. Counts are damped with 1 + log
+    so a repeated word does not dominate.
+
+    Args:
+        prompt (str): Prompt text
+        dimensions (int): Vector length, a power of two
+
+    Returns:
+        ndarray: float32 vector; all zeros for an empty prompt
+    """
+    vector = np.zeros(dimensions, dtype=np.float32)
+    for feature, count in prompt_features(prompt).items():
+        digest = zlib.crc32(feature.encode('utf-8'))
+        weight = 1.0 + math.log(count) if count > 1 else count
+        vector[digest & (dimensions - 1)] += weight if digest & 0x80000000 else -weight
+    norm = np.linalg.norm(vector)
+    if norm:
+        vector /= norm
+    return vector
+
+
+def quantize(vector):
+    """
+    Convert a unit vector to the int8 row stored in the index.
+
+    Components of a unit vector lie in [-1, 1], so one fixed scale fits
+    every row and the dot product of a float query with a stored row,
+    divided by QUANTIZATION_SCALE, is still the cosine similarity.
+
+    Args:
+        vector (ndarray): Unit vector from vectorize()
+
+    Returns:
+        ndarray: int8 vector
+    """
+    return np.rint(vector * QUANTIZATION_SCALE).astype(np.int8)
+
+
+class PromptIndex:
+    """
+    Matrix of prompt vectors memory-mapped from a file, one row per image ID.
+
+    Rows of deleted images and IDs without a prompt are zero and never
+    match. Several processes may read and write the same file; growing it
+    and replacing it are serialized by a lock file.
+
+    Attributes:
+        folder (str): Directory holding the index files
+        dimensions (int): Vector length
+        path (str): Matrix file
+    """
+
+    def __init__(self, folder, dimensions):
+        if dimensions & (dimensions - 1):
+            raise ValueError('PROMPT_INDEX_DIMENSIONS must be a power of two')
+        self.folder = folder
+        self.dimensions = dimensions
+        self.path = os.path.join(folder, f'prompts-{dimensions}d.i8')
+        self._matrix = None
+        self._identity = None
+
+    @property
+    def row_bytes(self):
+        return self.dimensions
+
+    def exists(self):
+        """Return whether the matrix file has been built."""
+        return os.path.exists(self.path)
+
+    def _locked(self):
+        """Return a context manager holding the cross-process lock of the index."""
+        return _FileLock(os.path.join(self.folder, 'prompts.lock'))
+
+    def matrix(self):
+        """
+        Return the memory-mapped matrix, remapping it if the file grew or was replaced.
+
+        Returns:
+            memmap: (rows, dimensions) int8 matrix, or None before the first build
+        """
+        try:
+            stat = os.stat(self.path)
+        except FileNotFoundError:
+            return None
+        identity = (stat.st_ino, stat.st_size)
+        if identity != self._identity:
+            rows = stat.st_size // self.row_bytes
+            self._matrix = np.memmap(self.path, dtype=np.int8, mode='r+', shape=(rows, self.dimensions)) \
+                if rows else None
+            self._identity = identity
+        return self._matrix
+
+    def _ensure_rows(self, rows):
+        """Grow the file to hold at least `rows` rows and return the remapped matrix."""
+        matrix = self.matrix()
+        if matrix is not None and len(matrix) >= rows:
+            return matrix
+        with self._locked():
+            capacity = -(-rows // GROWTH_ROWS) * GROWTH_ROWS
+            # Windows cannot resize a file this process has mapped
+            self._matrix = self._identity = None
+            with open(self.path, 'r+b') as file:
+                # Another process may have grown it further meanwhile; never shrink
+                if os.fstat(file.fileno()).st_size < capacity * self.row_bytes:
+                    file.truncate(capacity * self.row_bytes)
+        return self.matrix()
+
+    def update(self, vectors):
+        """
+        Store or clear the vectors of some images.
+
+        Does nothing before the index is first built; the build reads every
+        prompt from the database.
+
+        Args:
+            vectors (dict): Image ID mapped to its vector, or None to clear it
+        """
+        if not vectors or not self.exists():
+            return
+        with _lock:
+            matrix = self._ensure_rows(max(vectors) + 1)
+            for image_id, vector in vectors.items():
+                matrix[image_id] = 0 if vector is None else quantize(vector)
+
+    def search(self, queries, k, exclude=()):
+        """
+        Find the rows most similar to each query vector.
+
+        The matrix is scored in blocks of QUERY_BLOCK_ROWS rows with one
+        matrix product per block for all queries, keeping the k best of
+        every block with argpartition. Vectors are unit length, so the dot
+        product is the cosine similarity.
+
+        Args:
+            queries (ndarray): (queries, dimensions) float32 unit vectors
+            k (int): Matches per query
+            exclude (iterable): Image IDs never returned, e.g. the query images
+
+        Returns:
+            list: Per query, (score, image ID) tuples, best first
+        """
+        matrix = self.matrix()
+        queries = np.atleast_2d(np.asarray(queries, dtype=np.float32))
+        if matrix is None or k <= 0:
+            return [[] for _ in queries]
+
+        exclude = [image_id for image_id in exclude if image_id < len(matrix)]
+        best_scores = np.full((len(queries), 0), -np.inf, dtype=np.float32)
+        best_ids = np.zeros((len(queries), 0), dtype=np.int64)
+        for start in range(0, len(matrix), QUERY_BLOCK_ROWS):
+            block = np.asarray(matrix[start:start + QUERY_BLOCK_ROWS], dtype=np.float32)
+            scores = queries @ block.T
+            for image_id in exclude:
+                if start <= image_id < start + len(block):
+                    scores[:, image_id - start] = -np.inf
+            if scores.shape[1] > k:
+                top = np.argpartition(scores, -k, axis=1)[:, -k:]
+                scores = np.take_along_axis(scores, top, axis=1)
+            else:
+                top = np.broadcast_to(np.arange(scores.shape[1]), scores.shape)
+            best_scores = np.concatenate([best_scores, scores], axis=1)
+            best_ids = np.concatenate([best_ids, top + start], axis=1)
+            if best_scores.shape[1] > k:
+                keep = np.argpartition(best_scores, -k, axis=1)[:, -k:]
+                best_scores = np.take_along_axis(best_scores, keep, axis=1)
+                best_ids = np.take_along_axis(best_ids, keep, axis=1)
+
+        results = []
+        for scores, ids in zip(best_scores, best_ids):
+            order = np.argsort(-scores)
+            results.append([(float(scores[i]) / QUANTIZATION_SCALE, int(ids[i])) for i in order if scores[i] > 0])
+        return results
+
+    def rebuild(self, rows):
+        """
+        Build the matrix file from scratch and swap it in atomically.
+
+        Processes that have the old file mapped switch to the new one on
+        their next query. The caller holds the index lock.
+
+        Args:
+            rows (iterable): Batches of (image ID, prompt) tuples in ascending
+                ID order
+
+        Returns:
+            int: Number of prompts indexed
+        """
+        os.makedirs(self.folder, exist_ok=True)
+        temporary = f'{self.path}.{os.getpid()}.tmp'
+        indexed = 0
+        try:
+            with open(temporary, 'wb'):
+                pass
+            matrix = None
+            for batch in rows:
+                needed = -(-(batch[-1][0] + 1) // GROWTH_ROWS) * GROWTH_ROWS
+                if matrix is None or len(matrix) < needed:
+                    if matrix is not None:
+                        matrix.flush()
+                    with open(temporary, 'r+b') as file:
+                        file.truncate(needed * self.row_bytes)
+                    matrix = np.memmap(temporary, dtype=np.int8, mode='r+', shape=(needed, self.dimensions))
+                for image_id, prompt in batch:
+                    matrix[image_id] = quantize(vectorize(prompt, self.dimensions))
+                indexed += len(batch)
+            if matrix is None:
+                with open(temporary, 'r+b') as file:
+                    file.truncate(GROWTH_ROWS * self.row_bytes)
+            else:
+                matrix.flush()
+                del matrix
+            self._matrix = self._identity = None
+            os.replace(temporary, self.path)
+        finally:
+            if os.path.exists(temporary):
+                os.remove(temporary)
+        return indexed
+
+
+class _FileLock:
+    """Exclusive lock on a file, shared by the processes of one host (no-op without fcntl)."""
+
+    def __init__(self, path):
+        self.path = path
+        self._file = None
+
+    def __enter__(self):
+        if fcntl is not None:
+            self._file = open(self.path, 'a')
+            fcntl.flock(self._file, fcntl.LOCK_EX)
+        return self
+
+    def __exit__(self, *exc_info):
+        if self._file is not None:
+            fcntl.flock(self._file, fcntl.LOCK_UN)
+            self._file.close()
+            self._file = None
+
+
+def get_prompt_index():
+    """
+    Return this process's handle on the prompt index.
+
+    The file may not exist yet; see build_prompt_index_in_background().
+
+    Returns:
+        PromptIndex: Index of the current application
+    """
+    index = current_app.extensions.get('prompt_index')
+    if index is None:
+        with _lock:
+            index = current_app.extensions.get('prompt_index')
+            if index is None:
+                index = PromptIndex(current_app.config['PROMPT_INDEX_FOLDER'],
+                                    current_app.config['PROMPT_INDEX_DIMENSIONS'])
+                current_app.extensions['prompt_index'] = index
+    return index
+
+
+def build_prompt_index_in_background(app):
+    """
+    Start building a missing prompt index in a background thread.
+
+    Requests never build the index themselves; they skip the similar
+    prompts until it exists. One build runs per process at a time, and the
+    processes of a host wait for each other on the index lock, so all but
+    the first find the index built and return. A failed build is started
+    again by a later request.
+
+    Args:
+        app (Flask): Application whose index to build
+    """
+    with _lock:
+        builder = app.extensions.get('prompt_index_builder')
+        # Threads do not survive a fork, so a builder copied from the parent is not alive
+        if builder is not None and builder.is_alive():
+            return
+        builder = threading.Thread(target=_build_missing_index, args=(app,),
+                                   name='prompt-index-builder', daemon=True)
+        app.extensions['prompt_index_builder'] = builder
+    builder.start()
+
+
+def _build_missing_index(app):
+    with app.app_context():
+        try:
+            indexed = rebuild_prompt_index(force=False)
+            if indexed:
+                app.logger.info('Built the prompt index with %d prompts', indexed)
+        except Exception:
+            app.logger.exception('Could not build the prompt index')
+        finally:
+            db.session.remove()
+
+
+def _prompt_batches():
+    """Yield (image ID, prompt) batches of every image with a prompt, by ascending ID."""
+    last_id = 0
+    while True:
+        batch = db.session.query(Image.id, Image.prompt) \
+            .filter(Image.id > last_id, Image.prompt.isnot(None), Image.prompt != '') \
+            .order_by(Image.id).limit(REBUILD_BATCH_SIZE).all()
+        if not batch:
+            return
+        yield batch
+        last_id = batch[-1][0]
+
+
+def rebuild_prompt_index(index=None, force=True):
+    """
+    Rebuild the prompt index from the prompts in the database.
+
+    Prompts committed while the rebuild runs may be missed; run it again
+    after bulk changes made outside the application.
+
+    Args:
+        index (PromptIndex, optional): Index to rebuild, defaults to the
+            application's
+        force (bool): Rebuild an index that exists already
+
+    Returns:
+        int: Number of prompts indexed
+    """
+    index = index or get_prompt_index()
+    os.makedirs(index.folder, exist_ok=True)
+    with index._locked():
+        # Another process may have built it while this one waited for the lock
+        if not force and index.exists():
+            return 0
+        return index.rebuild(_prompt_batches())
+
+
+def find_similar_prompts(image, limit=6, min_score=None):
+    """
+    Find the images whose prompts are most similar to an image's prompt.
+
+    The index returns CANDIDATE_FACTOR times as many candidates as needed,
+    which are then scored again with their exact vectors, recomputed from
+    the prompts in the database. This corrects the ranking errors of the
+    int8 rows and drops images deleted since they were indexed.
+
+    Args:
+        image (Image): Image to compare against
+        limit (int): Maximum number of images to return
+        min_score (float, optional): Lowest cosine similarity, defaults to
+            PROMPT_SIMILARITY_MIN_SCORE
+
+    Returns:
+        list: (Image, score) tuples, most similar first
+    """
+    if min_score is None:
+        min_score = current_app.config['PROMPT_SIMILARITY_MIN_SCORE']
+    index = get_prompt_index()
+    if not index.exists():
+        build_prompt_index_in_background(current_app._get_current_object())
+        return []
+    query = vectorize(image.prompt, index.dimensions)
+    if not query.any():
+        return []
+
+    candidates = [image_id for _, image_id in
+                  index.search(query, limit * CANDIDATE_FACTOR, exclude=[image.id])[0]]
+    if not candidates:
+        return []
+    prompts = db.session.query(Image.id, Image.prompt).filter(Image.id.in_(candidates))
+    scored = sorted(((float(vectorize(prompt, index.dimensions) @ query), image_id)
+                     for image_id, prompt in prompts), reverse=True)
+    matches = [(score, image_id) for score, image_id in scored if score >= min_score][:limit]
+    if not matches:
+        return []
+    images = {i.id: i for i in Image.card_query().filter(Image.id.in_([i for _, i in matches]))}
+    return [(images[image_id], score) for score, image_id in matches if image_id in images]
+
+
+def record_prompt_changes(changes):
+    """
+    Remember prompts changed by bulk statements for the index update after commit.
+
+    Args:
+        changes (dict): Image ID mapped to its new prompt, or None when deleted
+    """
+    db.session.info.setdefault('prompt_changes', {}).update(changes)
+
+
+@event.listens_for(db.session, 'after_flush')
+def _track_prompt_changes(session, flush_context):
+    """Remember the prompts a flush added, changed or removed."""
+    changes = {}
+    for obj in session.new:
+        if isinstance(obj, Image) and obj.prompt:
+            changes[obj.id] = obj.prompt
+    for obj in session.dirty:
+        if isinstance(obj, Image) and inspect(obj).attrs.prompt.history.has_changes():
+            changes[obj.id] = obj.prompt
+    for obj in session.deleted:
+        if isinstance(obj, Image):
+            changes[obj.id] = None
+    if changes:
+        session.info.setdefault('prompt_changes', {}).update(changes)
+
+
+@event.listens_for(db.session, 'after_commit')
+def _update_prompt_index(session):
+    """Write the vectors of committed prompt changes into the index."""
+    changes = session.info.pop('prompt_changes', None)
+    if not changes:
+        return
+    index = get_prompt_index()
+    try:
+        index.update({image_id: vectorize(prompt, index.dimensions) if prompt else None
+                      for image_id, prompt in changes.items()})
+    except OSError as e:
+        # The index is derived data; a rebuild recovers anything missed
+        current_app.logger.warning('Could not update the prompt index: %s', e)
+
+
+@event.listens_for(db.session, 'after_rollback')
+def _forget_rolled_back_prompts(session):
+    """Drop the prompt changes of a rolled back transaction."""
+    session.info.pop('prompt_changes', None)
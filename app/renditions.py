@@ -0,0 +1,268 @@
+"""
+Rendition Module for the Image Storage Application.
+
+This module generates the fixed-width derivatives served by the gallery and
+search grids instead of the full-size originals. It handles:
+- Resizing an original into every configured rendition size with Pillow
+- Putting the rendered files into the renditions storage backend
+- Recording generated renditions against the Blob they were rendered from
+- Backfilling missing renditions for existing blobs across a process pool
+"""
+
+import os
+import shutil
+import tempfile
+import uuid
+from concurrent.futures import ProcessPoolExecutor, as_completed
+
+from flask import current_app
+from PIL import Image as PILImage, ImageOps
+
+from app.models import db, Blob, Rendition
+from app.storage_backends import get_storage, storage_from_settings
+
+# Formats Pillow can decode; vector images (svg) are served as-is
+RASTER_EXTENSIONS = {'png', 'jpg', 'jpeg', 'gif', 'webp'}
+
+
+def is_raster(extension):
+    """
+    Check whether renditions can be generated for a file type.
+
+    Args:
+        extension (str): File extension without the dot
+
+    Returns:
+        bool: True if the file is a raster format Pillow can resize
+    """
+    return extension.lower() in RASTER_EXTENSIONS
+
+
+def rendition_filename(storage_key, kind):
+    """
+    Build the storage key of a blob's rendition in the renditions store.
+
+    Args:
+        storage_key (str): Storage key of the blob the rendition is generated from
+        kind (str): Rendition kind, e.g. 'thumb'
+
+    Returns:
+        str: Sharded path of the WebP rendition
+    """
+    return f'{storage_key}.{kind}.webp'
+
+
+def prepare_image(original, max_width):
+    """
+    Decode an opened original ready for resizing.
+
+    JPEGs are decoded at a reduced scale when that still covers `max_width`,
+    EXIF orientation is applied and the pixels are converted to RGB or RGBA.
+
+    Args:
+        original (PIL.Image.Image): Image opened with Pillow
+        max_width (int): Largest width that will be produced from it
+
+    Returns:
+        PIL.Image.Image: Upright RGB or RGBA image
+    """
+    original.draft('RGB', (max_width, max_width))
+    img = ImageOps.exif_transpose(original)
+    if img.mode not in ('RGB', 'RGBA'):
+        has_alpha = img.mode in ('LA', 'PA') or 'transparency' in img.info
+        img = img.convert('RGBA' if has_alpha else 'RGB')
+    return img
+
+
+def render_renditions(source_path, targets, quality):
+    """
+    Decode an original once and write every requested rendition.
+
+    This function only touches the filesystem so it can run in a worker
+    process. Originals narrower than a target width are not upscaled.
+
+    Args:
+        source_path (str): Path to the original image
+        targets (list): (kind, width, dest_path) tuples, one per rendition
+        quality (int): WebP encoder quality
+
+    Returns:
+        list: (kind, width, height) tuples for the written renditions
+    """
+    results = []
+    with PILImage.open(source_path) as original:
+        img = prepare_image(original, max(width for _, width, _ in targets))
+
+        for kind, width, dest_path in sorted(targets, key=lambda t: t[1], reverse=True):
+            resized = img
+            if img.width > width:
+                height = max(1, round(img.height * width / img.width))
+                resized = img.resize((width, height), PILImage.LANCZOS)
+
+            # Write to a temporary file first so readers never see partial output
+            os.makedirs(os.path.dirname(dest_path), exist_ok=True)
+            tmp_path = f'{dest_path}.{uuid.uuid4().hex}.tmp'
+            resized.save(tmp_path, 'WEBP', quality=quality, method=4)
+            os.replace(tmp_path, dest_path)
+            results.append((kind, resized.width, resized.height))
+    return results
+
+
+def store_renditions(source_path, storage_key, kinds, sizes, quality, settings, staging_folder):
+    """
+    Render renditions of an original and put them into the renditions store.
+
+    The files are written to a private staging folder first, then moved or
+    uploaded under their rendition keys. Like render_renditions, this only
+    needs plain arguments so it can run in a worker process.
+
+    Args:
+        source_path (str): Local path to the original image
+        storage_key (str): Storage key of the blob
+        kinds (iterable): Rendition kinds to render
+        sizes (dict): Rendition kind mapped to its width
+        quality (int): WebP encoder quality
+        settings (dict): Settings of the renditions store
+        staging_folder (str): Local folder for the files being rendered
+
+    Returns:
+        list: (kind, width, height) tuples for the stored renditions
+    """
+    store = storage_from_settings(settings)
+    os.makedirs(staging_folder, exist_ok=True)
+    staging = tempfile.mkdtemp(dir=staging_folder)
+    try:
+        targets = [(kind, sizes[kind], os.path.join(staging, f'{kind}.webp')) for kind in kinds]
+        results = render_renditions(source_path, targets, quality)
+        for kind, _, path in targets:
+            store.put_file(path, rendition_filename(storage_key, kind), move=True)
+    finally:
+        shutil.rmtree(staging, ignore_errors=True)
+    return results
+
+
+def staging_folder():
+    """Return the local folder renditions are rendered into before being stored."""
+    return os.path.join(current_app.config['UPLOAD_FOLDER'], 'tmp')
+
+
+def backfill_blob(storage_key, kinds, sizes, quality, settings, staging):
+    """
+    Fetch a stored original and store its missing renditions.
+
+    Runs in a backfill worker process.
+
+    Args:
+        storage_key (str): Storage key of the blob
+        kinds (list): Rendition kinds to render
+        sizes (dict): Rendition kind mapped to its width
+        quality (int): WebP encoder quality
+        settings (dict): Settings of the 'originals' and 'renditions' stores
+        staging (str): Local folder for the files being rendered
+
+    Returns:
+        list: (kind, width, height) tuples for the stored renditions
+    """
+    with storage_from_settings(settings['originals']).local_path(storage_key) as source_path:
+        return store_renditions(source_path, storage_key, kinds, sizes, quality,
+                                settings['renditions'], staging)
+
+
+def record_renditions(blob, results):
+    """
+    Create or update Rendition rows for freshly rendered files.
+
+    Args:
+        blob (Blob): Blob the renditions were generated from
+        results (list): (kind, width, height) tuples from render_renditions
+    """
+    existing = {r.kind: r for r in blob.renditions}
+    for kind, width, height in results:
+        rendition = existing.get(kind)
+        if rendition is None:
+            rendition = Rendition(kind=kind, filename=rendition_filename(blob.storage_key, kind))
+            blob.renditions.append(rendition)
+        rendition.width = width
+        rendition.height = height
+
+
+def generate_renditions(blob, source_path=None):
+    """
+    Generate all configured renditions for a blob.
+
+    The new Rendition rows are added to the current session; committing is
+    left to the caller so they land in its transaction.
+
+    Args:
+        blob (Blob): Blob to generate renditions for
+        source_path (str, optional): Local path to the original, defaults to
+            a local copy of the stored file
+    """
+    if not is_raster(blob.extension):
+        return
+
+    if source_path is None:
+        with blob.local_path() as path:
+            return generate_renditions(blob, path)
+
+    sizes = current_app.config['RENDITION_SIZES']
+    results = store_renditions(source_path, blob.storage_key, sizes, sizes,
+                               current_app.config['RENDITION_QUALITY'],
+                               current_app.extensions['storage_settings']['renditions'], staging_folder())
+    record_renditions(blob, results)
+
+
+def backfill_renditions(workers=None, force=False, batch_size=100, echo=print):
+    """
+    Regenerate missing renditions for existing blobs in parallel.
+
+    Downloading and resizing are fanned out over a process pool while the
+    database writes stay in this process and are committed in batches.
+
+    Args:
+        workers (int, optional): Number of worker processes (defaults to CPU count)
+        force (bool): Regenerate every rendition, not only missing ones
+        batch_size (int): Number of blobs to commit per transaction
+        echo (callable): Function used to report progress
+
+    Returns:
+        tuple: (number of blobs processed, number of failures)
+    """
+    sizes = current_app.config['RENDITION_SIZES']
+    quality = current_app.config['RENDITION_QUALITY']
+    settings = current_app.extensions['storage_settings']
+    originals, renditions = get_storage(), get_storage('renditions')
+
+    jobs = {}
+    for blob in Blob.query.options(db.selectinload(Blob.renditions)).order_by(Blob.id):
+        if not is_raster(blob.extension):
+            continue
+        have = set() if force else {
+            r.kind for r in blob.renditions if renditions.exists(r.filename)
+        }
+        missing = [kind for kind in sizes if kind not in have]
+        if missing and originals.exists(blob.storage_key):
+            jobs[blob.id] = (blob.storage_key, missing)
+
+    processed = failed = 0
+    with ProcessPoolExecutor(max_workers=workers) as pool:
+        futures = {
+            pool.submit(backfill_blob, storage_key, missing, sizes, quality, settings, staging_folder()): blob_id
+            for blob_id, (storage_key, missing) in jobs.items()
+        }
+        for future in as_completed(futures):
+            blob_id = futures[future]
+            try:
+                results = future.result()
+            except Exception as e:
+                failed += 1
+                echo(f'Blob {blob_id}: {e}')
+                continue
+
+            record_renditions(db.session.get(Blob, blob_id), results)
+            processed += 1
+            if processed % batch_size == 0:
+                db.session.commit()
+                echo(f'{processed}/{len(jobs)} files processed')
+    db.session.commit()
+    return processed, failed
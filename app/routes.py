@@ -4,42 +4,89 @@ Routes Module for the Image Storage Application.
 This module defines all the URL routes and view functions for the application.
 It handles:
 - Image upload, viewing, editing, and deletion
+- Bulk moving, editing and deleting of selected or matching images
 - Category and subcategory management
 - Image search functionality
-- API endpoints for dynamic content
+- API endpoints for dynamic content and background processing status
 """
 
-import os
+from urllib.parse import parse_qsl
+
 from flask import Blueprint, current_app, render_template, request, redirect, url_for, flash, abort, jsonify
+from werkzeug.datastructures import MultiDict
 from werkzeug.utils import secure_filename
-from sqlalchemy import or_
 
 from app.models import db, Category, Subcategory, Image
+from app.jobs import latest_job
 from app.forms import ImageUploadForm, ImageEditForm, SearchForm, CategoryForm, SubcategoryForm
+from app.storage import store_upload, streams_uploads, discard_new_blob
+from app.validation import InvalidImage
+from app.uploads import create_image
+from app.search import filter_images, has_filters
+from app.pagination import keyset_paginate, encode_cursor
+from app.taxonomy import get_taxonomy
+from app.media import rendition_url
+from app.similarity import find_similar
+from app.prompt_index import find_similar_prompts
+from app.page_cache import cached_page, skip_page_cache
+from app.bulk import delete_images, move_category_images, update_images
 
 bp = Blueprint('main', __name__)
 
 @bp.route('/')
+@cached_page
 def index():
     """
     Display the home page with paginated recent images.
     
+    Pages are addressed either by number (`page`) or, for cheap deep
+    browsing, by a keyset cursor (`cursor`) on (upload_date, id).
+    
     Returns:
         str: Rendered index.html template with paginated images
     """
     try:
-        page = request.args.get('page', 1, type=int)
-        images = Image.query.order_by(Image.upload_date.desc()).paginate(
-            page=page, 
-            per_page=current_app.config['IMAGES_PER_PAGE']
-        )
-        return render_template('index.html', images=images)
+        images, next_cursor = paginate_images(Image.card_query())
+        return render_template('index.html', images=images, next_cursor=next_cursor,
+                               taxonomy=get_taxonomy())
     except Exception as e:
         flash(f'Error loading images: {str(e)}', 'error')
-    finally:
-        db.session.close()
+
+def paginate_images(query, rank_order=()):
+    """
+    Paginate an Image query according to the request arguments.
+    
+    A `cursor` argument selects keyset pagination; otherwise numbered pages
+    are used. Numbered pages in date order also expose a cursor for the
+    following page so "Next" links never fall back to OFFSET scans.
+    Relevance-ranked queries only support numbered pages.
+    
+    Args:
+        query (Query): Filtered Image query without ORDER BY
+        rank_order (list): ORDER BY clauses ranking search matches, if any
+        
+    Returns:
+        tuple: (Pagination or KeysetPage, cursor for the next page or None)
+    """
+    per_page = current_app.config['IMAGES_PER_PAGE']
+    
+    if 'cursor' in request.args and not rank_order:
+        images = keyset_paginate(query, request.args.get('cursor'), per_page)
+        return images, images.next_cursor
+    
+    page = request.args.get('page', 1, type=int)
+    images = query.order_by(*rank_order, Image.upload_date.desc(), Image.id.desc()).paginate(
+        page=page,
+        per_page=per_page,
+        error_out=False
+    )
+    next_cursor = None
+    if images.has_next and images.items and not rank_order:
+        next_cursor = encode_cursor(images.items[-1])
+    return images, next_cursor
 
 @bp.route('/upload', methods=['GET', 'POST'])
+@streams_uploads
 def upload_image():
     """
     Handle image upload functionality.
@@ -54,21 +101,22 @@ def upload_image():
     
     try:
         # Dynamically populate category and subcategory choices
-        form.category.choices = [(c.id, c.name) for c in Category.query.order_by(Category.name).all()]
-        form.subcategory.choices = [(s.id, s.name) for s in Subcategory.query.order_by(Subcategory.name).all()]
+        taxonomy = get_taxonomy()
+        form.category.choices = taxonomy.category_choices()
+        form.subcategory.choices = taxonomy.subcategory_choices()
         
         if form.validate_on_submit():
+            blob = None
             try:
-                # Handle file upload
+                # Stream the file into content-addressed storage
                 file = form.image.data
                 filename = secure_filename(file.filename)
-                filepath = os.path.join(current_app.config['UPLOAD_FOLDER'], filename)
-                
-                # Save the file
-                file.save(filepath)
+                blob = store_upload(file, filename)
+                is_duplicate = blob.refcount != 1
                 
-                # Create new image record
-                new_image = Image(
+                # Create new image record and its renditions
+                new_image = create_image(
+                    blob,
                     name=form.name.data,
                     filename=filename,
                     description=form.description.data,
@@ -77,29 +125,36 @@ def upload_image():
                     subcategory_id=form.subcategory.data
                 )
                 
-                db.session.add(new_image)
                 db.session.commit()
                 
+                if is_duplicate:
+                    flash('An identical file was already stored; the existing copy is shared.', 'info')
                 flash('Image uploaded successfully!', 'success')
                 return redirect(url_for('main.image_details', image_id=new_image.id))
                 
+            except InvalidImage as e:
+                # Raised while the file was streamed, before anything was stored
+                form.image.errors.append(str(e))
             except Exception as e:
                 flash(f'Error uploading image: {str(e)}', 'error')
                 db.session.rollback()
+                discard_new_blob(blob)
         
         return render_template('upload.html', form=form)
         
     except Exception as e:
         flash(f'Error: {str(e)}', 'error')
         return redirect(url_for('main.index'))
-    finally:
-        db.session.close()
 
 @bp.route('/image/<int:image_id>')
+@cached_page
 def image_details(image_id):
     """
     Display details of a specific image.
     
+    Visually similar images and images with similar prompts are listed
+    below it, and close visual matches are flagged as possible duplicates.
+    
     Args:
         image_id (int): ID of the image to display
         
@@ -107,12 +162,93 @@ def image_details(image_id):
         str: Rendered image details template
     """
     try:
-        image = Image.query.get_or_404(image_id)
-        return render_template('image_details.html', image=image)
+        image = Image.card_query().get_or_404(image_id)
+        similar = find_similar(image)
+        duplicate_distance = current_app.config['DUPLICATE_MAX_DISTANCE']
+        status = processing_status(image.id)
+        if status[0] in ('queued', 'running'):
+            # The page polls until processing ends and then reloads, which
+            # must not be answered with a cached copy of this page
+            skip_page_cache()
+        try:
+            similar_prompts = find_similar_prompts(image)
+        except OSError as e:
+            # The prompt index is optional on this page
+            current_app.logger.warning('Prompt index unavailable: %s', e)
+            similar_prompts = []
+        return render_template('image_details.html', image=image,
+                               processing_status=status,
+                               similar=similar,
+                               similar_prompts=similar_prompts,
+                               duplicates=[i for i, distance in similar if distance <= duplicate_distance])
     except Exception as e:
         flash(f'Error loading image: {str(e)}', 'error')
-    finally:
-        db.session.close()
+
+def processing_status(image_id):
+    """
+    Return the state of an image's background processing.
+    
+    Args:
+        image_id (int): ID of the image
+        
+    Returns:
+        tuple: ('ready', 'queued', 'running' or 'failed', latest process_image Job or None)
+    """
+    job = latest_job(image_id, 'process_image')
+    if job is None or job.status == 'succeeded':
+        return 'ready', job
+    return job.status, job
+
+@bp.route('/api/images/<int:image_id>/status')
+def image_status(image_id):
+    """
+    API endpoint reporting an image's background processing progress.
+    
+    The details page polls this after an upload until the renditions and
+    dimensions are available. Once the image is hashed, images that look
+    like near-duplicates of it are listed so upload clients can warn.
+    
+    Args:
+        image_id (int): ID of the image
+        
+    Returns:
+        str: JSON response with the status and, once ready, the derived data
+    """
+    image = Image.card_query().get_or_404(image_id)
+    status, job = processing_status(image.id)
+    duplicates = find_similar(image, current_app.config['DUPLICATE_MAX_DISTANCE'])
+    response = jsonify({
+        'image_id': image.id,
+        'status': status,
+        'attempts': job.attempts if job else 0,
+        'error': job.error if job and status == 'failed' else None,
+        'width': image.width,
+        'height': image.height,
+        'thumb_url': rendition_url(image, 'thumb'),
+        'preview_url': rendition_url(image, 'preview'),
+        'duplicates': [{
+            'id': duplicate.id,
+            'name': duplicate.name,
+            'distance': distance,
+            'url': url_for('main.image_details', image_id=duplicate.id)
+        } for duplicate, distance in duplicates]
+    })
+    response.cache_control.no_store = True
+    return response
+
+@bp.route('/api/cache/stats')
+def page_cache_stats():
+    """
+    API endpoint reporting the page cache counters of this worker process.
+    
+    Returns:
+        str: JSON response with hits, misses, bypasses, evictions,
+        invalidations, hit ratio, entries and bytes used
+    """
+    cache = current_app.extensions.get('page_cache')
+    response = jsonify({'enabled': cache is not None, **(cache.stats() if cache else {})})
+    response.cache_control.no_store = True
+    return response
 
 @bp.route('/image/<int:image_id>/edit', methods=['GET', 'POST'])
 def edit_image(image_id):
@@ -126,12 +262,14 @@ def edit_image(image_id):
         str: Rendered edit form or redirect to image details
     """
     try:
-        image = Image.query.get_or_404(image_id)
+        # Eager-load the blob and renditions the template builds media URLs from
+        image = Image.card_query().filter(Image.id == image_id).first_or_404()
         form = ImageEditForm(obj=image)
         
         # Populate category and subcategory choices
-        form.category.choices = [(c.id, c.name) for c in Category.query.order_by(Category.name).all()]
-        form.subcategory.choices = [(s.id, s.name) for s in Subcategory.query.order_by(Subcategory.name).all()]
+        taxonomy = get_taxonomy()
+        form.category.choices = taxonomy.category_choices()
+        form.subcategory.choices = taxonomy.subcategory_choices()
         
         if form.validate_on_submit():
             try:
@@ -152,8 +290,6 @@ def edit_image(image_id):
     except Exception as e:
         flash(f'Error loading image: {str(e)}', 'error')
         return redirect(url_for('main.index'))
-    finally:
-        db.session.close()
     
     return render_template('edit_image.html', form=form, image=image)
 
@@ -182,16 +318,103 @@ def delete_image(image_id):
     except Exception as e:
         db.session.rollback()
         flash(f'Error deleting image: {str(e)}', 'error')
-    finally:
-        db.session.close()
     
     return redirect(url_for('main.index'))
 
+def selected_image_ids():
+    """
+    Return the IDs of the images a bulk request applies to.
+    
+    These are the checked `ids`, or with `scope=all` every image matching
+    the search arguments in `filters`. `scope=all` is refused unless the
+    filters are valid and at least one of them is set, so a single request
+    cannot act on the whole library.
+    
+    Returns:
+        list: Image IDs, or None if `scope=all` came without valid filters
+    """
+    if request.form.get('scope') != 'all':
+        return list(dict.fromkeys(request.form.getlist('ids', type=int)))
+    
+    form = SearchForm(MultiDict(parse_qsl(request.form.get('filters', ''))), meta={'csrf': False})
+    taxonomy = get_taxonomy()
+    form.category.choices = [(0, 'All Categories')] + taxonomy.category_choices()
+    form.subcategory.choices = [(0, 'All Subcategories')] + taxonomy.subcategory_choices()
+    if not form.validate():
+        return None
+    filters = search_filters(form)
+    if not has_filters(**filters):
+        return None
+    query, _ = filter_images(Image.query.with_entities(Image.id), **filters)
+    return [image_id for (image_id,) in query]
+
+@bp.route('/images/bulk', methods=['POST'])
+def bulk_images():
+    """
+    Move, edit or delete several images at once.
+    
+    The `action` is 'move' (to `subcategory_id`), 'edit' (set the
+    non-empty `description` and `prompt`) or 'delete'. All changes are
+    made with set-based statements in one transaction.
+    
+    Returns:
+        str: Redirect back to the page the images were selected on
+    """
+    next_url = request.form.get('next', '')
+    if not next_url.startswith('/') or next_url.startswith('//'):
+        next_url = url_for('main.index')
+    action = request.form.get('action')
+    
+    try:
+        ids = selected_image_ids()
+        if ids is None:
+            flash('Search for the images first; actions on all matching images need a valid filter.', 'warning')
+            return redirect(next_url)
+        if not ids:
+            flash('Select at least one image.', 'warning')
+            return redirect(next_url)
+        
+        if action == 'move':
+            subcategory = db.session.get(Subcategory, request.form.get('subcategory_id', 0, type=int))
+            if subcategory is None:
+                flash('Choose the subcategory to move the images to.', 'danger')
+                return redirect(next_url)
+            count = update_images(ids, {'category_id': subcategory.category_id,
+                                        'subcategory_id': subcategory.id})
+            message = f'Moved {count} images to {subcategory.parent_category.name} > {subcategory.name}.'
+        elif action == 'edit':
+            changes = {field: request.form[field].strip() for field in ('description', 'prompt')
+                       if request.form.get(field, '').strip()}
+            if not changes:
+                flash('Enter a description or prompt to apply.', 'warning')
+                return redirect(next_url)
+            if len(changes.get('description', '')) > 1000 or len(changes.get('prompt', '')) > 500:
+                flash('Description cannot exceed 1000 characters and prompt 500 characters.', 'danger')
+                return redirect(next_url)
+            count = update_images(ids, changes)
+            message = f'Updated {count} images.'
+        elif action == 'delete':
+            count = delete_images(ids)
+            message = f'Deleted {count} images.'
+        else:
+            flash('Unknown bulk action.', 'danger')
+            return redirect(next_url)
+        
+        db.session.commit()
+        flash(message, 'success')
+    except Exception as e:
+        db.session.rollback()
+        flash(f'Error updating images: {str(e)}', 'error')
+    
+    return redirect(next_url)
+
 @bp.route('/api/subcategories/<int:category_id>')
 def get_subcategories(category_id):
     """
     API endpoint to get subcategories for a category.
     
+    Served from the taxonomy cache with an ETag derived from its version.
+    
     Args:
         category_id (int): ID of the category
         
@@ -199,15 +422,18 @@ def get_subcategories(category_id):
         str: JSON response with subcategory data
     """
     try:
-        subcategories = Subcategory.query.filter_by(category_id=category_id).order_by(Subcategory.name).all()
-        return jsonify([{
-            'id': sub.id,
-            'name': sub.name
-        } for sub in subcategories])
+        taxonomy = get_taxonomy()
+        response = jsonify([{
+            'id': sub_id,
+            'name': name
+        } for sub_id, name in taxonomy.subcategory_choices(category_id)])
+        
+        # Clients revalidate with the taxonomy version and get a 304 until it changes
+        response.set_etag(f'taxonomy-{taxonomy.version}-{category_id}')
+        response.cache_control.no_cache = True
+        return response.make_conditional(request)
     except Exception as e:
         flash(f'Error loading subcategories: {str(e)}', 'error')
-    finally:
-        db.session.close()
 
 @bp.route('/search', methods=['GET'])
 def search_images():
@@ -215,10 +441,13 @@ def search_images():
     Search images by various criteria.
     
     Supported search parameters:
-    - Query string (searches name and description)
+    - Query string (full-text search over name, description and prompt)
     - Category
     - Subcategory
-    - Date range
+    - Format, color mode and orientation
+    - Width, height and file size ranges
+    
+    Results are paginated by page number or keyset cursor like the index.
     
     Returns:
         str: Rendered search results template
@@ -227,43 +456,65 @@ def search_images():
     
     try:
         # Populate category and subcategory choices
-        form.category.choices = [(0, 'All Categories')] + \
-            [(c.id, c.name) for c in Category.query.order_by(Category.name).all()]
-        form.subcategory.choices = [(0, 'All Subcategories')] + \
-            [(s.id, s.name) for s in Subcategory.query.order_by(Subcategory.name).all()]
+        taxonomy = get_taxonomy()
+        form.category.choices = [(0, 'All Categories')] + taxonomy.category_choices()
+        form.subcategory.choices = [(0, 'All Subcategories')] + taxonomy.subcategory_choices()
         
-        images = []
+        images = next_cursor = None
         
         # Process search if there are any query parameters
         if request.args:
-            query = Image.query
-            
-            # Search by query string
-            if form.search_query.data:
-                search_term = f"%{form.search_query.data}%"
-                query = query.filter(or_(
-                    Image.name.ilike(search_term),
-                    Image.description.ilike(search_term),
-                    Image.prompt.ilike(search_term)
-                ))
-            
-            # Filter by category
-            if form.category.data and form.category.data != 0:
-                query = query.filter(Image.category_id == form.category.data)
-            
-            # Filter by subcategory
-            if form.subcategory.data and form.subcategory.data != 0:
-                query = query.filter(Image.subcategory_id == form.subcategory.data)
-            
-            images = query.order_by(Image.upload_date.desc()).all()
-        
-        return render_template('search.html', form=form, images=images)
+            query, rank_order = filter_images(Image.card_query(), **search_filters(form))
+            images, next_cursor = paginate_images(query, rank_order)
+        
+        # Carry the active filters over into pagination links
+        search_args = {key: value for key, value in request.args.items()
+                       if key not in ('page', 'cursor')}
+        
+        return render_template('search.html', form=form, images=images,
+                               next_cursor=next_cursor, search_args=search_args, taxonomy=taxonomy)
     except Exception as e:
         flash(f'Error loading search results: {str(e)}', 'error')
-    finally:
-        db.session.close()
+
+def search_filters(form):
+    """
+    Collect the filter_images() arguments entered in a search form.
+    
+    Args:
+        form (SearchForm): Search form bound to the request arguments
+        
+    Returns:
+        dict: Keyword arguments for filter_images()
+    """
+    return {
+        'text': form.search_query.data,
+        'category_id': form.category.data,
+        'subcategory_id': form.subcategory.data,
+        'image_format': form.image_format.data,
+        'color_mode': form.color_mode.data,
+        'orientation': form.orientation.data,
+        'min_width': form.min_width.data,
+        'max_width': form.max_width.data,
+        'min_height': form.min_height.data,
+        'max_height': form.max_height.data,
+        'min_size': megabytes_to_bytes(form.min_size.data),
+        'max_size': megabytes_to_bytes(form.max_size.data)
+    }
+
+def megabytes_to_bytes(value):
+    """
+    Convert a file size filter entered in megabytes to bytes.
+    
+    Args:
+        value (float): Size in megabytes, or None
+        
+    Returns:
+        int: Size in bytes, or None
+    """
+    return None if value is None else int(value * 1024 * 1024)
 
 @bp.route('/categories')
+@cached_page
 def categories():
     """
     List all categories and subcategories.
@@ -272,12 +523,11 @@ def categories():
         str: Rendered categories template
     """
     try:
-        categories = Category.query.order_by(Category.name).all()
+        categories = Category.query.options(db.selectinload(Category.subcategories)) \
+            .order_by(Category.name).all()
         return render_template('categories/list.html', categories=categories)
     except Exception as e:
         flash(f'Error loading categories: {str(e)}', 'error')
-    finally:
-        db.session.close()
 
 @bp.route('/categories/new', methods=['GET', 'POST'])
 def new_category():
@@ -299,8 +549,6 @@ def new_category():
     except Exception as e:
         db.session.rollback()
         flash(f'Error creating category: {str(e)}', 'error')
-    finally:
-        db.session.close()
     
     return render_template('categories/form.html', form=form, title='New Category')
 
@@ -331,8 +579,6 @@ def edit_category(category_id):
     except Exception as e:
         flash(f'Error loading category: {str(e)}', 'error')
         return redirect(url_for('main.categories'))
-    finally:
-        db.session.close()
     
     return render_template('categories/form.html', form=form, category=category, title='Edit Category')
 
@@ -341,6 +587,10 @@ def delete_category(category_id):
     """
     Delete a category and its subcategories.
     
+    A category that still contains images can only be deleted when a
+    subcategory of another category is chosen as `move_to`; its images are
+    then moved there with one UPDATE in the same transaction.
+    
     Args:
         category_id (int): ID of the category to delete
         
@@ -351,9 +601,14 @@ def delete_category(category_id):
         category = Category.query.get_or_404(category_id)
         
         # Check if category has any images
-        if category.images:
-            flash('Cannot delete category that contains images. Move or delete the images first.', 'danger')
-            return redirect(url_for('main.categories'))
+        moved = None
+        if category.image_count:
+            target = db.session.get(Subcategory, request.form.get('move_to', 0, type=int))
+            if target is None or target.category_id == category.id:
+                flash('Cannot delete category that contains images. Choose a subcategory of another '
+                      'category to move them to, or move or delete the images first.', 'danger')
+                return redirect(url_for('main.categories'))
+            moved = move_category_images(category.id, target)
         
         # Delete subcategories
         for subcategory in category.subcategories:
@@ -361,12 +616,14 @@ def delete_category(category_id):
         
         db.session.delete(category)
         db.session.commit()
-        flash('Category deleted successfully!', 'success')
+        if moved is None:
+            flash('Category deleted successfully!', 'success')
+        else:
+            flash(f'Category deleted successfully! Moved {moved} images to '
+                  f'{target.parent_category.name} > {target.name}.', 'success')
     except Exception as e:
         db.session.rollback()
         flash(f'Error deleting category: {str(e)}', 'error')
-    finally:
-        db.session.close()
     
     return redirect(url_for('main.categories'))
 
@@ -379,7 +636,7 @@ def new_subcategory():
         str: Rendered subcategory form or redirect to categories list
     """
     form = SubcategoryForm()
-    form.category.choices = [(c.id, c.name) for c in Category.query.order_by(Category.name).all()]
+    form.category.choices = get_taxonomy().category_choices()
     
     try:
         if form.validate_on_submit():
@@ -394,8 +651,6 @@ def new_subcategory():
     except Exception as e:
         db.session.rollback()
         flash(f'Error creating subcategory: {str(e)}', 'error')
-    finally:
-        db.session.close()
     
     return render_template('categories/subcategory_form.html', form=form, title='New Subcategory')
 
@@ -413,7 +668,7 @@ def edit_subcategory(subcategory_id):
     try:
         subcategory = Subcategory.query.get_or_404(subcategory_id)
         form = SubcategoryForm(obj=subcategory)
-        form.category.choices = [(c.id, c.name) for c in Category.query.order_by(Category.name).all()]
+        form.category.choices = get_taxonomy().category_choices()
         
         if form.validate_on_submit():
             try:
@@ -428,8 +683,6 @@ def edit_subcategory(subcategory_id):
     except Exception as e:
         flash(f'Error loading subcategory: {str(e)}', 'error')
         return redirect(url_for('main.categories'))
-    finally:
-        db.session.close()
     
     return render_template('categories/subcategory_form.html', form=form, subcategory=subcategory, title='Edit Subcategory')
 
@@ -448,7 +701,7 @@ def delete_subcategory(subcategory_id):
         subcategory = Subcategory.query.get_or_404(subcategory_id)
         
         # Check if subcategory has any images
-        if subcategory.images:
+        if subcategory.image_count:
             flash('Cannot delete subcategory that contains images. Move or delete the images first.', 'danger')
             return redirect(url_for('main.categories'))
         
@@ -458,7 +711,5 @@ def delete_subcategory(subcategory_id):
     except Exception as e:
         db.session.rollback()
         flash(f'Error deleting subcategory: {str(e)}', 'error')
-    finally:
-        db.session.close()
     
     return redirect(url_for('main.categories'))
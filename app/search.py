@@ -0,0 +1,311 @@
+"""
+Search Module for the Image Storage Application.
+
+This module provides the indexed full-text search behind `search_images`,
+replacing leading-wildcard ILIKE scans. It handles:
+- Creating the full-text index for the active database
+  (an SQLite FTS5 table or a PostgreSQL tsvector column) from a migration
+- Detecting which index exists on the first search of each process
+- Keeping the index in sync with the image table via database triggers
+  or generated columns, so every write path is covered
+- Turning user input into ranked, prefix-matching, multi-term queries
+- Applying the shared search filters, including range filters on the
+  indexed metadata columns (dimensions, format, file size, color mode)
+"""
+
+import re
+
+import sqlalchemy as sa
+from flask import current_app
+from sqlalchemy import or_
+
+from app.models import db, Image
+
+FTS_TABLE = 'image_fts'
+
+# Upper bound on the number of terms taken from a single query
+MAX_TERMS = 10
+
+# Column weights: a match in the name outranks the description, then the prompt
+NAME_WEIGHT, DESCRIPTION_WEIGHT, PROMPT_WEIGHT = 10.0, 4.0, 1.0
+
+# Metadata range filters: argument name mapped to the condition it applies
+RANGE_FILTERS = {
+    'min_width': lambda value: Image.width >= value,
+    'max_width': lambda value: Image.width <= value,
+    'min_height': lambda value: Image.height >= value,
+    'max_height': lambda value: Image.height <= value,
+    'min_size': lambda value: Image.file_size >= value,
+    'max_size': lambda value: Image.file_size <= value,
+}
+
+ORIENTATIONS = {
+    'landscape': lambda: Image.width > Image.height,
+    'portrait': lambda: Image.width < Image.height,
+    'square': lambda: Image.width == Image.height,
+}
+
+_SQLITE_SETUP = [
+    f"""
+    CREATE VIRTUAL TABLE IF NOT EXISTS {FTS_TABLE} USING fts5(
+        name, description, prompt,
+        content='image', content_rowid='id',
+        tokenize='unicode61 remove_diacritics 2',
+        prefix='2 3'
+    )
+    """,
+    f"""
+    CREATE TRIGGER IF NOT EXISTS {FTS_TABLE}_ai AFTER INSERT ON image BEGIN
+        INSERT INTO {FTS_TABLE}(rowid, name, description, prompt)
+        VALUES (new.id, new.name, new.description, new.prompt);
+    END
+    """,
+    f"""
+    CREATE TRIGGER IF NOT EXISTS {FTS_TABLE}_ad AFTER DELETE ON image BEGIN
+        INSERT INTO {FTS_TABLE}({FTS_TABLE}, rowid, name, description, prompt)
+        VALUES ('delete', old.id, old.name, old.description, old.prompt);
+    END
+    """,
+    f"""
+    CREATE TRIGGER IF NOT EXISTS {FTS_TABLE}_au AFTER UPDATE OF name, description, prompt ON image BEGIN
+        INSERT INTO {FTS_TABLE}({FTS_TABLE}, rowid, name, description, prompt)
+        VALUES ('delete', old.id, old.name, old.description, old.prompt);
+        INSERT INTO {FTS_TABLE}(rowid, name, description, prompt)
+        VALUES (new.id, new.name, new.description, new.prompt);
+    END
+    """,
+]
+
+_POSTGRES_SETUP = [
+    """
+    ALTER TABLE image ADD COLUMN IF NOT EXISTS search_vector tsvector
+    GENERATED ALWAYS AS (
+        setweight(to_tsvector('simple', coalesce(name, '')), 'A') ||
+        setweight(to_tsvector('simple', coalesce(description, '')), 'B') ||
+        setweight(to_tsvector('simple', coalesce(prompt, '')), 'C')
+    ) STORED
+    """,
+    'CREATE INDEX IF NOT EXISTS ix_image_search_vector ON image USING GIN (search_vector)',
+]
+
+
+def setup_search_index(conn):
+    """
+    Create the full-text index for the database behind a connection.
+
+    Run by the initial schema migration. All statements are idempotent, and
+    an FTS5 table created for an existing database is rebuilt from the image
+    table.
+
+    Args:
+        conn (Connection): Connection to the application database, inside
+            the caller's transaction
+
+    Returns:
+        str: Search backend in use ('fts5', 'tsvector' or 'like')
+    """
+    dialect = conn.dialect.name
+
+    if dialect == 'sqlite':
+        existed = _sqlite_has_fts(conn)
+        try:
+            for statement in _SQLITE_SETUP:
+                conn.exec_driver_sql(statement)
+        except sa.exc.OperationalError:
+            # SQLite compiled without FTS5
+            return 'like'
+        if not existed:
+            conn.exec_driver_sql(f"INSERT INTO {FTS_TABLE}({FTS_TABLE}) VALUES ('rebuild')")
+        return 'fts5'
+
+    if dialect == 'postgresql':
+        for statement in _POSTGRES_SETUP:
+            conn.exec_driver_sql(statement)
+        return 'tsvector'
+
+    return 'like'
+
+
+def drop_search_index(conn):
+    """
+    Remove the full-text index created by setup_search_index.
+
+    Args:
+        conn (Connection): Connection to the application database
+    """
+    dialect = conn.dialect.name
+    if dialect == 'sqlite':
+        for suffix in ('ai', 'ad', 'au'):
+            conn.exec_driver_sql(f'DROP TRIGGER IF EXISTS {FTS_TABLE}_{suffix}')
+        conn.exec_driver_sql(f'DROP TABLE IF EXISTS {FTS_TABLE}')
+    elif dialect == 'postgresql':
+        conn.exec_driver_sql('DROP INDEX IF EXISTS ix_image_search_vector')
+        conn.exec_driver_sql('ALTER TABLE image DROP COLUMN IF EXISTS search_vector')
+
+
+def _sqlite_has_fts(conn):
+    return conn.execute(
+        sa.text("SELECT 1 FROM sqlite_master WHERE name = :name"), {'name': FTS_TABLE}
+    ).first() is not None
+
+
+def detect_search_backend(engine):
+    """
+    Report which full-text index the migrations created in a database.
+
+    Args:
+        engine (Engine): SQLAlchemy engine of the application database
+
+    Returns:
+        str: Search backend in use ('fts5', 'tsvector' or 'like')
+    """
+    with engine.connect() as conn:
+        if conn.dialect.name == 'sqlite':
+            return 'fts5' if _sqlite_has_fts(conn) else 'like'
+        if conn.dialect.name == 'postgresql':
+            has_vector = conn.execute(sa.text(
+                "SELECT 1 FROM information_schema.columns "
+                "WHERE table_name = 'image' AND column_name = 'search_vector' "
+                "AND table_schema = current_schema()")).first() is not None
+            return 'tsvector' if has_vector else 'like'
+    return 'like'
+
+
+def search_backend():
+    """
+    Return the search backend of the current application.
+
+    Detected on the first search rather than at startup, so creating the
+    application needs no database connection.
+
+    Returns:
+        str: Search backend in use ('fts5', 'tsvector' or 'like')
+    """
+    backend = current_app.extensions.get('search_backend')
+    if backend is None:
+        backend = current_app.extensions['search_backend'] = detect_search_backend(db.engine)
+    return backend
+
+
+def parse_terms(text):
+    """
+    Split a user query into normalized search terms.
+
+    Args:
+        text (str): Raw search input
+
+    Returns:
+        list: Lower-cased word terms, at most MAX_TERMS of them
+    """
+    return re.findall(r'\w+', (text or '').lower())[:MAX_TERMS]
+
+
+def apply_text_search(query, text):
+    """
+    Restrict an Image query to rows matching a full-text query.
+
+    Every term must match (AND semantics) and each term also matches as a
+    prefix, so 'sun land' finds 'Sunset over the landscape'. Input without
+    any word terms, such as '!!!', matches no image; blank input leaves the
+    query unfiltered.
+
+    Args:
+        query (Query): Image query to filter
+        text (str): Raw search input
+
+    Returns:
+        tuple: (filtered query, list of ORDER BY clauses ranking best matches first)
+    """
+    terms = parse_terms(text)
+    if not terms:
+        if (text or '').strip():
+            return query.filter(sa.false()), []
+        return query, []
+
+    backend = search_backend()
+
+    if backend == 'fts5':
+        fts = sa.table(FTS_TABLE, sa.column('rowid'))
+        match = ' '.join(f'"{term}"*' for term in terms)
+        rank = sa.func.bm25(sa.literal_column(FTS_TABLE), NAME_WEIGHT, DESCRIPTION_WEIGHT, PROMPT_WEIGHT)
+        query = query.join(fts, fts.c.rowid == Image.id) \
+            .filter(sa.literal_column(FTS_TABLE).op('MATCH')(match))
+        # bm25() scores better matches with more negative numbers
+        return query, [rank.asc()]
+
+    if backend == 'tsvector':
+        vector = sa.literal_column('image.search_vector')
+        tsquery = sa.func.to_tsquery('simple', ' & '.join(f'{term}:*' for term in terms))
+        query = query.filter(vector.op('@@')(tsquery))
+        return query, [sa.func.ts_rank(vector, tsquery).desc()]
+
+    # Fallback for databases without a full-text index
+    for term in terms:
+        pattern = f'%{term}%'
+        query = query.filter(or_(
+            Image.name.ilike(pattern),
+            Image.description.ilike(pattern),
+            Image.prompt.ilike(pattern)
+        ))
+    return query, []
+
+
+def has_filters(text=None, category_id=None, subcategory_id=None,
+                image_format=None, color_mode=None, orientation=None, **ranges):
+    """
+    Check whether filter_images() arguments narrow the results by more than text.
+
+    Text only counts when it has word terms; filter_images() matches nothing
+    for other text, which must not be mistaken for a filter either.
+
+    Args:
+        Same as filter_images()
+
+    Returns:
+        bool: True if at least one filter is set
+    """
+    if parse_terms(text) or orientation in ORIENTATIONS:
+        return True
+    if category_id or subcategory_id or image_format or color_mode:
+        return True
+    return any(value is not None for value in ranges.values())
+
+
+def filter_images(query, text=None, category_id=None, subcategory_id=None,
+                  image_format=None, color_mode=None, orientation=None, **ranges):
+    """
+    Apply the search filters shared by the search page and the JSON API.
+
+    Metadata filters only match images whose metadata has been extracted.
+
+    Args:
+        query (Query): Image query to filter
+        text (str, optional): Full-text search input
+        category_id (int, optional): Only return images in this category
+        subcategory_id (int, optional): Only return images in this subcategory
+        image_format (str, optional): Only return images of this format, e.g. 'png'
+        color_mode (str, optional): Only return images in this color mode, e.g. 'RGBA'
+        orientation (str, optional): 'landscape', 'portrait' or 'square'
+        **ranges: Bounds named in RANGE_FILTERS (min_width, max_size, ...);
+            None values are ignored
+
+    Returns:
+        tuple: (filtered query, ORDER BY clauses ranking text matches)
+    """
+    rank_order = []
+    if text:
+        query, rank_order = apply_text_search(query, text)
+    if category_id:
+        query = query.filter(Image.category_id == category_id)
+    if subcategory_id:
+        query = query.filter(Image.subcategory_id == subcategory_id)
+    if image_format:
+        query = query.filter(Image.format == image_format)
+    if color_mode:
+        query = query.filter(Image.color_mode == color_mode)
+    if orientation in ORIENTATIONS:
+        query = query.filter(ORIENTATIONS[orientation]())
+    for name, value in ranges.items():
+        if value is not None:
+            query = query.filter(RANGE_FILTERS[name](value))
+    return query, rank_order
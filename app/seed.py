@@ -0,0 +1,85 @@
+"""
+Seed Data Module for the Image Storage Application.
+
+This module creates the default categories and subcategories of a new
+installation. It is run once by 'flask seed' after 'flask db upgrade'
+instead of by every process at startup. It handles:
+- The default category taxonomy
+- Inserting the missing categories with one INSERT that skips existing names
+- Adding the default subcategories to the categories it created
+"""
+
+from sqlalchemy import insert, select
+
+from app.models import db, Category, Subcategory
+
+DEFAULT_TAXONOMY = {
+    'Personal': ['Family', 'Friends', 'Events', 'Travel'],
+    'Work': ['Projects', 'Meetings', 'Documents', 'Screenshots'],
+    'Art': ['Digital', 'Traditional', 'Sketches', 'Paintings'],
+    'Photography': ['Landscape', 'Portrait', 'Street', 'Nature'],
+    'Design': ['UI/UX', 'Graphics', 'Logos', 'Mockups'],
+}
+
+
+def _insert_missing_categories(names):
+    """
+    Insert the categories whose names do not exist yet.
+
+    PostgreSQL and SQLite skip existing names with ON CONFLICT DO NOTHING and
+    report the inserted rows with RETURNING, so concurrent seeders never both
+    claim a category. Other databases use INSERT IGNORE and look the new rows
+    up afterwards.
+
+    Args:
+        names (list): Category names
+
+    Returns:
+        dict: Names of the inserted categories mapped to their IDs
+    """
+    rows = [{'name': name} for name in names]
+    dialect = db.engine.dialect.name
+    if dialect in ('postgresql', 'sqlite'):
+        if dialect == 'postgresql':
+            from sqlalchemy.dialects.postgresql import insert as dialect_insert
+        else:
+            from sqlalchemy.dialects.sqlite import insert as dialect_insert
+        statement = dialect_insert(Category).values(rows).on_conflict_do_nothing(index_elements=['name'])
+        return dict(db.session.execute(statement.returning(Category.name, Category.id)).all())
+
+    existing = set(db.session.scalars(select(Category.name).where(Category.name.in_(names))))
+    db.session.execute(insert(Category).values(rows).prefix_with('IGNORE', dialect='mysql'))
+    created = [name for name in names if name not in existing]
+    if not created:
+        return {}
+    return dict(db.session.execute(select(Category.name, Category.id).where(Category.name.in_(created))).all())
+
+
+def seed_taxonomy(taxonomy=None):
+    """
+    Create the default categories and subcategories that are missing.
+
+    Safe to run any number of times: categories that already exist are left
+    unchanged, so default subcategories that were renamed or deleted are not
+    added again.
+
+    Args:
+        taxonomy (dict): Category names mapped to their subcategory names
+            (defaults to DEFAULT_TAXONOMY)
+
+    Returns:
+        tuple: (categories created, subcategories created)
+    """
+    taxonomy = taxonomy or DEFAULT_TAXONOMY
+    created = _insert_missing_categories(list(taxonomy))
+    subcategories = [{'name': name, 'category_id': created[category]}
+                     for category in taxonomy if category in created
+                     for name in taxonomy[category]]
+    if subcategories:
+        db.session.execute(insert(Subcategory), subcategories)
+    if created:
+        # Core INSERTs bypass the flush events that invalidate the caches
+        db.session.info['taxonomy_changed'] = True
+        db.session.info['pages_changed'] = True
+    db.session.commit()
+    return len(created), len(subcategories)
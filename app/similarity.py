@@ -0,0 +1,377 @@
+"""
+Similarity Module for the Image Storage Application.
+
+This module finds near-duplicate and visually similar images by comparing
+64-bit perceptual hashes (dHash) stored on every Image. Lookups go through
+an in-memory multi-index hash table instead of a scan over all hashes.
+It handles:
+- Computing the difference hash of an image file
+- Indexing hashes for sub-linear Hamming-distance range queries
+- Keeping each process's index in step with the database
+- Finding similar images for the details page and upload warnings
+- Clustering near-duplicates across the whole library
+- Backfilling hashes for images stored before they were computed
+"""
+
+import threading
+import time
+from itertools import combinations
+
+from flask import current_app
+from PIL import Image as PILImage, ImageOps
+
+from app.jobs import enqueue, job_handler
+from app.models import db, Image
+from app.renditions import is_raster
+from app.storage import file_extension
+
+# dHash compares each pixel with its right neighbour on a 9x8 grayscale thumbnail
+HASH_WIDTH, HASH_HEIGHT = 9, 8
+
+# The 64-bit hash is split into BANDS bands of BAND_BITS bits. Two hashes within
+# distance r agree to within r // BANDS bits on at least one band, so only
+# entries whose band is that close to the query's need to be compared.
+BANDS = 4
+BAND_BITS = 16
+BAND_MASK = (1 << BAND_BITS) - 1
+
+_band_flips = {}
+
+
+def hamming(a, b):
+    """Return the number of differing bits between two hashes."""
+    return bin(a ^ b).count('1')
+
+
+def to_signed(value):
+    """Convert an unsigned 64-bit hash to the signed value stored in BIGINT columns."""
+    return value - (1 << 64) if value >= 1 << 63 else value
+
+
+def to_unsigned(value):
+    """Convert a stored signed 64-bit hash back to its unsigned value."""
+    return value + (1 << 64) if value < 0 else value
+
+
+def image_hash(path):
+    """
+    Compute the 64-bit difference hash of an image file.
+
+    The hash survives resizing, recompression and small edits, so images
+    whose hashes differ in only a few bits look alike. JPEGs are decoded at a
+    reduced scale, which makes hashing large photos cheap.
+
+    Args:
+        path (str): Path to a raster image
+
+    Returns:
+        int: Unsigned 64-bit hash
+    """
+    with PILImage.open(path) as img:
+        img.draft('L', (HASH_WIDTH * 8, HASH_HEIGHT * 8))
+        img = ImageOps.exif_transpose(img).convert('L')
+        small = img.resize((HASH_WIDTH, HASH_HEIGHT), PILImage.BILINEAR, reducing_gap=2.0)
+
+    pixels = list(small.getdata())
+    value = 0
+    for row in range(HASH_HEIGHT):
+        for col in range(HASH_WIDTH - 1):
+            left = pixels[row * HASH_WIDTH + col]
+            value = (value << 1) | (left > pixels[row * HASH_WIDTH + col + 1])
+    return value
+
+
+def apply_hash(image, path=None):
+    """
+    Compute and store the perceptual hash of an image's file.
+
+    Vector images are left without a hash.
+
+    Args:
+        image (Image): Image whose file is in storage
+        path (str, optional): Local path to the file, defaults to a local
+            copy of the stored file
+    """
+    if not is_raster(file_extension(image.storage_key)):
+        return
+    if path is None:
+        with image.local_path() as path:
+            return apply_hash(image, path)
+    image.perceptual_hash = to_signed(image_hash(path))
+
+
+def _flips(radius):
+    """Return every BAND_BITS-bit mask with at most `radius` bits set."""
+    if radius not in _band_flips:
+        _band_flips[radius] = [sum(1 << bit for bit in bits)
+                               for count in range(radius + 1)
+                               for bits in combinations(range(BAND_BITS), count)]
+    return _band_flips[radius]
+
+
+class HashIndex:
+    """
+    Multi-index hash table answering Hamming-distance range queries.
+
+    Every hash is filed under each of its bands. A query only compares
+    entries whose band lies within radius // BANDS bits of the query's, which
+    touches a small fraction of the library for the radii used here.
+
+    Attributes:
+        hashes (dict): Image ID mapped to its unsigned hash
+        state (tuple): (row count, highest image ID) the index was loaded at
+    """
+
+    def __init__(self, rows=(), state=None):
+        self.hashes = {}
+        self.tables = [{} for _ in range(BANDS)]
+        self.state = state
+        self.checked_at = time.monotonic()
+        for image_id, value in rows:
+            self.add(image_id, value)
+
+    def __len__(self):
+        return len(self.hashes)
+
+    def add(self, image_id, value):
+        """
+        Add or replace the hash of an image.
+
+        Args:
+            image_id (int): ID of the image
+            value (int): Unsigned 64-bit hash
+        """
+        if image_id in self.hashes:
+            self.remove(image_id)
+        self.hashes[image_id] = value
+        for band, table in enumerate(self.tables):
+            table.setdefault((value >> (band * BAND_BITS)) & BAND_MASK, []).append(image_id)
+
+    def remove(self, image_id):
+        """
+        Remove an image from the index.
+
+        Args:
+            image_id (int): ID of the image
+        """
+        value = self.hashes.pop(image_id, None)
+        if value is None:
+            return
+        for band, table in enumerate(self.tables):
+            bucket = table.get((value >> (band * BAND_BITS)) & BAND_MASK, [])
+            if image_id in bucket:
+                bucket.remove(image_id)
+
+    def search(self, value, radius):
+        """
+        Find indexed hashes within a Hamming distance of `value`.
+
+        Args:
+            value (int): Unsigned 64-bit query hash
+            radius (int): Largest distance to return
+
+        Returns:
+            list: (distance, image ID) tuples, closest first
+        """
+        flips = _flips(radius // BANDS)
+        seen = set()
+        matches = []
+        for band, table in enumerate(self.tables):
+            key = (value >> (band * BAND_BITS)) & BAND_MASK
+            for flip in flips:
+                for image_id in table.get(key ^ flip, ()):
+                    if image_id not in seen:
+                        seen.add(image_id)
+                        distance = hamming(value, self.hashes[image_id])
+                        if distance <= radius:
+                            matches.append((distance, image_id))
+        matches.sort()
+        return matches
+
+
+_build_lock = threading.Lock()
+
+
+def _index_state():
+    """Return (count, max id) of hashed images, which changes whenever hashes are added or removed."""
+    count, max_id = db.session.query(db.func.count(Image.id), db.func.max(Image.id)) \
+        .filter(Image.perceptual_hash.isnot(None)).one()
+    return count, max_id
+
+
+def load_index():
+    """
+    Build a HashIndex from every hashed image in the database.
+
+    Returns:
+        HashIndex: Freshly loaded index
+    """
+    state = _index_state()
+    rows = db.session.query(Image.id, Image.perceptual_hash).filter(Image.perceptual_hash.isnot(None))
+    return HashIndex(((image_id, to_unsigned(value)) for image_id, value in rows), state)
+
+
+def get_similarity_index():
+    """
+    Return this process's hash index, reloading it when the library changed.
+
+    Hashes computed in this process are added to the index as they are
+    stored. Changes made by other processes are noticed by comparing the
+    number of hashed images and the highest ID with the database at most
+    once every SIMILARITY_INDEX_TTL seconds.
+
+    Returns:
+        HashIndex: Current index
+    """
+    index = current_app.extensions.get('similarity_index')
+    ttl = current_app.config['SIMILARITY_INDEX_TTL']
+    if index is not None and time.monotonic() - index.checked_at < ttl:
+        return index
+
+    with _build_lock:
+        index = current_app.extensions.get('similarity_index')
+        if index is None or time.monotonic() - index.checked_at >= ttl:
+            if index is None or _index_state() != index.state:
+                index = load_index()
+                current_app.extensions['similarity_index'] = index
+            index.checked_at = time.monotonic()
+    return index
+
+
+def index_image(image):
+    """
+    Add a freshly hashed image to this process's index, if it is loaded.
+
+    Args:
+        image (Image): Image with a perceptual hash and an ID
+    """
+    index = current_app.extensions.get('similarity_index')
+    if index is None or image.perceptual_hash is None:
+        return
+    with _build_lock:
+        known = image.id in index.hashes
+        index.add(image.id, to_unsigned(image.perceptual_hash))
+        if index.state is not None and not known:
+            count, max_id = index.state
+            index.state = (count + 1, max(max_id or 0, image.id))
+
+
+def find_similar(image, max_distance=None, limit=8):
+    """
+    Find the images that look most like the given one.
+
+    Args:
+        image (Image): Image to compare against
+        max_distance (int, optional): Largest Hamming distance, defaults to
+            SIMILARITY_MAX_DISTANCE
+        limit (int): Maximum number of images to return
+
+    Returns:
+        list: (Image, distance) tuples, most similar first
+    """
+    if image.perceptual_hash is None:
+        return []
+    if max_distance is None:
+        max_distance = current_app.config['SIMILARITY_MAX_DISTANCE']
+
+    matches = [(distance, image_id) for distance, image_id
+               in get_similarity_index().search(to_unsigned(image.perceptual_hash), max_distance)
+               if image_id != image.id]
+    # Fetch a few extra in case some were deleted since the index was loaded
+    candidates = matches[:limit * 2]
+    images = {i.id: i for i in Image.card_query().filter(Image.id.in_([i for _, i in candidates]))}
+    return [(images[image_id], distance) for distance, image_id in candidates if image_id in images][:limit]
+
+
+def cluster_duplicates(max_distance=None, batch_size=500, echo=print):
+    """
+    Group near-duplicate images across the whole library.
+
+    Every image is linked to the images within `max_distance` of it and the
+    connected groups are stored in Image.duplicate_group as the lowest image
+    ID of the group. Images without near-duplicates get None.
+
+    Args:
+        max_distance (int, optional): Largest Hamming distance, defaults to
+            DUPLICATE_MAX_DISTANCE
+        batch_size (int): Images updated per statement
+        echo (callable): Function used to report progress
+
+    Returns:
+        tuple: (number of groups, number of images in them)
+    """
+    if max_distance is None:
+        max_distance = current_app.config['DUPLICATE_MAX_DISTANCE']
+    index = load_index()
+    parent = {image_id: image_id for image_id in index.hashes}
+
+    def find(image_id):
+        while parent[image_id] != image_id:
+            parent[image_id] = parent[parent[image_id]]
+            image_id = parent[image_id]
+        return image_id
+
+    for position, (image_id, value) in enumerate(index.hashes.items(), 1):
+        for _, other_id in index.search(value, max_distance):
+            root, other_root = find(image_id), find(other_id)
+            if root != other_root:
+                parent[max(root, other_root)] = min(root, other_root)
+        if position % 10000 == 0:
+            echo(f'{position}/{len(index)} images compared')
+
+    groups = {}
+    for image_id in parent:
+        groups.setdefault(find(image_id), []).append(image_id)
+    groups = {root: members for root, members in groups.items() if len(members) > 1}
+
+    Image.query.filter(Image.duplicate_group.isnot(None)) \
+        .update({'duplicate_group': None}, synchronize_session=False)
+    for root, members in groups.items():
+        for offset in range(0, len(members), batch_size):
+            Image.query.filter(Image.id.in_(members[offset:offset + batch_size])) \
+                .update({'duplicate_group': root}, synchronize_session=False)
+    db.session.commit()
+    return len(groups), sum(len(members) for members in groups.values())
+
+
+def queue_hash_backfill(batch_size=200):
+    """
+    Enqueue compute_hashes jobs for raster images without a perceptual hash.
+
+    Args:
+        batch_size (int): Images handled per job
+
+    Returns:
+        tuple: (number of images, number of jobs enqueued)
+    """
+    image_ids = [image_id for (image_id,) in db.session.query(Image.id)
+                 .filter(Image.perceptual_hash.is_(None), db.or_(Image.format.is_(None), Image.format != 'svg'))
+                 .order_by(Image.id)]
+    jobs = 0
+    for offset in range(0, len(image_ids), batch_size):
+        enqueue('compute_hashes', image_ids=image_ids[offset:offset + batch_size])
+        jobs += 1
+    db.session.commit()
+    return len(image_ids), jobs
+
+
+@job_handler('compute_hashes')
+def compute_hashes_job(job):
+    """
+    Compute perceptual hashes for a batch of existing images.
+
+    Images whose file is missing or unreadable are logged and skipped.
+
+    Args:
+        job (Job): The compute_hashes job
+    """
+    images = Image.query.options(db.joinedload(Image.blob)) \
+        .filter(Image.id.in_(job.data['image_ids'])).all()
+    for image in images:
+        try:
+            apply_hash(image)
+        except Exception as e:
+            current_app.logger.warning('Could not hash image %s: %s', image.id, e)
+    db.session.flush()
+    for image in images:
+        index_image(image)
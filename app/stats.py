@@ -0,0 +1,206 @@
+"""
+Category Statistics Module for the Image Storage Application.
+
+This module keeps the image count, total bytes and latest upload date
+stored on every Category and Subcategory in step with the image table, so
+pages read them instead of counting images. It handles:
+- Turning flushed image inserts, moves, size changes and deletes into
+  counter updates in the same transaction
+- Applying the counter changes of bulk UPDATE and DELETE statements
+- A reconcile_stats job that recomputes every counter and repairs drift
+"""
+
+from collections import defaultdict
+
+from flask import current_app
+from sqlalchemy import event, inspect
+
+from app.jobs import job_handler
+from app.models import db, Category, Image, Subcategory
+
+
+def _new_deltas():
+    """Return an empty delta map: (model, id) -> [image count, bytes]."""
+    return defaultdict(lambda: [0, 0])
+
+
+def _add(deltas, category_id, subcategory_id, count, size):
+    """Add a count and size change to both counter owners of an image."""
+    for model, owner_id in ((Category, category_id), (Subcategory, subcategory_id)):
+        if owner_id is not None:
+            delta = deltas[(model, owner_id)]
+            delta[0] += count
+            delta[1] += size
+
+
+def _owner_column(model):
+    """Return the image column referencing a counter owner."""
+    return Image.category_id if model is Category else Image.subcategory_id
+
+
+def apply_deltas(connection, deltas):
+    """
+    Apply counter changes and recompute the latest upload of their owners.
+
+    The latest upload date is read back with an indexed MAX() lookup, which
+    also covers the images that were removed or moved away. Must run after
+    the image rows were written.
+
+    Args:
+        connection (Connection): Connection of the current transaction
+        deltas (dict): (model, id) mapped to [image count, bytes] changes
+    """
+    for model in (Category, Subcategory):
+        table = model.__table__
+        column = _owner_column(model)
+        rows = [{'owner_id': owner_id, 'count': count, 'size': size}
+                for (owner, owner_id), (count, size) in deltas.items() if owner is model]
+        if not rows:
+            continue
+        latest = db.select(db.func.max(Image.upload_date)).where(column == table.c.id).scalar_subquery()
+        connection.execute(
+            table.update().where(table.c.id == db.bindparam('owner_id')).values(
+                image_count=table.c.image_count + db.bindparam('count'),
+                total_bytes=table.c.total_bytes + db.bindparam('size'),
+                latest_upload=latest),
+            rows)
+
+
+def image_groups(condition):
+    """
+    Count the images matching a condition per category and subcategory.
+
+    Args:
+        condition: SQL expression selecting the images
+
+    Returns:
+        list: (category_id, subcategory_id, image count, bytes) tuples
+    """
+    return db.session.query(Image.category_id, Image.subcategory_id, db.func.count(Image.id),
+                            db.func.coalesce(db.func.sum(Image.file_size), 0)) \
+        .filter(condition).group_by(Image.category_id, Image.subcategory_id).all()
+
+
+def record_bulk_update(groups, changes):
+    """
+    Apply the counter changes of a bulk UPDATE on the images in `groups`.
+
+    Args:
+        groups (list): image_groups() result taken before the UPDATE
+        changes (dict): Column names mapped to the values the UPDATE set
+    """
+    if 'category_id' not in changes and 'subcategory_id' not in changes:
+        return
+    deltas = _new_deltas()
+    for category_id, subcategory_id, count, size in groups:
+        _add(deltas, category_id, subcategory_id, -count, -size)
+        _add(deltas, changes.get('category_id', category_id),
+             changes.get('subcategory_id', subcategory_id), count, size)
+    apply_deltas(db.session.connection(), deltas)
+
+
+def record_bulk_delete(groups):
+    """
+    Apply the counter changes of a bulk DELETE of the images in `groups`.
+
+    Args:
+        groups (list): image_groups() result taken before the DELETE
+    """
+    deltas = _new_deltas()
+    for category_id, subcategory_id, count, size in groups:
+        _add(deltas, category_id, subcategory_id, -count, -size)
+    apply_deltas(db.session.connection(), deltas)
+
+
+def _previous(state, key):
+    """Return the value an image column had before the pending change."""
+    history = state.attrs[key].history
+    return history.deleted[0] if history.deleted else getattr(state.obj(), key)
+
+
+@event.listens_for(db.session, 'before_flush')
+def _collect_image_changes(session, flush_context, instances):
+    """Turn the images a flush writes into counter deltas."""
+    deltas = _new_deltas()
+    for obj in session.new:
+        if isinstance(obj, Image):
+            _add(deltas, obj.category_id, obj.subcategory_id, 1, obj.file_size or 0)
+    for obj in session.deleted:
+        if isinstance(obj, Image):
+            _add(deltas, obj.category_id, obj.subcategory_id, -1, -(obj.file_size or 0))
+    for obj in session.dirty:
+        if not isinstance(obj, Image):
+            continue
+        state = inspect(obj)
+        if any(state.attrs[key].history.has_changes() for key in ('category_id', 'subcategory_id', 'file_size')):
+            _add(deltas, _previous(state, 'category_id'), _previous(state, 'subcategory_id'),
+                 -1, -(_previous(state, 'file_size') or 0))
+            _add(deltas, obj.category_id, obj.subcategory_id, 1, obj.file_size or 0)
+    if deltas:
+        session.info['stats_deltas'] = deltas
+
+
+@event.listens_for(db.session, 'after_flush')
+def _apply_image_changes(session, flush_context):
+    """Write the counter deltas of the flushed images in the same transaction."""
+    deltas = session.info.pop('stats_deltas', None)
+    if deltas:
+        apply_deltas(session.connection(), deltas)
+
+
+@event.listens_for(db.session, 'after_rollback')
+def _forget_rolled_back_stats(session):
+    """Drop the deltas of a flush that failed."""
+    session.info.pop('stats_deltas', None)
+
+
+def reconcile_stats():
+    """
+    Recompute the category and subcategory counters that drifted.
+
+    Drift is found by comparing the counters with grouped aggregates of the
+    image table. Drifted rows are then rewritten by one UPDATE that computes
+    their values in the statement itself, so counter changes committed by
+    concurrent uploads in the meantime are not overwritten. Committing is
+    left to the caller.
+
+    Returns:
+        int: Number of categories and subcategories repaired
+    """
+    repaired = 0
+    for model in (Category, Subcategory):
+        column = _owner_column(model)
+        actual = {owner_id: (count, size, latest) for owner_id, count, size, latest in db.session.query(
+            column, db.func.count(Image.id), db.func.coalesce(db.func.sum(Image.file_size), 0),
+            db.func.max(Image.upload_date)).group_by(column)}
+        stored = db.session.query(model.id, model.image_count, model.total_bytes, model.latest_upload)
+        drifted = [owner_id for owner_id, *counters in stored
+                   if tuple(counters) != actual.get(owner_id, (0, 0, None))]
+        if not drifted:
+            continue
+
+        table = model.__table__
+        owned = column == table.c.id
+        db.session.execute(table.update().where(table.c.id.in_(drifted)).values(
+            image_count=db.select(db.func.count(Image.id)).where(owned).scalar_subquery(),
+            total_bytes=db.select(db.func.coalesce(db.func.sum(Image.file_size), 0)).where(owned).scalar_subquery(),
+            latest_upload=db.select(db.func.max(Image.upload_date)).where(owned).scalar_subquery()))
+        current_app.logger.info('Repaired the counters of %s %s', model.__tablename__, drifted)
+        repaired += len(drifted)
+    if repaired:
+        # The categories page shows the counters
+        db.session.info['pages_changed'] = True
+    return repaired
+
+
+@job_handler('reconcile_stats')
+def reconcile_stats_job(job):
+    """
+    Repair category and subcategory counters that drifted from the images.
+
+    Args:
+        job (Job): The reconcile_stats job
+    """
+    repaired = reconcile_stats()
+    if repaired:
+        current_app.logger.warning('Repaired the counters of %d categories and subcategories', repaired)
@@ -0,0 +1,439 @@
+"""
+Storage Module for the Image Storage Application.
+
+This module implements content-addressed storage for uploaded files. Every
+file is stored once under the SHA-256 of its contents, sharded as
+`ab/cd/abcdef....ext` in the configured storage backend. It handles:
+- Streaming uploads through a hasher and the upload validator into a
+  temporary file, for form posts while the request body is parsed
+- Deduplicating identical contents onto a shared, reference-counted Blob
+- Removing blobs left without references, and their files, only after the
+  transaction that released them committed
+- Migrating images stored under their original filename
+"""
+
+import hashlib
+import os
+import tempfile
+
+from flask import Request, current_app
+from sqlalchemy import inspect
+from sqlalchemy.exc import IntegrityError
+from werkzeug.utils import secure_filename
+
+from app.jobs import enqueue, job_handler
+from app.models import db, Blob, Image, Rendition
+from app.storage_backends import get_storage
+from app.validation import InvalidImage, UploadValidator
+
+# Bytes read per iteration while streaming and hashing
+CHUNK_SIZE = 1024 * 1024
+
+
+def file_extension(filename):
+    """
+    Return the lower-case extension of a filename without the dot.
+
+    Args:
+        filename (str): Filename to inspect
+
+    Returns:
+        str: Extension such as 'png', or '' if there is none
+    """
+    return os.path.splitext(filename)[1].lower().lstrip('.')
+
+
+def temp_folder():
+    """
+    Return the folder for in-flight files, creating it if needed.
+
+    It lives inside the upload folder so, with local storage, finished
+    files can be moved into place with an atomic rename on the same
+    filesystem.
+
+    Returns:
+        str: Path to the temporary folder
+    """
+    folder = os.path.join(current_app.config['UPLOAD_FOLDER'], 'tmp')
+    os.makedirs(folder, exist_ok=True)
+    return folder
+
+
+def hash_file(path, inspect=None):
+    """
+    Compute the SHA-256 digest and size of a file.
+
+    Args:
+        path (str): File to hash
+        inspect (callable, optional): Called with every chunk read, e.g.
+            UploadValidator.feed
+
+    Returns:
+        tuple: (hex digest, size in bytes)
+    """
+    hasher = hashlib.sha256()
+    size = 0
+    with open(path, 'rb') as f:
+        for chunk in iter(lambda: f.read(CHUNK_SIZE), b''):
+            if inspect is not None:
+                inspect(chunk)
+            hasher.update(chunk)
+            size += len(chunk)
+    return hasher.hexdigest(), size
+
+
+def rewrite_file(path, data):
+    """
+    Replace the contents of a file, e.g. with a sanitized SVG.
+
+    Args:
+        path (str): File to overwrite
+        data (bytes): New contents
+
+    Returns:
+        tuple: (hex digest, size in bytes) of the new contents
+    """
+    with open(path, 'wb') as f:
+        f.write(data)
+        f.flush()
+        os.fsync(f.fileno())
+    return hashlib.sha256(data).hexdigest(), len(data)
+
+
+def stream_to_temp(stream, inspect=None):
+    """
+    Copy a stream into a temporary file while hashing it.
+
+    Args:
+        stream: Readable binary file-like object
+        inspect (callable, optional): Called with every chunk before it is
+            written; an exception it raises aborts the copy and removes the file
+
+    Returns:
+        tuple: (temporary file path, hex digest, size in bytes)
+    """
+    hasher = hashlib.sha256()
+    size = 0
+    with tempfile.NamedTemporaryFile(dir=temp_folder(), delete=False) as tmp:
+        try:
+            for chunk in iter(lambda: stream.read(CHUNK_SIZE), b''):
+                if inspect is not None:
+                    inspect(chunk)
+                hasher.update(chunk)
+                tmp.write(chunk)
+                size += len(chunk)
+            # The upload is acknowledged before any processing, so make the
+            # original durable before it is moved into place
+            tmp.flush()
+            os.fsync(tmp.fileno())
+        except BaseException:
+            tmp.close()
+            os.remove(tmp.name)
+            raise
+    return tmp.name, hasher.hexdigest(), size
+
+
+class StreamedUpload:
+    """
+    Temporary file a multipart file part is written to while it is parsed.
+
+    Werkzeug writes the part in chunks as they arrive from the client.
+    Every chunk is fed to an UploadValidator and hashed before it is
+    written, so a file that is not an acceptable image is rejected from its
+    first bytes: the rest of the part is read from the request but
+    discarded, and the error is raised by store_upload(). The file is
+    removed when the request is closed unless it was stored.
+
+    Attributes:
+        path (str): Path of the temporary file
+        size (int): Bytes written so far
+        validator (UploadValidator): Validator fed with every chunk
+        error (InvalidImage): Why the file was rejected, or None
+    """
+
+    def __init__(self, filename):
+        self.validator = UploadValidator(file_extension(secure_filename(filename or '')))
+        self.error = None
+        self.size = 0
+        self._hasher = hashlib.sha256()
+        self._file = tempfile.NamedTemporaryFile(dir=temp_folder(), delete=False)
+        self.path = self._file.name
+
+    def write(self, chunk):
+        if self.error is not None:
+            return len(chunk)
+        try:
+            self.validator.feed(chunk)
+        except InvalidImage as e:
+            self.error = e
+            self._file.seek(0)
+            self._file.truncate()
+            return len(chunk)
+        self._hasher.update(chunk)
+        self.size += len(chunk)
+        return self._file.write(chunk)
+
+    def read(self, size=-1):
+        return self._file.read(size)
+
+    def readline(self, size=-1):
+        return self._file.readline(size)
+
+    def seek(self, offset, whence=os.SEEK_SET):
+        return self._file.seek(offset, whence)
+
+    def tell(self):
+        return self._file.tell()
+
+    def detach(self):
+        """
+        Finish the temporary file and hand it over to the caller.
+
+        Returns:
+            tuple: (temporary file path, hex digest, size in bytes)
+
+        Raises:
+            InvalidImage: If the file was rejected while it was parsed
+        """
+        if self.error is not None:
+            raise self.error
+        # The upload is acknowledged before any processing, so make the
+        # original durable before it is moved into place
+        self._file.flush()
+        os.fsync(self._file.fileno())
+        self._file.close()
+        return self.path, self._hasher.hexdigest(), self.size
+
+    def close(self):
+        self._file.close()
+        if os.path.exists(self.path):
+            os.remove(self.path)
+
+
+def streams_uploads(view):
+    """
+    Mark a view whose uploaded files are validated while they are parsed.
+
+    Args:
+        view (callable): View function, decorated below its route
+
+    Returns:
+        callable: The same view function
+    """
+    view.streams_uploads = True
+    return view
+
+
+class UploadRequest(Request):
+    """
+    Request class that streams the files posted to marked views into StreamedUpload.
+
+    Other views keep Werkzeug's default of buffering files in memory or a
+    temporary file. The body is limited by MAX_CONTENT_LENGTH either way.
+    """
+
+    def _get_file_stream(self, total_content_length, content_type, filename=None, content_length=None):
+        view = current_app.view_functions.get(self.endpoint)
+        if getattr(view, 'streams_uploads', False):
+            return StreamedUpload(filename)
+        return super()._get_file_stream(total_content_length, content_type, filename, content_length)
+
+
+def store_file(path, sha256, size, extension, move=True):
+    """
+    Add a file to content-addressed storage and take a reference to it.
+
+    If a blob with the same contents already exists, its reference count is
+    incremented and the given file is discarded (when moving); a blob without
+    references that is waiting for delete_blobs_job is taken over and its
+    file restored if it was removed already. Otherwise the
+    file is moved (or copied) into the storage backend under its sharded key
+    and a new Blob is added to the session. The caller commits.
+
+    Args:
+        path (str): File to store
+        sha256 (str): Hex SHA-256 digest of the file
+        size (int): File size in bytes
+        extension (str): File extension without the dot
+        move (bool): Move the file into storage instead of copying it
+
+    Returns:
+        Blob: Blob now holding the contents
+    """
+    storage = get_storage()
+    blob = Blob.query.filter_by(sha256=sha256).first()
+
+    if blob is not None:
+        # Increment in SQL so concurrent uploads cannot lose a reference. The
+        # reference is taken before the file is checked: the row stays locked
+        # until commit, so delete_blobs_job cannot remove the file meanwhile
+        blob.refcount = Blob.refcount + 1
+        db.session.flush()
+        if not storage.exists(blob.storage_key):
+            # Repair a blob whose file went missing
+            storage.put_file(path, blob.storage_key, move)
+        elif move:
+            os.remove(path)
+        return blob
+
+    blob = Blob(sha256=sha256, extension=extension, size=size, refcount=1)
+    storage.put_file(path, blob.storage_key, move)
+    db.session.add(blob)
+    return blob
+
+
+def store_upload(file_storage, filename):
+    """
+    Stream an uploaded file into content-addressed storage.
+
+    The file is validated while it is copied and stored under the extension
+    of its actual format; SVGs are stored sanitized. Files posted to views
+    marked with streams_uploads() were validated and copied while the
+    request was parsed already.
+
+    Args:
+        file_storage (FileStorage): Uploaded file from the request
+        filename (str): Sanitized original filename
+
+    Returns:
+        Blob: Blob holding the uploaded contents
+
+    Raises:
+        InvalidImage: If the file is not an acceptable image
+    """
+    if isinstance(file_storage.stream, StreamedUpload):
+        validator = file_storage.stream.validator
+        path, sha256, size = file_storage.stream.detach()
+    else:
+        validator = UploadValidator(file_extension(filename))
+        path, sha256, size = stream_to_temp(file_storage.stream, validator.feed)
+    try:
+        info = validator.finish()
+        if info.document is not None:
+            sha256, size = rewrite_file(path, info.document)
+        return store_file(path, sha256, size, info.extension)
+    except BaseException:
+        if os.path.exists(path):
+            os.remove(path)
+        raise
+
+
+def discard_new_blob(blob):
+    """
+    Schedule the removal of the file of a blob whose creating transaction failed.
+
+    The file is not deleted right away: an identical upload may have stored
+    the same key and committed its own Blob, whose file it now is. Instead
+    the hash is claimed by a Blob row without references in a transaction of
+    its own, together with a delete_blobs job. If a Blob with the hash was
+    committed meanwhile, the claim fails and the file stays. Blobs that
+    existed before the transaction are left alone; their reference count
+    increment is undone by the rollback. Call it after the rollback.
+
+    Args:
+        blob (Blob): Blob returned by store_file/store_upload, or None
+    """
+    if blob is None:
+        return
+    state = inspect(blob)
+    if not (state.transient or state.pending):
+        return
+    orphan = Blob(sha256=blob.sha256, extension=blob.extension, size=blob.size, refcount=0)
+    try:
+        db.session.add(orphan)
+        db.session.flush()
+        enqueue('delete_blobs', blob_ids=[orphan.id])
+        db.session.commit()
+    except IntegrityError:
+        db.session.rollback()
+
+
+@job_handler('delete_blobs')
+def delete_blobs_job(job):
+    """
+    Remove blobs left without references, with their renditions and files.
+
+    A blob is claimed with an UPDATE that only matches while its reference
+    count is still zero, which locks the row until this job commits. Its
+    files are deleted while the row is locked, so an upload of the same
+    contents either took a reference first, and the blob is kept, or waits
+    for the delete and then stores the file again. If the commit fails, the
+    row stays behind without references and the job is retried.
+
+    Args:
+        job (Job): The delete_blobs job
+    """
+    orphans = db.session.query(Blob.id, Blob.sha256, Blob.extension) \
+        .filter(Blob.id.in_(job.data['blob_ids']), Blob.refcount <= 0).all()
+    originals = []
+    renditions = []
+    for blob_id, sha256, extension in orphans:
+        claimed = Blob.query.filter(Blob.id == blob_id, Blob.refcount <= 0) \
+            .update({'refcount': Blob.refcount}, synchronize_session=False)
+        if not claimed:
+            continue  # Referenced again since it was released
+        originals.append(Blob.key_for(sha256, extension))
+        renditions += [filename for (filename,) in db.session.query(Rendition.filename)
+                       .filter(Rendition.blob_id == blob_id)]
+        Rendition.query.filter(Rendition.blob_id == blob_id).delete(synchronize_session=False)
+        Blob.query.filter(Blob.id == blob_id).delete(synchronize_session=False)
+
+    if originals:
+        get_storage().delete_many(originals)
+    if renditions:
+        get_storage('renditions').delete_many(renditions)
+    db.session.commit()
+
+
+def migrate_legacy_images(batch_size=100, echo=print):
+    """
+    Move images stored under their original filename into content storage.
+
+    Such files only ever existed in the local upload folder; they are copied
+    into whichever storage backend is configured. The legacy files are
+    removed by delete_files jobs committed with each batch, so they stay in
+    place for as long as any image row still points at them.
+
+    Args:
+        batch_size (int): Number of images to commit per transaction
+        echo (callable): Function used to report progress
+
+    Returns:
+        tuple: (number of images migrated, number of missing files)
+    """
+    migrated = missing = 0
+    blobs, filenames = [], []
+    legacy = Image.query.filter(Image.blob_id.is_(None)).order_by(Image.id).all()
+    for image in legacy:
+        path = os.path.join(current_app.config['UPLOAD_FOLDER'], image.filename)
+        if not os.path.exists(path):
+            missing += 1
+            echo(f'Image {image.id}: file {image.filename} not found')
+            continue
+
+        sha256, size = hash_file(path)
+        image.blob = store_file(path, sha256, size, file_extension(image.filename), move=False)
+        blobs.append(image.blob)
+        filenames.append(image.filename)
+        # Flush so a later duplicate in this batch finds the new blob
+        db.session.flush()
+        migrated += 1
+        if migrated % batch_size == 0:
+            _commit_migrated_batch(blobs, filenames)
+            blobs, filenames = [], []
+            echo(f'{migrated}/{len(legacy)} images migrated')
+    _commit_migrated_batch(blobs, filenames)
+    return migrated, missing
+
+
+def _commit_migrated_batch(blobs, filenames):
+    """Commit a batch of migrated images with the jobs removing their legacy files."""
+    if filenames:
+        enqueue('delete_files', files=[['legacy', filename] for filename in filenames])
+    try:
+        db.session.commit()
+    except Exception:
+        db.session.rollback()
+        for blob in blobs:
+            discard_new_blob(blob)
+        raise
@@ -0,0 +1,415 @@
+"""
+Storage Backend Module for the Image Storage Application.
+
+This module hides where stored files live behind a small interface, so
+originals and renditions can be kept on a local disk or in an S3-compatible
+object store (AWS S3, MinIO, Ceph, R2, ...) shared by any number of app
+nodes. Keys are '/'-separated paths such as 'ab/cd/abcdef....png'. It handles:
+- A local-disk driver writing files atomically below a root folder
+- An S3 driver with pooled connections and multipart transfers
+- Temporary local copies of stored files for Pillow to decode
+- URLs that let clients fetch files straight from the object store
+- Building the configured backends, also inside worker processes
+"""
+
+import mimetypes
+import os
+import shutil
+import tempfile
+import threading
+import time
+import uuid
+from collections import OrderedDict
+from contextlib import contextmanager
+
+from flask import current_app
+
+# Presigned URLs cached per process so repeat page views reuse the same URL,
+# which lets browsers cache the file until the URL is renewed
+PRESIGNED_URL_CACHE_SIZE = 10000
+
+# Most keys S3 accepts in one DeleteObjects request
+S3_DELETE_BATCH_SIZE = 1000
+
+
+class LocalStorage:
+    """
+    Files stored below a folder on the local filesystem.
+
+    Attributes:
+        root (str): Folder holding the files
+    """
+
+    local = True
+
+    def __init__(self, root, **options):
+        self.root = root
+
+    def path(self, key):
+        """Return the filesystem path of a key."""
+        return os.path.join(self.root, *key.split('/'))
+
+    def exists(self, key):
+        """Check whether a file is stored under `key`."""
+        return os.path.isfile(self.path(key))
+
+    def put_file(self, source, key, move=False):
+        """
+        Atomically store a local file under `key`.
+
+        Copies go through a uniquely named temporary file, so concurrent
+        writers of the same key never see or produce a partial file.
+
+        Args:
+            source (str): File to store
+            key (str): Storage key
+            move (bool): Move the file instead of copying it
+        """
+        destination = self.path(key)
+        os.makedirs(os.path.dirname(destination), exist_ok=True)
+        if move:
+            try:
+                os.replace(source, destination)
+                return
+            except OSError:
+                # Different filesystem: fall back to copying
+                pass
+        tmp = f'{destination}.{uuid.uuid4().hex}.tmp'
+        try:
+            shutil.copyfile(source, tmp)
+            os.replace(tmp, destination)
+        except BaseException:
+            if os.path.exists(tmp):
+                os.remove(tmp)
+            raise
+        if move:
+            os.remove(source)
+
+    @contextmanager
+    def local_path(self, key):
+        """
+        Yield a local path holding the file stored under `key`.
+
+        Raises:
+            FileNotFoundError: If nothing is stored under the key
+        """
+        path = self.path(key)
+        if not os.path.isfile(path):
+            raise FileNotFoundError(path)
+        yield path
+
+    def delete(self, key):
+        """Delete the file stored under `key`, if any."""
+        try:
+            os.remove(self.path(key))
+        except FileNotFoundError:
+            pass
+
+    def delete_many(self, keys):
+        """Delete the files stored under several keys, skipping missing ones."""
+        for key in keys:
+            self.delete(key)
+
+    def url(self, key, version=None):
+        """Local files are served by the application; there is no direct URL."""
+        return None
+
+
+class S3Storage:
+    """
+    Files stored as objects in an S3-compatible bucket.
+
+    The boto3 client is created lazily in each process (never shared across
+    a fork) and keeps up to `max_pool_connections` HTTP connections alive
+    for the threads of that process. Files larger than the multipart
+    threshold are transferred in parallel parts.
+
+    Attributes:
+        bucket (str): Bucket name
+        prefix (str): Prefix prepended to every key
+        public_url (str): Base URL serving the bucket publicly (e.g. a CDN),
+            used instead of presigned URLs when set
+        presign_expires (int): Lifetime of presigned URLs in seconds
+        cache_control (str): Cache-Control stored with uploaded objects
+    """
+
+    local = False
+
+    def __init__(self, bucket, prefix='', endpoint_url=None, region=None, access_key_id=None,
+                 secret_access_key=None, public_url=None, presign_expires=3600, cache_control=None,
+                 max_pool_connections=50, multipart_threshold=8 * 1024 * 1024,
+                 multipart_chunksize=8 * 1024 * 1024, max_concurrency=4, temp_folder=None, **options):
+        self.bucket = bucket
+        self.prefix = prefix
+        self.endpoint_url = endpoint_url
+        self.region = region
+        self.access_key_id = access_key_id
+        self.secret_access_key = secret_access_key
+        self.public_url = public_url.rstrip('/') if public_url else None
+        self.presign_expires = presign_expires
+        self.cache_control = cache_control
+        self.max_pool_connections = max_pool_connections
+        self.multipart_threshold = multipart_threshold
+        self.multipart_chunksize = multipart_chunksize
+        self.max_concurrency = max_concurrency
+        self.temp_folder = temp_folder
+        self._client = None
+        self._client_pid = None
+        self._lock = threading.Lock()
+        self._urls = OrderedDict()
+
+    @property
+    def client(self):
+        """The boto3 S3 client of this process."""
+        if self._client is None or self._client_pid != os.getpid():
+            with self._lock:
+                if self._client is None or self._client_pid != os.getpid():
+                    import boto3
+                    from botocore.config import Config as BotoConfig
+
+                    config = BotoConfig(
+                        max_pool_connections=self.max_pool_connections,
+                        retries={'max_attempts': 5, 'mode': 'standard'},
+                        # Stand-ins such as MinIO are addressed by path
+                        s3={'addressing_style': 'path'} if self.endpoint_url else None
+                    )
+                    self._client = boto3.session.Session().client(
+                        's3',
+                        endpoint_url=self.endpoint_url,
+                        region_name=self.region,
+                        aws_access_key_id=self.access_key_id,
+                        aws_secret_access_key=self.secret_access_key,
+                        config=config
+                    )
+                    self._client_pid = os.getpid()
+        return self._client
+
+    @property
+    def transfer_config(self):
+        """TransferConfig used for multipart uploads and downloads."""
+        from boto3.s3.transfer import TransferConfig
+
+        return TransferConfig(multipart_threshold=self.multipart_threshold,
+                              multipart_chunksize=self.multipart_chunksize,
+                              max_concurrency=self.max_concurrency)
+
+    def object_key(self, key):
+        """Return the bucket key of a storage key."""
+        return self.prefix + key
+
+    def exists(self, key):
+        """Check whether an object is stored under `key`."""
+        from botocore.exceptions import ClientError
+
+        try:
+            self.client.head_object(Bucket=self.bucket, Key=self.object_key(key))
+            return True
+        except ClientError as e:
+            if e.response.get('Error', {}).get('Code') in ('404', 'NoSuchKey', 'NotFound'):
+                return False
+            raise
+
+    def put_file(self, source, key, move=False):
+        """
+        Upload a local file under `key`, in parts if it is large.
+
+        Args:
+            source (str): File to upload
+            key (str): Storage key
+            move (bool): Delete the local file once uploaded
+        """
+        extra = {'ContentType': mimetypes.guess_type(key)[0] or 'application/octet-stream'}
+        if self.cache_control:
+            extra['CacheControl'] = self.cache_control
+        self.client.upload_file(source, self.bucket, self.object_key(key),
+                                ExtraArgs=extra, Config=self.transfer_config)
+        if move:
+            os.remove(source)
+
+    @contextmanager
+    def local_path(self, key):
+        """
+        Download the object stored under `key` into a temporary file.
+
+        The file is removed when the block exits.
+
+        Raises:
+            FileNotFoundError: If nothing is stored under the key
+        """
+        from botocore.exceptions import ClientError
+
+        if self.temp_folder:
+            os.makedirs(self.temp_folder, exist_ok=True)
+        fd, path = tempfile.mkstemp(suffix=os.path.splitext(key)[1], dir=self.temp_folder)
+        os.close(fd)
+        try:
+            try:
+                self.client.download_file(self.bucket, self.object_key(key), path,
+                                          Config=self.transfer_config)
+            except ClientError as e:
+                if e.response.get('Error', {}).get('Code') in ('404', 'NoSuchKey', 'NotFound'):
+                    raise FileNotFoundError(f's3://{self.bucket}/{self.object_key(key)}') from e
+                raise
+            yield path
+        finally:
+            os.remove(path)
+
+    def delete(self, key):
+        """Delete the object stored under `key`, if any."""
+        self.client.delete_object(Bucket=self.bucket, Key=self.object_key(key))
+
+    def delete_many(self, keys):
+        """Delete the objects stored under several keys, 1000 per request."""
+        keys = list(keys)
+        for offset in range(0, len(keys), S3_DELETE_BATCH_SIZE):
+            objects = [{'Key': self.object_key(key)} for key in keys[offset:offset + S3_DELETE_BATCH_SIZE]]
+            response = self.client.delete_objects(Bucket=self.bucket, Delete={'Objects': objects, 'Quiet': True})
+            errors = response.get('Errors')
+            if errors:
+                raise OSError(f"Could not delete {len(errors)} objects, e.g. {errors[0].get('Key')}: "
+                              f"{errors[0].get('Message')}")
+
+    def url(self, key, version=None):
+        """
+        Return a URL clients can fetch the object from directly.
+
+        With a public URL configured the result is stable (and carries
+        `version` as a cache buster); otherwise a presigned GET URL is
+        returned, reused until half its lifetime has passed.
+
+        Args:
+            key (str): Storage key
+            version (str, optional): Version appended to public URLs
+
+        Returns:
+            str: Direct URL of the object
+        """
+        if self.public_url:
+            url = f'{self.public_url}/{self.object_key(key)}'
+            return f'{url}?v={version}' if version else url
+
+        now = time.monotonic()
+        with self._lock:
+            cached = self._urls.get(key)
+            if cached is not None and cached[1] > now:
+                self._urls.move_to_end(key)
+                return cached[0]
+
+        url = self.client.generate_presigned_url(
+            'get_object', Params={'Bucket': self.bucket, 'Key': self.object_key(key)},
+            ExpiresIn=self.presign_expires)
+        with self._lock:
+            self._urls[key] = (url, now + self.presign_expires / 2)
+            self._urls.move_to_end(key)
+            while len(self._urls) > PRESIGNED_URL_CACHE_SIZE:
+                self._urls.popitem(last=False)
+        return url
+
+
+DRIVERS = {'local': LocalStorage, 's3': S3Storage}
+
+# Backends built from settings in worker processes, by settings
+_worker_backends = {}
+
+
+def create_storage(settings):
+    """
+    Build a storage backend from plain settings.
+
+    Args:
+        settings (dict): 'driver' plus the driver's constructor arguments
+
+    Returns:
+        LocalStorage or S3Storage: New backend
+    """
+    options = dict(settings)
+    driver = options.pop('driver')
+    if driver not in DRIVERS:
+        raise ValueError(f'Unknown storage driver {driver!r}, expected one of {sorted(DRIVERS)}')
+    return DRIVERS[driver](**options)
+
+
+def storage_from_settings(settings):
+    """
+    Return a backend for settings, reusing one per process.
+
+    Settings are plain dicts, so they can be handed to process pool workers,
+    which build their own backend (and connection pool) on first use.
+
+    Args:
+        settings (dict): Settings returned by storage_settings()
+
+    Returns:
+        LocalStorage or S3Storage: Backend for the settings
+    """
+    key = tuple(sorted(settings.items()))
+    backend = _worker_backends.get(key)
+    if backend is None:
+        backend = _worker_backends[key] = create_storage(settings)
+    return backend
+
+
+def storage_settings(config):
+    """
+    Build the settings of the 'originals' and 'renditions' stores.
+
+    Args:
+        config (Config): Application configuration
+
+    Returns:
+        dict: Store name mapped to its settings
+    """
+    driver = config['STORAGE_BACKEND']
+    if driver == 'local':
+        return {
+            'originals': {'driver': 'local', 'root': config['UPLOAD_FOLDER']},
+            'renditions': {'driver': 'local', 'root': config['RENDITION_FOLDER']},
+        }
+    if driver == 's3':
+        common = {
+            'driver': 's3',
+            'bucket': config['S3_BUCKET'],
+            'endpoint_url': config['S3_ENDPOINT_URL'],
+            'region': config['S3_REGION'],
+            'access_key_id': config['S3_ACCESS_KEY_ID'],
+            'secret_access_key': config['S3_SECRET_ACCESS_KEY'],
+            'public_url': config['S3_PUBLIC_URL'],
+            'presign_expires': config['S3_PRESIGN_EXPIRES'],
+            'max_pool_connections': config['S3_MAX_POOL_CONNECTIONS'],
+            'multipart_threshold': config['S3_MULTIPART_THRESHOLD'],
+            'multipart_chunksize': config['S3_MULTIPART_CHUNKSIZE'],
+            'max_concurrency': config['S3_MAX_CONCURRENCY'],
+            'temp_folder': os.path.join(config['UPLOAD_FOLDER'], 'tmp'),
+        }
+        prefix = config['S3_PREFIX']
+        return {
+            # Originals never change under their content-addressed key
+            'originals': dict(common, prefix=prefix, cache_control='public, max-age=31536000, immutable'),
+            'renditions': dict(common, prefix=f'{prefix}renditions/', cache_control='public, max-age=86400'),
+        }
+    raise ValueError(f'Unknown STORAGE_BACKEND {driver!r}, expected one of {sorted(DRIVERS)}')
+
+
+def init_storage(app):
+    """
+    Create the application's storage backends from STORAGE_BACKEND.
+
+    Args:
+        app (Flask): Application to attach the backends to
+    """
+    settings = storage_settings(app.config)
+    app.extensions['storage_settings'] = settings
+    app.extensions['storage'] = {name: create_storage(store) for name, store in settings.items()}
+
+
+def get_storage(name='originals'):
+    """
+    Return one of the application's storage backends.
+
+    Args:
+        name (str): 'originals' or 'renditions'
+
+    Returns:
+        LocalStorage or S3Storage: The backend
+    """
+    return current_app.extensions['storage'][name]
@@ -0,0 +1,213 @@
+"""
+Taxonomy Cache Module for the Image Storage Application.
+
+This module keeps the category/subcategory lists used to fill form choices
+in memory, so rendering a form does not query the database for a taxonomy
+that almost never changes. Every cached snapshot carries a version number
+held by a version store; commits that touch a Category or Subcategory bump
+the version, and each process reloads its snapshot once it sees a newer one.
+It handles:
+- Loading and caching an ordered snapshot of the taxonomy
+- Bumping the taxonomy version whenever a change is committed
+- Sharing the version between worker processes through Redis (optional)
+"""
+
+import threading
+import time
+
+from flask import current_app
+from sqlalchemy import event
+
+from app.models import db, Category, Subcategory
+
+
+class LocalVersionStore:
+    """
+    Version store kept in process memory.
+
+    Suitable for a single process and for tests; with several workers each
+    one only sees its own changes until its snapshot expires.
+    """
+
+    def __init__(self):
+        self._version = 0
+        self._lock = threading.Lock()
+
+    def get(self):
+        """Return the current taxonomy version."""
+        return self._version
+
+    def bump(self):
+        """Increment and return the taxonomy version."""
+        with self._lock:
+            self._version += 1
+            return self._version
+
+
+class RedisVersionStore:
+    """
+    Version store shared by all workers through a Redis key.
+
+    Attributes:
+        key (str): Redis key holding the version counter
+    """
+
+    def __init__(self, url, key='image-storage:taxonomy-version'):
+        import redis
+
+        self._client = redis.Redis.from_url(url, socket_timeout=1)
+        self.key = key
+
+    def get(self):
+        """Return the current taxonomy version, or None if Redis is unavailable."""
+        try:
+            return int(self._client.get(self.key) or 0)
+        except Exception as e:
+            current_app.logger.warning('Version lookup of %s failed: %s', self.key, e)
+            return None
+
+    def bump(self):
+        """Increment and return the taxonomy version."""
+        try:
+            return self._client.incr(self.key)
+        except Exception as e:
+            current_app.logger.warning('Version bump of %s failed: %s', self.key, e)
+            return None
+
+
+class Taxonomy:
+    """
+    Immutable snapshot of the category taxonomy, ordered by name.
+
+    Attributes:
+        version (int): Version the snapshot was loaded at
+        categories (tuple): (id, name) pairs
+        subcategories (tuple): (id, name, category_id) triples
+    """
+
+    def __init__(self, version, categories, subcategories):
+        self.version = version
+        self.categories = categories
+        self.subcategories = subcategories
+        self.loaded_at = time.monotonic()
+
+    def category_choices(self):
+        """Return (id, name) choices for a category SelectField."""
+        return list(self.categories)
+
+    def subcategory_choices(self, category_id=None):
+        """
+        Return (id, name) choices for a subcategory SelectField.
+
+        Args:
+            category_id (int, optional): Only include subcategories of this category
+
+        Returns:
+            list: (id, name) pairs ordered by name
+        """
+        return [(sub_id, name) for sub_id, name, parent_id in self.subcategories
+                if category_id is None or parent_id == category_id]
+
+
+class TaxonomyCache:
+    """
+    Read-through cache of the taxonomy snapshot.
+
+    Attributes:
+        store: Version store (LocalVersionStore or RedisVersionStore)
+        ttl (int): Seconds after which a snapshot is reloaded regardless of version
+    """
+
+    def __init__(self, store, ttl):
+        self.store = store
+        self.ttl = ttl
+        self._snapshot = None
+        self._lock = threading.Lock()
+
+    def get(self):
+        """
+        Return the current taxonomy, reloading it if it is stale.
+
+        Returns:
+            Taxonomy: Current snapshot
+        """
+        version = self.store.get()
+        snapshot = self._snapshot
+        if self._is_fresh(snapshot, version):
+            return snapshot
+
+        with self._lock:
+            # Another thread may have reloaded while we waited
+            snapshot = self._snapshot
+            if not self._is_fresh(snapshot, version):
+                snapshot = self._snapshot = self._load(version)
+        return snapshot
+
+    def invalidate(self):
+        """Bump the shared version and drop this process's snapshot."""
+        self.store.bump()
+        self._snapshot = None
+
+    def _is_fresh(self, snapshot, version):
+        """Check whether a snapshot may still be served."""
+        return (snapshot is not None and version is not None and snapshot.version == version
+                and time.monotonic() - snapshot.loaded_at < self.ttl)
+
+    @staticmethod
+    def _load(version):
+        """Load a new snapshot from the database."""
+        categories = tuple((row.id, row.name) for row in
+                           db.session.query(Category.id, Category.name).order_by(Category.name))
+        subcategories = tuple((row.id, row.name, row.category_id) for row in
+                              db.session.query(Subcategory.id, Subcategory.name, Subcategory.category_id)
+                              .order_by(Subcategory.name))
+        return Taxonomy(version, categories, subcategories)
+
+
+def init_taxonomy_cache(app):
+    """
+    Create the application's taxonomy cache.
+
+    A Redis version store is used when TAXONOMY_CACHE_REDIS_URL is set,
+    otherwise a local one.
+
+    Args:
+        app (Flask): Application to attach the cache to
+    """
+    url = app.config.get('TAXONOMY_CACHE_REDIS_URL')
+    store = RedisVersionStore(url) if url else LocalVersionStore()
+    app.extensions['taxonomy_cache'] = TaxonomyCache(store, app.config['TAXONOMY_CACHE_TTL'])
+
+
+def get_taxonomy():
+    """
+    Return the current taxonomy snapshot.
+
+    Returns:
+        Taxonomy: Categories and subcategories ordered by name
+    """
+    return current_app.extensions['taxonomy_cache'].get()
+
+
+@event.listens_for(db.session, 'before_flush')
+def _track_taxonomy_changes(session, flush_context, instances):
+    """Remember when a flush writes categories or subcategories."""
+    for obj in (*session.new, *session.dirty, *session.deleted):
+        if isinstance(obj, (Category, Subcategory)):
+            session.info['taxonomy_changed'] = True
+            return
+
+
+@event.listens_for(db.session, 'after_commit')
+def _invalidate_on_commit(session):
+    """Invalidate the taxonomy cache once a taxonomy change is committed."""
+    if session.info.pop('taxonomy_changed', False):
+        cache = current_app.extensions.get('taxonomy_cache')
+        if cache is not None:
+            cache.invalidate()
+
+
+@event.listens_for(db.session, 'after_rollback')
+def _forget_rolled_back_changes(session):
+    """Drop the change flag of a rolled back transaction."""
+    session.info.pop('taxonomy_changed', None)
@@ -0,0 +1,80 @@
+"""
+Testing Helpers for the Image Storage Application.
+
+This module provides utilities for tests that guard database access
+patterns, such as N+1 query regressions on listing pages. It provides:
+- A context manager that records every SQL statement sent to the database
+- An assertion helper that fails when a block exceeds a query budget
+"""
+
+from contextlib import contextmanager
+
+from sqlalchemy import event
+
+from app.models import db
+
+
+class QueryCounter:
+    """
+    Collects the SQL statements executed while it is active.
+
+    Attributes:
+        statements (list): SQL text of every executed statement, in order
+    """
+
+    def __init__(self):
+        self.statements = []
+
+    @property
+    def count(self):
+        """int: Number of statements executed."""
+        return len(self.statements)
+
+    def _record(self, conn, cursor, statement, parameters, context, executemany):
+        self.statements.append(statement)
+
+
+@contextmanager
+def count_queries(engine=None):
+    """
+    Record the SQL statements executed inside a `with` block.
+
+    Args:
+        engine (Engine, optional): Engine to watch, defaults to the app engine
+
+    Yields:
+        QueryCounter: Counter holding the executed statements
+    """
+    engine = engine or db.engine
+    counter = QueryCounter()
+    event.listen(engine, 'before_cursor_execute', counter._record)
+    try:
+        yield counter
+    finally:
+        event.remove(engine, 'before_cursor_execute', counter._record)
+
+
+@contextmanager
+def assert_max_queries(limit, engine=None):
+    """
+    Fail if a `with` block executes more than `limit` SQL statements.
+
+    Example:
+        with assert_max_queries(4):
+            client.get('/')
+
+    Args:
+        limit (int): Maximum number of statements allowed
+        engine (Engine, optional): Engine to watch, defaults to the app engine
+
+    Yields:
+        QueryCounter: Counter holding the executed statements
+
+    Raises:
+        AssertionError: If more than `limit` statements were executed
+    """
+    with count_queries(engine) as counter:
+        yield counter
+    if counter.count > limit:
+        listing = '\n'.join(f'{i}. {statement}' for i, statement in enumerate(counter.statements, 1))
+        raise AssertionError(f'Expected at most {limit} queries, got {counter.count}:\n{listing}')
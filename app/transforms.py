@@ -0,0 +1,355 @@
+"""
+Image Transform Module for the Image Storage Application.
+
+This module resizes and converts images on request for responsive `srcset`
+markup and API clients, e.g. `/img/42/w640.webp?q=75`. Results are kept in a
+size-bounded on-disk cache evicted in least-recently-used order. It handles:
+- Validating requested widths, formats and qualities against whitelists
+- Rendering a transform once even when many requests ask for it at once
+- Evicting the least recently used cache files beyond the size budget
+- Building transform URLs and srcset attributes for templates
+"""
+
+import mimetypes
+import os
+import threading
+import uuid
+
+from flask import Blueprint, current_app, request, abort, url_for
+from PIL import Image as PILImage
+
+from app.models import db, Image
+from app.media import send_media
+from app.renditions import is_raster, prepare_image
+from app.storage import file_extension
+
+try:
+    # AVIF encoding needs the optional pillow-avif-plugin package
+    import pillow_avif  # noqa: F401
+except ImportError:
+    pass
+
+bp = Blueprint('transforms', __name__, url_prefix='/img')
+
+# URL extension mapped to the Pillow encoder writing it
+PILLOW_FORMATS = {'webp': 'WEBP', 'avif': 'AVIF', 'jpg': 'JPEG', 'png': 'PNG'}
+# Formats whose encoder ignores the quality setting
+LOSSLESS_FORMATS = {'png'}
+
+mimetypes.add_type('image/avif', '.avif')
+
+
+class SingleFlight:
+    """
+    Collapse concurrent calls for the same key into one execution.
+
+    The first caller for a key runs the function; callers arriving while it
+    runs wait for it and share its result (or exception).
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._calls = {}
+
+    def do(self, key, fn):
+        """
+        Run `fn` unless a call for `key` is already in flight.
+
+        Args:
+            key (str): Identity of the work
+            fn (callable): Function producing the result
+
+        Returns:
+            The result of the (possibly shared) call
+        """
+        with self._lock:
+            call = self._calls.get(key)
+            leader = call is None
+            if leader:
+                call = self._calls[key] = {'done': threading.Event(), 'result': None, 'error': None}
+
+        if not leader:
+            call['done'].wait()
+            if call['error'] is not None:
+                raise call['error']
+            return call['result']
+
+        try:
+            call['result'] = fn()
+            return call['result']
+        except BaseException as e:
+            call['error'] = e
+            raise
+        finally:
+            with self._lock:
+                del self._calls[key]
+            call['done'].set()
+
+
+class DiskCache:
+    """
+    Size-bounded file cache evicted in least-recently-used order.
+
+    A file's modification time doubles as its last access time: hits touch
+    the file, and eviction removes the oldest files until the cache is back
+    under 90% of its budget. The running total is tracked in memory and
+    seeded from a scan of the folder on first use, so several processes may
+    share one folder; each simply evicts when its own view is over budget.
+
+    Attributes:
+        folder (str): Directory holding the cached files
+        max_bytes (int): Size budget of the cache
+    """
+
+    def __init__(self, folder, max_bytes):
+        self.folder = folder
+        self.max_bytes = max_bytes
+        self._lock = threading.Lock()
+        self._size = None
+
+    def path_for(self, key):
+        """Return the path a cache key is stored at."""
+        return os.path.join(self.folder, key[:2], key)
+
+    def get(self, key):
+        """
+        Look up a cached file and mark it as recently used.
+
+        Args:
+            key (str): Cache key
+
+        Returns:
+            str: Path of the cached file, or None on a miss
+        """
+        path = self.path_for(key)
+        try:
+            os.utime(path)
+        except FileNotFoundError:
+            return None
+        return path
+
+    def put(self, key, writer):
+        """
+        Create a cache entry and evict old entries if over budget.
+
+        Args:
+            key (str): Cache key
+            writer (callable): Called with a temporary path to write the file to
+
+        Returns:
+            str: Path of the cached file
+        """
+        path = self.path_for(key)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        tmp_path = f'{path}.{uuid.uuid4().hex}.tmp'
+        try:
+            writer(tmp_path)
+            os.replace(tmp_path, path)
+        except BaseException:
+            if os.path.exists(tmp_path):
+                os.remove(tmp_path)
+            raise
+
+        with self._lock:
+            if self._size is None:
+                self._size = self._scan_size()
+            else:
+                self._size += os.path.getsize(path)
+            if self._size > self.max_bytes:
+                self._evict(keep=path)
+        return path
+
+    def _entries(self):
+        """Yield (mtime, size, path) for every cached file."""
+        for dirpath, _, filenames in os.walk(self.folder):
+            for name in filenames:
+                if name.endswith('.tmp'):
+                    continue
+                path = os.path.join(dirpath, name)
+                try:
+                    stat = os.stat(path)
+                except FileNotFoundError:
+                    continue
+                yield stat.st_mtime, stat.st_size, path
+
+    def _scan_size(self):
+        """Return the total size of the cached files."""
+        return sum(size for _, size, _ in self._entries())
+
+    def _evict(self, keep):
+        """Remove least recently used files until under 90% of the budget."""
+        entries = sorted(self._entries())
+        self._size = sum(size for _, size, _ in entries)
+        target = self.max_bytes * 0.9
+        for _, size, path in entries:
+            if self._size <= target:
+                break
+            if path == keep:
+                continue
+            try:
+                os.remove(path)
+            except FileNotFoundError:
+                pass
+            self._size -= size
+
+
+_flights = SingleFlight()
+
+
+def get_cache():
+    """
+    Return the application's transform cache, creating it on first use.
+
+    Returns:
+        DiskCache: Cache configured from TRANSFORM_CACHE_FOLDER and TRANSFORM_CACHE_MAX_BYTES
+    """
+    cache = current_app.extensions.get('transform_cache')
+    if cache is None:
+        cache = current_app.extensions['transform_cache'] = DiskCache(
+            current_app.config['TRANSFORM_CACHE_FOLDER'],
+            current_app.config['TRANSFORM_CACHE_MAX_BYTES']
+        )
+    return cache
+
+
+def available_formats():
+    """
+    Return the configured output formats Pillow can encode here.
+
+    Returns:
+        list: URL extensions such as 'webp' and 'jpg'
+    """
+    PILImage.init()
+    return [fmt for fmt in current_app.config['TRANSFORM_FORMATS']
+            if PILLOW_FORMATS.get(fmt) in PILImage.SAVE]
+
+
+def transform_image(source_path, dest_path, width, fmt, quality):
+    """
+    Resize an image to a width and encode it in another format.
+
+    Images narrower than `width` are re-encoded at their own size rather
+    than upscaled.
+
+    Args:
+        source_path (str): Path to the original image
+        dest_path (str): Path to write the result to
+        width (int): Maximum output width in pixels
+        fmt (str): Output format extension, e.g. 'webp'
+        quality (int): Encoder quality for lossy formats
+    """
+    with PILImage.open(source_path) as original:
+        img = prepare_image(original, width)
+        if img.width > width:
+            height = max(1, round(img.height * width / img.width))
+            img = img.resize((width, height), PILImage.LANCZOS)
+        if fmt == 'jpg' and img.mode != 'RGB':
+            img = img.convert('RGB')
+
+        if fmt in LOSSLESS_FORMATS:
+            img.save(dest_path, PILLOW_FORMATS[fmt], optimize=True)
+        else:
+            img.save(dest_path, PILLOW_FORMATS[fmt], quality=quality)
+
+
+def source_version(image):
+    """
+    Identify the contents of an image for cache keys and URL versions.
+
+    Args:
+        image (Image): Image being transformed
+
+    Returns:
+        str: The blob hash, or the image ID and upload time for legacy files
+    """
+    if image.blob is not None:
+        return image.blob.sha256
+    return f'legacy{image.id}-{int(image.upload_date.timestamp())}'
+
+
+@bp.route('/<int:image_id>/w<int:width>.<fmt>')
+def transform(image_id, width, fmt):
+    """
+    Serve an image resized to a whitelisted width and format.
+
+    The optional `q` argument selects one of TRANSFORM_QUALITIES. URLs built
+    with transform_url carry a `v` version of the source contents and are
+    cached by browsers for a year.
+
+    Args:
+        image_id (int): ID of the image
+        width (int): Requested width from TRANSFORM_WIDTHS
+        fmt (str): Requested format from TRANSFORM_FORMATS
+
+    Returns:
+        Response: Transformed image
+    """
+    config = current_app.config
+    quality = request.args.get('q', config['TRANSFORM_DEFAULT_QUALITY'], type=int)
+    if width not in config['TRANSFORM_WIDTHS']:
+        abort(400, description=f'Width must be one of {sorted(config["TRANSFORM_WIDTHS"])}')
+    if fmt not in available_formats():
+        abort(400, description=f'Format must be one of {available_formats()}')
+    if quality not in config['TRANSFORM_QUALITIES']:
+        abort(400, description=f'Quality must be one of {sorted(config["TRANSFORM_QUALITIES"])}')
+
+    image = Image.query.options(db.joinedload(Image.blob)).filter(Image.id == image_id).first_or_404()
+    if not is_raster(file_extension(image.storage_key)):
+        abort(404)
+
+    version = source_version(image)
+    if fmt in LOSSLESS_FORMATS:
+        quality = 0
+    key = f'{version}-w{width}-q{quality}.{fmt}'
+
+    cache = get_cache()
+
+    def render():
+        # The original is only fetched from storage when nothing is cached
+        with image.local_path() as source_path:
+            return cache.put(key, lambda tmp_path: transform_image(source_path, tmp_path, width, fmt, quality))
+
+    path = cache.get(key)
+    if path is None:
+        try:
+            path = _flights.do(key, lambda: cache.get(key) or render())
+        except FileNotFoundError:
+            abort(404)
+
+    return send_media(path, etag=key, immutable=request.args.get('v') == version[:16])
+
+
+@bp.app_template_global()
+def transform_url(image, width, fmt='webp', quality=None):
+    """
+    Template helper returning a versioned transform URL.
+
+    Args:
+        image (Image): Image to transform
+        width (int): Width from TRANSFORM_WIDTHS
+        fmt (str): Format from TRANSFORM_FORMATS
+        quality (int, optional): Quality from TRANSFORM_QUALITIES
+
+    Returns:
+        str: URL of the transformed image
+    """
+    return url_for('transforms.transform', image_id=image.id, width=width, fmt=fmt,
+                   q=quality, v=source_version(image)[:16])
+
+
+@bp.app_template_global()
+def transform_srcset(image, fmt='webp'):
+    """
+    Template helper returning a srcset covering every whitelisted width.
+
+    Args:
+        image (Image): Image to build the srcset for
+        fmt (str): Format from TRANSFORM_FORMATS
+
+    Returns:
+        str: srcset attribute value, or '' for images that cannot be transformed
+    """
+    if not is_raster(file_extension(image.storage_key)):
+        return ''
+    return ', '.join(f'{transform_url(image, width, fmt)} {width}w'
+                     for width in sorted(current_app.config['TRANSFORM_WIDTHS']))
@@ -0,0 +1,409 @@
+"""
+Chunked Upload Module for the Image Storage Application.
+
+This module provides a resumable upload API for files too large to send in
+a single form post. Chunks are streamed straight from the request body into
+a temporary file at their offsets, so no request ever buffers more than
+one chunk. It handles:
+- Starting an upload session (init), within limits on the number and
+  total size of the uploads in progress
+- Receiving checksum-verified chunks in any order (put-chunk), refusing
+  files that are not acceptable images as soon as the first chunk arrived
+- Reporting which chunks have arrived so clients can resume (status)
+- Moving the finished file into content-addressed storage (complete)
+- Creating Image records for stored blobs
+- Processing new images in the background (renditions, metadata)
+"""
+
+import hashlib
+import os
+import re
+import uuid
+from datetime import datetime, timedelta
+
+from flask import Blueprint, current_app, request, jsonify, url_for
+from werkzeug.utils import secure_filename
+
+from app.models import db, Category, Subcategory, Image, UploadSession, UploadChunk
+from app.jobs import enqueue, job_handler
+from app.metrics import observe_upload
+from app.metadata import apply_metadata
+from app.renditions import generate_renditions, is_raster
+from app.similarity import apply_hash, index_image
+from app.storage import CHUNK_SIZE, file_extension, hash_file, rewrite_file, store_file, discard_new_blob, temp_folder
+from app.validation import InvalidImage, UploadValidator, inspect_header
+
+bp = Blueprint('uploads', __name__, url_prefix='/api/uploads')
+
+SHA256_PATTERN = re.compile(r'^[0-9a-f]{64}$')
+
+
+def create_image(blob, **fields):
+    """
+    Create an Image record for a stored blob.
+
+    Renditions and other derived data are not computed here: a
+    process_image job is enqueued in the same transaction, so the request
+    returns as soon as the original is stored and the image is processed in
+    the background. The image is added to the session and the caller commits.
+
+    Args:
+        blob (Blob): Blob holding the image contents
+        **fields: Image column values (name, filename, description, ...)
+
+    Returns:
+        Image: The new, uncommitted image
+    """
+    image = Image(blob=blob, **fields)
+    db.session.add(image)
+    db.session.flush()
+    enqueue('process_image', image_id=image.id)
+    observe_upload(blob.size)
+    return image
+
+
+@job_handler('process_image')
+def process_image(job):
+    """
+    Fill in the derived data of a newly stored image.
+
+    The blob's renditions are rendered unless an identical upload already
+    did so, and the original's metadata (dimensions, format, size, color
+    mode, generation parameters) and perceptual hash are recorded on the
+    image.
+
+    Args:
+        job (Job): The process_image job
+    """
+    image = db.session.get(Image, job.image_id)
+    if image is None or image.blob is None:
+        return  # Deleted before the job ran
+
+    blob = image.blob
+    # One local copy of the original serves every step
+    with blob.local_path() as path:
+        if is_raster(blob.extension) and not blob.renditions:
+            generate_renditions(blob, path)
+        apply_metadata(image, path)
+        apply_hash(image, path)
+    index_image(image)
+
+
+def _error(message, status=400, **extra):
+    """Return a JSON error response."""
+    return jsonify({'error': message, **extra}), status
+
+
+def _session_status(session):
+    """Serialize an upload session for API responses."""
+    return {
+        'id': session.id,
+        'filename': session.filename,
+        'size': session.total_size,
+        'chunk_size': session.chunk_size,
+        'chunk_count': session.chunk_count,
+        'received': [chunk.index for chunk in session.chunks],
+    }
+
+
+def _reject_upload(session, error):
+    """Discard an upload whose file is not an acceptable image and report why."""
+    session.delete_file()
+    db.session.delete(session)
+    db.session.commit()
+    return _error(str(error), error.status)
+
+
+def purge_stale_uploads(max_age=None):
+    """
+    Delete upload sessions that have not received a chunk recently.
+
+    Args:
+        max_age (int, optional): Age in seconds, defaults to UPLOAD_SESSION_TTL
+
+    Returns:
+        int: Number of sessions purged
+    """
+    max_age = max_age or current_app.config['UPLOAD_SESSION_TTL']
+    cutoff = datetime.utcnow() - timedelta(seconds=max_age)
+    stale = UploadSession.query.filter(UploadSession.updated_at < cutoff).all()
+    for session in stale:
+        session.delete_file()
+        db.session.delete(session)
+    db.session.commit()
+    return len(stale)
+
+
+def _has_upload_capacity(size):
+    """
+    Check whether another upload of `size` bytes fits within the limits.
+
+    Args:
+        size (int): Size of the new upload in bytes
+
+    Returns:
+        bool: True if MAX_UPLOAD_SESSIONS and MAX_UPLOAD_RESERVED_BYTES allow it
+    """
+    sessions, reserved = db.session.query(
+        db.func.count(UploadSession.id), db.func.coalesce(db.func.sum(UploadSession.total_size), 0)).one()
+    return (sessions < current_app.config['MAX_UPLOAD_SESSIONS']
+            and reserved + size <= current_app.config['MAX_UPLOAD_RESERVED_BYTES'])
+
+
+@bp.route('', methods=['POST'])
+def create_upload():
+    """
+    Start a chunked upload.
+
+    Expects a JSON body with `filename`, `size`, `name`, `category_id` and
+    `subcategory_id`, and optionally `description`, `prompt` and the `sha256`
+    of the whole file.
+
+    Returns:
+        str: JSON upload status with the chunk size to use (201)
+    """
+    data = request.get_json(silent=True) or {}
+
+    filename = secure_filename(str(data.get('filename') or ''))
+    if file_extension(filename) not in current_app.config['ALLOWED_EXTENSIONS']:
+        return _error('Only image files (jpg, png, jpeg, gif, webp, svg) are allowed!')
+
+    size = data.get('size')
+    max_size = current_app.config['MAX_UPLOAD_SIZE']
+    # JSON true and false are bools, which isinstance() would accept as ints
+    if type(size) is not int or size <= 0:
+        return _error('size must be a positive integer')
+    if size > max_size:
+        return _error(f'File exceeds the maximum upload size of {max_size} bytes', 413)
+
+    name = str(data.get('name') or '').strip()
+    description = data.get('description') or ''
+    prompt = data.get('prompt') or ''
+    if not 3 <= len(name) <= 200:
+        return _error('Name must be between 3 and 200 characters')
+    if len(description) > 1000:
+        return _error('Description cannot exceed 1000 characters')
+    if len(prompt) > 500:
+        return _error('Prompt cannot exceed 500 characters')
+
+    sha256 = data.get('sha256')
+    if sha256 is not None and not SHA256_PATTERN.match(str(sha256).lower()):
+        return _error('sha256 must be a hex SHA-256 digest')
+
+    try:
+        category = db.session.get(Category, data.get('category_id'))
+        subcategory = db.session.get(Subcategory, data.get('subcategory_id'))
+        if category is None or subcategory is None:
+            return _error('Unknown category or subcategory')
+
+        if not _has_upload_capacity(size):
+            purge_stale_uploads()
+            if not _has_upload_capacity(size):
+                return _error('Too many uploads in progress, please try again later', 429)
+
+        session = UploadSession(
+            id=uuid.uuid4().hex,
+            filename=filename,
+            total_size=size,
+            chunk_size=current_app.config['UPLOAD_CHUNK_SIZE'],
+            sha256=sha256.lower() if sha256 else None,
+            name=name,
+            description=description,
+            prompt=prompt,
+            category_id=category.id,
+            subcategory_id=subcategory.id
+        )
+
+        # Chunks are written at their offsets; the file grows as they arrive
+        temp_folder()
+        open(session.get_filepath(), 'wb').close()
+
+        db.session.add(session)
+        db.session.commit()
+
+        response = jsonify(_session_status(session))
+        response.headers['Location'] = url_for('uploads.upload_status', upload_id=session.id)
+        return response, 201
+    except Exception as e:
+        db.session.rollback()
+        return _error(f'Error starting upload: {str(e)}', 500)
+
+
+@bp.route('/<upload_id>', methods=['GET'])
+def upload_status(upload_id):
+    """
+    Report which chunks of an upload have been received.
+
+    Args:
+        upload_id (str): ID of the upload session
+
+    Returns:
+        str: JSON upload status
+    """
+    session = db.session.get(UploadSession, upload_id)
+    if session is None:
+        return _error('Upload not found', 404)
+    return jsonify(_session_status(session))
+
+
+@bp.route('/<upload_id>/chunks/<int:index>', methods=['PUT'])
+def put_chunk(upload_id, index):
+    """
+    Receive one chunk of an upload.
+
+    The raw request body is the chunk and the `X-Chunk-SHA256` header its
+    hex digest. The body is streamed to its offset in the temporary file and
+    the chunk is only recorded once its length and digest check out, so a
+    failed chunk can simply be sent again. The header in the first chunk is
+    validated right away; if it rules the file out, the upload is discarded.
+
+    Args:
+        upload_id (str): ID of the upload session
+        index (int): Zero-based chunk index
+
+    Returns:
+        str: JSON upload status
+    """
+    session = db.session.get(UploadSession, upload_id)
+    if session is None:
+        return _error('Upload not found', 404)
+    if index >= session.chunk_count:
+        return _error(f'Chunk index must be below {session.chunk_count}')
+
+    expected_length = session.expected_chunk_length(index)
+    if request.content_length != expected_length:
+        return _error(f'Chunk {index} must be exactly {expected_length} bytes')
+
+    expected_digest = request.headers.get('X-Chunk-SHA256', '').lower()
+    if not SHA256_PATTERN.match(expected_digest):
+        return _error('X-Chunk-SHA256 header with the chunk digest is required')
+
+    try:
+        hasher = hashlib.sha256()
+        written = 0
+        with open(session.get_filepath(), 'r+b') as f:
+            f.seek(index * session.chunk_size)
+            while written < expected_length:
+                data = request.stream.read(min(CHUNK_SIZE, expected_length - written))
+                if not data:
+                    break
+                hasher.update(data)
+                f.write(data)
+                written += len(data)
+            f.flush()
+            os.fsync(f.fileno())
+
+        if written != expected_length or hasher.hexdigest() != expected_digest:
+            return _error('Chunk checksum mismatch, please resend the chunk', 422)
+
+        if index == 0:
+            try:
+                inspect_header(session.get_filepath(), expected_length, file_extension(session.filename))
+            except InvalidImage as e:
+                return _reject_upload(session, e)
+
+        chunk = db.session.get(UploadChunk, (session.id, index))
+        if chunk is None:
+            chunk = UploadChunk(session_id=session.id, index=index)
+            db.session.add(chunk)
+        chunk.sha256 = expected_digest
+        session.updated_at = datetime.utcnow()
+        db.session.commit()
+
+        return jsonify(_session_status(session))
+    except FileNotFoundError:
+        db.session.rollback()
+        return _error('Upload data is gone, please start a new upload', 410)
+    except Exception as e:
+        db.session.rollback()
+        return _error(f'Error receiving chunk: {str(e)}', 500)
+
+
+@bp.route('/<upload_id>/complete', methods=['POST'])
+def complete_upload(upload_id):
+    """
+    Finish an upload once every chunk has arrived.
+
+    The assembled file is hashed and validated in one pass, checked against
+    the digest given at init (if any), atomically moved into
+    content-addressed storage and turned into an Image.
+
+    Args:
+        upload_id (str): ID of the upload session
+
+    Returns:
+        str: JSON with the new image ID and its URL (201)
+    """
+    session = db.session.get(UploadSession, upload_id)
+    if session is None:
+        return _error('Upload not found', 404)
+
+    received = {chunk.index for chunk in session.chunks}
+    missing = sorted(set(range(session.chunk_count)) - received)
+    if missing:
+        return _error('Upload is missing chunks', 409, missing=missing)
+
+    blob = None
+    try:
+        path = session.get_filepath()
+        validator = UploadValidator(file_extension(session.filename))
+        sha256, size = hash_file(path, validator.feed)
+        if size != session.total_size or (session.sha256 and sha256 != session.sha256):
+            return _error('File checksum mismatch, please resend the chunks', 422)
+        info = validator.finish()
+        if info.document is not None:
+            sha256, size = rewrite_file(path, info.document)
+
+        blob = store_file(path, sha256, size, info.extension)
+        image = create_image(
+            blob,
+            name=session.name,
+            filename=session.filename,
+            description=session.description,
+            prompt=session.prompt,
+            category_id=session.category_id,
+            subcategory_id=session.subcategory_id
+        )
+        db.session.delete(session)
+        db.session.commit()
+
+        return jsonify({
+            'image_id': image.id,
+            'url': url_for('main.image_details', image_id=image.id),
+            'status_url': url_for('main.image_status', image_id=image.id)
+        }), 201
+    except InvalidImage as e:
+        db.session.rollback()
+        return _reject_upload(session, e)
+    except FileNotFoundError:
+        db.session.rollback()
+        return _error('Upload data is gone, please start a new upload', 410)
+    except Exception as e:
+        db.session.rollback()
+        discard_new_blob(blob)
+        return _error(f'Error completing upload: {str(e)}', 500)
+
+
+@bp.route('/<upload_id>', methods=['DELETE'])
+def abort_upload(upload_id):
+    """
+    Abandon an upload and discard the received data.
+
+    Args:
+        upload_id (str): ID of the upload session
+
+    Returns:
+        str: Empty response (204)
+    """
+    session = db.session.get(UploadSession, upload_id)
+    if session is None:
+        return _error('Upload not found', 404)
+
+    try:
+        session.delete_file()
+        db.session.delete(session)
+        db.session.commit()
+        return '', 204
+    except Exception as e:
+        db.session.rollback()
+        return _error(f'Error aborting upload: {str(e)}', 500)
@@ -0,0 +1,413 @@
+"""
+Upload Validation Module for the Image Storage Application.
+
+This module checks that a file really is an image the application can
+store and serve, from its bytes rather than its filename. Files are
+inspected chunk by chunk while they are copied, so a bad file is refused as
+soon as its first chunk has been read, and pixel data is never decoded. It
+handles:
+- Recognizing PNG, JPEG, GIF, WebP and SVG files by their magic bytes and
+  storing them under the extension of their actual format
+- Reading the dimensions from the image header alone and enforcing the
+  pixel count and dimension limits before anything decodes the image;
+  WebP dimensions are read from the RIFF chunk header directly, since
+  Pillow only opens a WebP file once it has all of it
+- Refusing truncated files that lack their format's end marker
+- Removing scripts, event handlers and external references from SVGs
+"""
+
+import io
+import re
+from collections import namedtuple
+from xml.etree import ElementTree
+
+from flask import current_app
+from PIL import Image as PILImage
+
+# Header bytes buffered before Pillow reads it; JPEG headers carry EXIF and
+# ICC data ahead of the dimensions, so the buffer grows up to MAX_HEADER_BYTES
+HEADER_BYTES = 64 * 1024
+MAX_HEADER_BYTES = 1024 * 1024
+
+# Bytes up to and including the dimensions in the first chunk of a WebP file
+WEBP_HEADER_BYTES = 30
+
+# Bytes kept from the end of the file to look for the end marker
+TAIL_BYTES = 1024
+
+# Sniffed format mapped to (Pillow format, allowed extensions, the first being canonical)
+FORMATS = {
+    'png': ('PNG', ('png',)),
+    'jpeg': ('JPEG', ('jpg', 'jpeg')),
+    'gif': ('GIF', ('gif',)),
+    'webp': ('WEBP', ('webp',)),
+    'svg': (None, ('svg',)),
+}
+
+PNG_END = b'IEND\xaeB`\x82'
+JPEG_END = b'\xff\xd9'
+
+# An SVG document may open with a byte order mark, an XML declaration, comments and a DOCTYPE
+SVG_START = re.compile(rb'(?:\xef\xbb\xbf)?\s*(?:<\?xml[^>]*>\s*)?(?:(?:<!--.*?-->|<!DOCTYPE[^>\[]*>)\s*)*<svg[\s>/]',
+                       re.DOTALL)
+
+SVG_NAMESPACE = 'http://www.w3.org/2000/svg'
+XLINK_NAMESPACE = 'http://www.w3.org/1999/xlink'
+XML_NAMESPACE = 'http://www.w3.org/XML/1998/namespace'
+
+# SVG elements that run code or embed other documents
+UNSAFE_SVG_ELEMENTS = {'script', 'foreignObject', 'handler', 'listener'}
+ANIMATION_ELEMENTS = {'set', 'animate', 'animateColor', 'animateMotion', 'animateTransform'}
+
+# References that stay inside the document: fragments and embedded raster images
+SAFE_HREF = re.compile(r'\s*(?:#|data:image/(?:png|jpeg|gif|webp)[;,])', re.IGNORECASE)
+
+# Attribute values and style sheets that load or run something outside the document
+UNSAFE_CSS = re.compile(r'@import|javascript:|expression\s*\(|url\s*\(\s*["\']?\s*(?!#|data:image/)',
+                        re.IGNORECASE)
+
+ElementTree.register_namespace('xlink', XLINK_NAMESPACE)
+
+ImageInfo = namedtuple('ImageInfo', 'format extension width height document')
+ImageInfo.__doc__ = """
+Result of validating a file.
+
+Attributes:
+    format (str): Sniffed format, a key of FORMATS
+    extension (str): Extension to store the file under
+    width (int): Width from the header, None for SVG
+    height (int): Height from the header, None for SVG
+    document (bytes): Sanitized SVG to store instead of the upload, None for raster images
+"""
+
+
+class InvalidImage(ValueError):
+    """Raised when a file is not a valid image; `status` is the HTTP status to report."""
+
+    status = 422
+
+
+class UnsupportedImage(InvalidImage):
+    """Raised when a file is not in one of the allowed formats."""
+
+    status = 415
+
+
+class ImageTooLarge(InvalidImage):
+    """Raised when an image exceeds the configured size limits."""
+
+    status = 413
+
+
+def validation_limits():
+    """
+    Return the validation limits from the application config.
+
+    The limits are plain values so they can be handed to worker processes.
+
+    Returns:
+        dict: max_pixels, max_dimension, max_svg_size and allowed_extensions
+    """
+    config = current_app.config
+    return {
+        'max_pixels': config['MAX_IMAGE_PIXELS'],
+        'max_dimension': config['MAX_IMAGE_DIMENSION'],
+        'max_svg_size': config['MAX_SVG_SIZE'],
+        'allowed_extensions': set(config['ALLOWED_EXTENSIONS']),
+    }
+
+
+def sniff_format(head):
+    """
+    Recognize an image format from the first bytes of a file.
+
+    Args:
+        head (bytes): Start of the file
+
+    Returns:
+        str: Key of FORMATS, or None if the bytes match no supported format
+    """
+    if head.startswith(b'\x89PNG\r\n\x1a\n'):
+        return 'png'
+    if head.startswith(b'\xff\xd8\xff'):
+        return 'jpeg'
+    if head[:6] in (b'GIF87a', b'GIF89a'):
+        return 'gif'
+    if head[:4] == b'RIFF' and head[8:12] == b'WEBP':
+        return 'webp'
+    if SVG_START.match(head):
+        return 'svg'
+    return None
+
+
+def webp_dimensions(head):
+    """
+    Read the dimensions of a WebP image from its first chunk header.
+
+    Handles the lossy (VP8), lossless (VP8L) and extended (VP8X, used for
+    animation, alpha and metadata) formats.
+
+    Args:
+        head (bytes): At least the first WEBP_HEADER_BYTES of the file
+
+    Returns:
+        tuple: (width, height), or None if the header is not valid
+    """
+    if len(head) < WEBP_HEADER_BYTES:
+        return None
+    chunk, data = head[12:16], head[20:WEBP_HEADER_BYTES]
+    if chunk == b'VP8 ' and data[3:6] == b'\x9d\x01\x2a':
+        # Keyframe start code, then 14-bit width and height with 2 bits of scaling
+        width, height = int.from_bytes(data[6:8], 'little') & 0x3fff, int.from_bytes(data[8:10], 'little') & 0x3fff
+    elif chunk == b'VP8L' and data[0] == 0x2f:
+        # Signature, then width and height minus one in 14 bits each
+        bits = int.from_bytes(data[1:5], 'little')
+        width, height = (bits & 0x3fff) + 1, ((bits >> 14) & 0x3fff) + 1
+    elif chunk == b'VP8X':
+        # Flags, then canvas width and height minus one in 24 bits each
+        width, height = int.from_bytes(data[4:7], 'little') + 1, int.from_bytes(data[7:10], 'little') + 1
+    else:
+        return None
+    if not width or not height:
+        return None
+    return width, height
+
+
+class UploadValidator:
+    """
+    Validates a file from the chunks it is copied in.
+
+    Call feed() with every chunk and finish() after the last one. Only the
+    header, the last TAIL_BYTES and, for SVGs, the document are kept.
+
+    Attributes:
+        extension (str): Extension of the uploaded filename
+        limits (dict): Limits from validation_limits()
+        size (int): Bytes fed so far
+        info (ImageInfo): Header information once it has been read, else None
+    """
+
+    def __init__(self, extension, limits=None):
+        self.extension = extension
+        self.limits = limits or validation_limits()
+        self.size = 0
+        self.info = None
+        self._head = b''
+        self._header_goal = HEADER_BYTES
+        self._tail = b''
+        self._document = None
+        self._riff_size = None
+
+    def feed(self, chunk):
+        """
+        Inspect the next chunk of the file.
+
+        Args:
+            chunk (bytes): Next bytes of the file
+
+        Raises:
+            InvalidImage: As soon as the bytes seen rule the file out
+        """
+        self.size += len(chunk)
+        self._tail = (self._tail + chunk[-TAIL_BYTES:])[-TAIL_BYTES:]
+        if self._document is not None:
+            self._document.append(chunk)
+            self._check_svg_size()
+        elif self.info is None:
+            self._head += chunk
+            if len(self._head) >= self._header_goal:
+                self.read_header(complete=False)
+
+    def read_header(self, complete):
+        """
+        Sniff the format and read the dimensions from the bytes fed so far.
+
+        Args:
+            complete (bool): Whether the whole file has been fed; otherwise a
+                header that is cut off is read again once more bytes arrived
+
+        Raises:
+            InvalidImage: If the file is not an allowed image within the limits
+        """
+        head = self._head
+        fmt = sniff_format(head)
+        if fmt is None:
+            if complete or len(head) >= HEADER_BYTES:
+                raise UnsupportedImage('The file is not a PNG, JPEG, GIF, WebP or SVG image')
+            return
+
+        pillow_format, extensions = FORMATS[fmt]
+        allowed = [extension for extension in extensions if extension in self.limits['allowed_extensions']]
+        if not allowed:
+            raise UnsupportedImage(f'{fmt.upper()} images are not allowed')
+        extension = self.extension if self.extension in allowed else allowed[0]
+
+        if fmt == 'svg':
+            self.info = ImageInfo(fmt, extension, None, None, None)
+            self._document = [head]
+            self._head = b''
+            self._check_svg_size()
+            return
+
+        if fmt == 'webp':
+            dimensions = webp_dimensions(head)
+            if dimensions is None:
+                if not complete and len(head) < WEBP_HEADER_BYTES:
+                    return
+                raise InvalidImage('The file is not a valid WEBP image')
+            width, height = dimensions
+        else:
+            try:
+                # Opening reads the header only; the pixels are decoded on first access
+                with PILImage.open(io.BytesIO(head), formats=[pillow_format]) as img:
+                    width, height = img.size
+            except PILImage.DecompressionBombError as e:
+                raise ImageTooLarge(str(e))
+            except Exception:
+                if not complete and len(head) < MAX_HEADER_BYTES:
+                    self._header_goal = min(len(head) * 2, MAX_HEADER_BYTES)
+                    return
+                raise InvalidImage(f'The file is not a valid {fmt.upper()} image')
+
+        max_dimension = self.limits['max_dimension']
+        if width > max_dimension or height > max_dimension:
+            raise ImageTooLarge(f'Images may be at most {max_dimension} pixels wide and high, '
+                                f'this one is {width}x{height}')
+        if width * height > self.limits['max_pixels']:
+            raise ImageTooLarge(f'Images may have at most {self.limits["max_pixels"]:,} pixels, '
+                                f'this one has {width * height:,}')
+        if fmt == 'webp':
+            self._riff_size = int.from_bytes(head[4:8], 'little')
+        self.info = ImageInfo(fmt, extension, width, height, None)
+        self._head = b''
+
+    def _check_svg_size(self):
+        if self.size > self.limits['max_svg_size']:
+            raise ImageTooLarge(f'SVG files may be at most {self.limits["max_svg_size"]:,} bytes')
+
+    def finish(self):
+        """
+        Complete the validation after the last chunk.
+
+        Returns:
+            ImageInfo: Format, extension to store the file under, dimensions
+                and, for SVGs, the sanitized document
+
+        Raises:
+            InvalidImage: If the file is not an allowed, complete image
+        """
+        if self.info is None:
+            self.read_header(complete=True)
+        fmt = self.info.format
+        if fmt == 'svg':
+            return self.info._replace(document=sanitize_svg(b''.join(self._document)))
+
+        tail = self._tail
+        if fmt == 'png':
+            complete = PNG_END in tail
+        elif fmt == 'jpeg':
+            complete = JPEG_END in tail
+        elif fmt == 'gif':
+            complete = tail.rstrip(b'\0').endswith(b';')
+        else:
+            # The RIFF header gives the size of the rest of the file
+            complete = self.size >= self._riff_size + 8
+        if not complete:
+            raise InvalidImage(f'The {fmt.upper()} file is truncated')
+        return self.info
+
+
+def inspect_header(path, length, extension, limits=None):
+    """
+    Check the start of a file of which only the first `length` bytes exist yet.
+
+    Args:
+        path (str): Partially written file
+        length (int): Bytes written from the start of the file
+        extension (str): Extension of the uploaded filename
+        limits (dict, optional): Limits, defaults to validation_limits()
+
+    Raises:
+        InvalidImage: If the header already rules the file out
+    """
+    validator = UploadValidator(extension, limits)
+    with open(path, 'rb') as f:
+        validator.feed(f.read(min(length, MAX_HEADER_BYTES)))
+    if validator.info is None:
+        validator.read_header(complete=False)
+
+
+def _local_name(name):
+    """Split an ElementTree name into (namespace, local name)."""
+    if name.startswith('{'):
+        namespace, _, local = name[1:].partition('}')
+        return namespace, local
+    return None, name
+
+
+def _safe_attributes(element):
+    """Return an element's attributes without event handlers and external references."""
+    attributes = {}
+    for name, value in element.attrib.items():
+        namespace, local = _local_name(name)
+        if namespace not in (None, XLINK_NAMESPACE, XML_NAMESPACE) or local.lower().startswith('on'):
+            continue
+        if local == 'href' and not SAFE_HREF.match(value):
+            continue
+        if name == f'{{{XML_NAMESPACE}}}base' or UNSAFE_CSS.search(value):
+            continue
+        attributes[name] = value
+    return attributes
+
+
+def _sanitize_children(parent):
+    """Remove unsafe descendants of an element and strip the unsafe attributes of the rest."""
+    for child in list(parent):
+        namespace, local = _local_name(child.tag) if isinstance(child.tag, str) else ('', '')
+        attribute = child.get('attributeName', '')
+        unsafe = (namespace != SVG_NAMESPACE or local in UNSAFE_SVG_ELEMENTS
+                  or (local in ANIMATION_ELEMENTS and (attribute.endswith('href') or attribute.lower().startswith('on')))
+                  or (local == 'style' and UNSAFE_CSS.search(child.text or '')))
+        if unsafe:
+            parent.remove(child)
+            continue
+        child.attrib = _safe_attributes(child)
+        child.tag = local
+        _sanitize_children(child)
+
+
+def sanitize_svg(document):
+    """
+    Remove everything from an SVG that could run code or load other resources.
+
+    Entity declarations are refused outright, which rules out entity
+    expansion attacks. Elements outside the SVG namespace, scripts, foreign
+    objects, event handler attributes, links other than to fragments or
+    embedded raster images, and styles loading external resources are
+    removed. The result is serialized again, so comments and processing
+    instructions are dropped as well.
+
+    Args:
+        document (bytes): SVG document
+
+    Returns:
+        bytes: Sanitized SVG document
+
+    Raises:
+        InvalidImage: If the document is not a well-formed SVG
+    """
+    if b'<!ENTITY' in document:
+        raise InvalidImage('SVG files may not declare entities')
+    try:
+        root = ElementTree.fromstring(document)
+    except ElementTree.ParseError as e:
+        raise InvalidImage(f'The SVG file is not well-formed ({e})')
+    if root.tag != f'{{{SVG_NAMESPACE}}}svg':
+        raise InvalidImage('The file is not an SVG document')
+
+    root.attrib = _safe_attributes(root)
+    root.tag = 'svg'
+    _sanitize_children(root)
+    # Tags were made unqualified above; declare the SVG namespace as the default
+    root.set('xmlns', SVG_NAMESPACE)
+    return ElementTree.tostring(root, encoding='utf-8', xml_declaration=True)
@@ -0,0 +1,167 @@
+"""
+Database Concurrency Benchmark for the Image Storage Application.
+
+Compares concurrent read/write throughput of SQLite with the engine tuning
+in app/database.py (WAL journal, synchronous=NORMAL, busy timeout, mmap,
+sized pool) against SQLite's defaults (rollback journal, synchronous=FULL,
+pysqlite's 5 second lock timeout, default pool). For each setup a fresh
+database is seeded, then reader threads page through the gallery and open
+image details while writer threads insert and rename images, each
+operation in its own application context like a request. Throughput,
+"database is locked" failures and p50/p95 latency are reported per
+operation type.
+
+Usage:
+    python benchmarks/db_concurrency.py --images 20000 --readers 8 --writers 4 --duration 10
+"""
+
+import argparse
+import os
+import random
+import sys
+import tempfile
+import threading
+import time
+
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
+
+from sqlalchemy.exc import OperationalError
+
+from app import create_app
+from app.models import db, Image, Subcategory
+from config import Config
+from search_benchmark import seed, random_text
+
+
+def percentile(sorted_values, fraction):
+    """Return the nearest-rank percentile of a sorted list."""
+    if not sorted_values:
+        return 0.0
+    index = max(0, min(len(sorted_values) - 1, int(round(fraction * len(sorted_values))) - 1))
+    return sorted_values[index]
+
+
+def make_config(tmp, tuned):
+    """Return a Config subclass using a database in `tmp`, with or without tuning."""
+    class BenchmarkConfig(Config):
+        SQLALCHEMY_DATABASE_URI = 'sqlite:///' + os.path.join(tmp, 'bench.db')
+        UPLOAD_FOLDER = os.path.join(tmp, 'uploads')
+        RENDITION_FOLDER = os.path.join(tmp, 'uploads', 'renditions')
+        TRANSFORM_CACHE_FOLDER = os.path.join(tmp, 'uploads', 'transforms')
+
+    if not tuned:
+        BenchmarkConfig.SQLITE_PRAGMAS = {}
+        # SQLAlchemy's own defaults for file-backed SQLite
+        BenchmarkConfig.SQLALCHEMY_ENGINE_OPTIONS = {'pool_size': 5, 'max_overflow': 10}
+    return BenchmarkConfig
+
+
+class Worker(threading.Thread):
+    """
+    A thread issuing reads or writes until the deadline.
+
+    Attributes:
+        results (list): (operation, latency in seconds, success) tuples
+    """
+
+    def __init__(self, app, role, image_count, subcategories, rng, stop_at):
+        super().__init__(daemon=True)
+        self.app = app
+        self.role = role
+        self.image_count = image_count
+        self.subcategories = subcategories
+        self.rng = rng
+        self.stop_at = stop_at
+        self.results = []
+
+    def gallery(self):
+        page = self.rng.randint(1, 50)
+        Image.card_query().order_by(Image.upload_date.desc(), Image.id.desc()) \
+            .offset((page - 1) * 12).limit(12).all()
+
+    def details(self):
+        Image.card_query().filter(Image.id == self.rng.randint(1, self.image_count)).first()
+
+    def insert(self):
+        subcategory_id, category_id = self.rng.choice(self.subcategories)
+        db.session.add(Image(
+            name=random_text(self.rng, 3),
+            filename='concurrency.png',
+            description=random_text(self.rng, 12),
+            prompt=random_text(self.rng, 25),
+            category_id=category_id,
+            subcategory_id=subcategory_id
+        ))
+        db.session.commit()
+
+    def rename(self):
+        image = db.session.get(Image, self.rng.randint(1, self.image_count))
+        image.name = random_text(self.rng, 3)
+        db.session.commit()
+
+    def run(self):
+        operations = ('gallery', 'details') if self.role == 'reader' else ('insert', 'rename')
+        while time.monotonic() < self.stop_at:
+            operation = self.rng.choice(operations)
+            started = time.monotonic()
+            with self.app.app_context():
+                try:
+                    getattr(self, operation)()
+                    ok = True
+                except OperationalError:
+                    ok = False
+            self.results.append((operation, time.monotonic() - started, ok))
+
+
+def run_setup(name, tuned, args):
+    """Seed a database for one setup, run the workload and return its results."""
+    with tempfile.TemporaryDirectory() as tmp:
+        app = create_app(make_config(tmp, tuned))
+        with app.app_context():
+            seed(args.images, random.Random(args.seed))
+            subcategories = [(s.id, s.category_id) for s in Subcategory.query.all()]
+            journal = db.session.execute(db.text('PRAGMA journal_mode')).scalar()
+
+        stop_at = time.monotonic() + args.duration
+        workers = [Worker(app, role, args.images, subcategories, random.Random(args.seed + i), stop_at)
+                   for i, role in enumerate(['reader'] * args.readers + ['writer'] * args.writers)]
+        for worker in workers:
+            worker.start()
+        for worker in workers:
+            worker.join()
+
+        with app.app_context():
+            db.engine.dispose()
+
+    print(f'# {name}: journal_mode={journal}')
+    return [r for w in workers for r in w.results]
+
+
+def report(name, results, duration):
+    """Print per-operation throughput, failures and latency for one setup."""
+    for operation in ('gallery', 'details', 'insert', 'rename'):
+        selected = [r for r in results if r[0] == operation]
+        latencies = sorted(latency * 1000 for _, latency, ok in selected if ok)
+        failures = sum(1 for _, _, ok in selected if not ok)
+        print(f'{name:<9} {operation:<8} {len(latencies) / duration:>9.1f} {failures:>7} '
+              f'{percentile(latencies, 0.50):>8.1f}ms {percentile(latencies, 0.95):>8.1f}ms')
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--images', type=int, default=20000, help='Images to seed (default: %(default)s)')
+    parser.add_argument('--readers', type=int, default=8, help='Reader threads (default: %(default)s)')
+    parser.add_argument('--writers', type=int, default=4, help='Writer threads (default: %(default)s)')
+    parser.add_argument('--duration', type=float, default=10, help='Seconds per setup (default: %(default)s)')
+    parser.add_argument('--seed', type=int, default=42, help='Random seed (default: %(default)s)')
+    args = parser.parse_args()
+
+    results = {name: run_setup(name, tuned, args) for name, tuned in (('default', False), ('tuned', True))}
+
+    print(f"{'setup':<9} {'op':<8} {'ok ops/s':>9} {'locked':>7} {'p50':>10} {'p95':>10}")
+    for name, setup_results in results.items():
+        report(name, setup_results, args.duration)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,295 @@
+"""
+Load Test for the Image Storage Application.
+
+Seeds a fresh database with synthetic images, starts the production server
+(serve.py) against it and drives a weighted mix of gallery, search, details
+and upload requests at a fixed concurrency. Latency percentiles (p50, p95,
+p99) and throughput are reported per request type and overall, so runs can
+be compared across changes.
+
+Usage:
+    python benchmarks/loadtest.py --images 10000 --concurrency 16 --duration 30
+    python benchmarks/loadtest.py --url http://127.0.0.1:5000 --mix index=1,search=1
+"""
+
+import argparse
+import http.client
+import io
+import json
+import os
+import random
+import re
+import socket
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+import uuid
+from urllib.parse import urlsplit, urlencode
+
+ROOT = os.path.abspath(os.path.join(os.path.dirname(__file__), '..'))
+sys.path.insert(0, ROOT)
+
+DEFAULT_MIX = 'index=40,search=30,details=25,upload=5'
+SEARCHES = ['sunset', 'neon city', 'golden hour portrait', 'bavex', 'kelith mo', 'dragon castle']
+
+
+def percentile(sorted_values, fraction):
+    """Return the nearest-rank percentile of a sorted list."""
+    if not sorted_values:
+        return 0.0
+    index = max(0, min(len(sorted_values) - 1, int(round(fraction * len(sorted_values))) - 1))
+    return sorted_values[index]
+
+
+def free_port():
+    """Return a TCP port that is currently free on localhost."""
+    with socket.socket() as s:
+        s.bind(('127.0.0.1', 0))
+        return s.getsockname()[1]
+
+
+def random_png(rng, size=256):
+    """Return the bytes of a PNG filled with noise, so every upload is a new blob."""
+    from PIL import Image as PILImage
+
+    buf = io.BytesIO()
+    PILImage.frombytes('RGB', (size, size), rng.randbytes(size * size * 3)).save(buf, 'PNG')
+    return buf.getvalue()
+
+
+class Client:
+    """
+    One simulated user with a keep-alive connection.
+
+    Attributes:
+        results (list): (request type, latency in seconds, success) tuples
+    """
+
+    def __init__(self, base_url, rng, image_count, taxonomy):
+        parts = urlsplit(base_url)
+        self.host, self.port = parts.hostname, parts.port or 80
+        self.rng = rng
+        self.image_count = image_count
+        self.taxonomy = taxonomy
+        self.conn = None
+        self.cookie = None
+        self.csrf_token = None
+        self.results = []
+
+    def request(self, method, path, body=None, headers=None):
+        """Send a request and return (status, body), reconnecting after errors."""
+        headers = dict(headers or {})
+        if self.cookie:
+            headers['Cookie'] = self.cookie
+        for attempt in range(2):
+            if self.conn is None:
+                self.conn = http.client.HTTPConnection(self.host, self.port, timeout=60)
+            try:
+                self.conn.request(method, path, body=body, headers=headers)
+                response = self.conn.getresponse()
+                data = response.read()
+                cookie = response.getheader('Set-Cookie')
+                if cookie:
+                    self.cookie = cookie.split(';', 1)[0]
+                return response.status, data
+            except (http.client.HTTPException, OSError):
+                self.conn.close()
+                self.conn = None
+                if attempt:
+                    raise
+
+    def index(self):
+        pages = max(1, min(50, self.image_count // 12))
+        return self.request('GET', '/?' + urlencode({'page': self.rng.randint(1, pages)}))
+
+    def search(self):
+        return self.request('GET', '/search?' + urlencode({'search_query': self.rng.choice(SEARCHES)}))
+
+    def details(self):
+        return self.request('GET', f'/image/{self.rng.randint(1, self.image_count)}')
+
+    def upload(self):
+        if self.csrf_token is None:
+            _, page = self.request('GET', '/upload')
+            match = re.search(rb'name="csrf_token" type="hidden" value="([^"]+)"', page)
+            self.csrf_token = match.group(1).decode() if match else ''
+
+        category_id, subcategory_id = self.taxonomy
+        boundary = uuid.uuid4().hex
+        fields = {
+            'csrf_token': self.csrf_token,
+            'name': f'Load test {uuid.uuid4().hex[:8]}',
+            'description': 'Uploaded by the load test',
+            'prompt': 'noise',
+            'category': str(category_id),
+            'subcategory': str(subcategory_id),
+        }
+        body = io.BytesIO()
+        for name, value in fields.items():
+            body.write(f'--{boundary}\r\nContent-Disposition: form-data; name="{name}"\r\n\r\n{value}\r\n'.encode())
+        body.write(f'--{boundary}\r\nContent-Disposition: form-data; name="image"; filename="load.png"\r\n'
+                   f'Content-Type: image/png\r\n\r\n'.encode())
+        body.write(random_png(self.rng))
+        body.write(f'\r\n--{boundary}--\r\n'.encode())
+        status, data = self.request('POST', '/upload', body=body.getvalue(),
+                                    headers={'Content-Type': f'multipart/form-data; boundary={boundary}'})
+        # A successful upload redirects; a re-rendered form means it was rejected
+        return (422 if status == 200 else status), data
+
+    def run(self, mix, warmup_until, stop_at):
+        """Issue requests from the mix until `stop_at`, recording those after warm-up."""
+        kinds, weights = zip(*mix.items())
+        while time.monotonic() < stop_at:
+            kind = self.rng.choices(kinds, weights)[0]
+            started = time.monotonic()
+            try:
+                status, _ = getattr(self, kind)()
+                ok = status < 400
+            except Exception:
+                ok = False
+            if started >= warmup_until:
+                self.results.append((kind, time.monotonic() - started, ok))
+
+
+def start_server(args, tmp):
+    """Seed a database in `tmp` and start serve.py against it; return (process, url, env)."""
+    env = dict(os.environ,
+               DATABASE_URL='sqlite:///' + os.path.join(tmp, 'loadtest.db'),
+               UPLOAD_FOLDER=os.path.join(tmp, 'uploads'),
+               SERVER_PIDFILE=os.path.join(tmp, 'server.pid'))
+    os.environ.update(env)
+
+    # Imported after the environment is set so Config picks it up
+    sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+    from app import create_app
+    from app.models import db
+    from search_benchmark import seed
+
+    app = create_app()
+    with app.app_context():
+        started = time.perf_counter()
+        seed(args.images, random.Random(args.seed))
+        print(f'# seeded {args.images} images in {time.perf_counter() - started:.1f}s')
+        db.engine.dispose()
+
+    port = free_port()
+    command = [sys.executable, os.path.join(ROOT, 'serve.py'), '--bind', f'127.0.0.1:{port}',
+               '--workers', str(args.workers), '--threads', str(args.threads), '--server', args.server]
+    process = subprocess.Popen(command, cwd=ROOT, env=env,
+                               stdout=subprocess.DEVNULL if not args.verbose else None,
+                               stderr=subprocess.DEVNULL if not args.verbose else None)
+    url = f'http://127.0.0.1:{port}'
+
+    deadline = time.monotonic() + 60
+    while time.monotonic() < deadline:
+        try:
+            conn = http.client.HTTPConnection('127.0.0.1', port, timeout=5)
+            conn.request('GET', '/')
+            if conn.getresponse().status == 200:
+                return process, url, env
+        except OSError:
+            time.sleep(0.2)
+        if process.poll() is not None:
+            raise SystemExit('serve.py exited during startup; rerun with --verbose')
+    raise SystemExit('serve.py did not become ready within 60s')
+
+
+def stop_server(process, env):
+    """Stop the server gracefully through serve.py stop."""
+    subprocess.run([sys.executable, os.path.join(ROOT, 'serve.py'), 'stop'], cwd=ROOT, env=env,
+                   stdout=subprocess.DEVNULL)
+    try:
+        process.wait(timeout=30)
+    except subprocess.TimeoutExpired:
+        process.kill()
+
+
+def fetch_taxonomy(url):
+    """Return a (category_id, subcategory_id) pair uploads can use."""
+    parts = urlsplit(url)
+    conn = http.client.HTTPConnection(parts.hostname, parts.port or 80, timeout=10)
+    conn.request('GET', '/api/v1/categories')
+    for category in json.loads(conn.getresponse().read()):
+        if category['subcategories']:
+            return category['id'], category['subcategories'][0]['id']
+    raise SystemExit('No subcategory available for uploads')
+
+
+def report(results, elapsed, args):
+    """Print (and optionally save) per-type and overall latency statistics."""
+    rows = []
+    kinds = sorted({kind for kind, _, _ in results})
+    for kind in kinds + ['total']:
+        selected = [r for r in results if kind == 'total' or r[0] == kind]
+        latencies = sorted(latency * 1000 for _, latency, ok in selected if ok)
+        rows.append({
+            'type': kind,
+            'requests': len(selected),
+            'errors': sum(1 for _, _, ok in selected if not ok),
+            'rps': len(selected) / elapsed,
+            'p50_ms': percentile(latencies, 0.50),
+            'p95_ms': percentile(latencies, 0.95),
+            'p99_ms': percentile(latencies, 0.99),
+        })
+
+    print(f"{'type':<8} {'requests':>9} {'errors':>7} {'req/s':>8} {'p50':>9} {'p95':>9} {'p99':>9}")
+    for row in rows:
+        print(f"{row['type']:<8} {row['requests']:>9} {row['errors']:>7} {row['rps']:>8.1f} "
+              f"{row['p50_ms']:>7.1f}ms {row['p95_ms']:>7.1f}ms {row['p99_ms']:>7.1f}ms")
+
+    if args.json:
+        with open(args.json, 'w') as f:
+            json.dump({'settings': vars(args), 'results': rows}, f, indent=2)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--url', help='Test an already running server instead of starting one')
+    parser.add_argument('--images', type=int, default=10000, help='Images to seed (default: %(default)s)')
+    parser.add_argument('--concurrency', type=int, default=16, help='Simulated users (default: %(default)s)')
+    parser.add_argument('--duration', type=float, default=30, help='Seconds to measure (default: %(default)s)')
+    parser.add_argument('--warmup', type=float, default=3, help='Seconds before measuring (default: %(default)s)')
+    parser.add_argument('--mix', default=DEFAULT_MIX, help='Request weights (default: %(default)s)')
+    parser.add_argument('--workers', type=int, default=4, help='Server worker processes (default: %(default)s)')
+    parser.add_argument('--threads', type=int, default=4, help='Threads per worker (default: %(default)s)')
+    parser.add_argument('--server', choices=('auto', 'gunicorn', 'waitress'), default='auto')
+    parser.add_argument('--seed', type=int, default=42, help='Random seed (default: %(default)s)')
+    parser.add_argument('--json', help='Also write the results to this JSON file')
+    parser.add_argument('--verbose', action='store_true', help='Show server output')
+    args = parser.parse_args()
+
+    mix = {}
+    for item in args.mix.split(','):
+        kind, _, weight = item.partition('=')
+        if kind not in ('index', 'search', 'details', 'upload'):
+            parser.error(f'Unknown request type in --mix: {kind}')
+        mix[kind] = float(weight or 1)
+
+    with tempfile.TemporaryDirectory() as tmp:
+        process = env = None
+        url = args.url
+        if url is None:
+            process, url, env = start_server(args, tmp)
+        try:
+            taxonomy = fetch_taxonomy(url) if 'upload' in mix else None
+            clients = [Client(url, random.Random(args.seed + i), args.images, taxonomy)
+                       for i in range(args.concurrency)]
+            warmup_until = time.monotonic() + args.warmup
+            stop_at = warmup_until + args.duration
+            threads = [threading.Thread(target=c.run, args=(mix, warmup_until, stop_at)) for c in clients]
+            print(f'# {args.concurrency} clients for {args.duration:.0f}s against {url}')
+            for thread in threads:
+                thread.start()
+            for thread in threads:
+                thread.join()
+        finally:
+            if process is not None:
+                stop_server(process, env)
+
+    report([r for c in clients for r in c.results], args.duration, args)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,123 @@
+"""
+Prompt Index Benchmark for the Image Storage Application.
+
+Measures the "similar prompts" index of app/prompt_index.py on synthetic
+prompts drawn from the vocabulary of the search benchmark, a share of them
+variations of earlier prompts so queries have close matches. The index is
+built in a temporary folder without a database. Build time, file size and
+the median and p95 latency of single and batched top-k queries are
+reported. The results are compared with an exact float32 brute-force
+search, both straight from the int8 index and after reranking
+CANDIDATE_FACTOR times as many candidates with their exact vectors, the
+way the details page does.
+
+Usage:
+    python benchmarks/prompt_benchmark.py --prompts 100000,250000
+"""
+
+import argparse
+import os
+import random
+import statistics
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
+
+import numpy as np
+
+from app.prompt_index import CANDIDATE_FACTOR, REBUILD_BATCH_SIZE, PromptIndex, vectorize
+from benchmarks.search_benchmark import random_text
+
+
+def make_prompts(count, rng, variation_share=0.3):
+    """Return `count` prompts, some of them earlier prompts with a few words changed."""
+    prompts = []
+    for _ in range(count):
+        if prompts and rng.random() < variation_share:
+            words = rng.choice(prompts).split()
+            for position in rng.sample(range(len(words)), min(len(words), rng.randint(1, 3))):
+                words[position] = random_text(rng, 1)
+            prompts.append(' '.join(words))
+        else:
+            prompts.append(random_text(rng, rng.randint(5, 25)))
+    return prompts
+
+
+def batches(prompts):
+    """Yield (image ID, prompt) batches the way the rebuild reads them from the database."""
+    for offset in range(0, len(prompts), REBUILD_BATCH_SIZE):
+        yield [(image_id, prompt) for image_id, prompt in enumerate(prompts[offset:offset + REBUILD_BATCH_SIZE], offset + 1)]
+
+
+def exact_search(vectors, query, k, exclude):
+    """Score every prompt in float32 and return the IDs of the k best."""
+    scores = vectors @ query
+    scores[exclude] = -np.inf
+    return set(np.argsort(-scores)[:k].tolist())
+
+
+def percentiles(latencies):
+    latencies = sorted(latencies)
+    return statistics.median(latencies), latencies[int(len(latencies) * 0.95) - 1]
+
+
+def run(count, args, rng):
+    prompts = make_prompts(count, rng)
+    query_ids = rng.sample(range(1, count + 1), args.queries)
+
+    with tempfile.TemporaryDirectory() as folder:
+        index = PromptIndex(folder, args.dimensions)
+        started = time.perf_counter()
+        index.rebuild(batches(prompts))
+        build = time.perf_counter() - started
+        size = os.path.getsize(index.path)
+
+        queries = np.stack([vectorize(prompts[image_id - 1], args.dimensions) for image_id in query_ids])
+        index.search(queries[:1], args.k)  # maps the file
+
+        single = []
+        for image_id, query in zip(query_ids, queries):
+            started = time.perf_counter()
+            index.search(query, args.k * CANDIDATE_FACTOR, exclude=[image_id])
+            single.append((time.perf_counter() - started) * 1000)
+
+        started = time.perf_counter()
+        results = index.search(queries, args.k * CANDIDATE_FACTOR, exclude=query_ids)
+        batched = (time.perf_counter() - started) * 1000 / len(query_ids)
+
+        # Recall against the exact top k; the batch also excluded the other query images
+        vectors = np.zeros((len(index.matrix()), args.dimensions), dtype=np.float32)
+        for image_id, prompt in enumerate(prompts, 1):
+            vectors[image_id] = vectorize(prompt, args.dimensions)
+        recall, reranked = [], []
+        for query, result in zip(queries, results):
+            exact = exact_search(vectors, query, args.k, query_ids)
+            candidates = [image_id for _, image_id in result]
+            recall.append(len(set(candidates[:args.k]) & exact) / args.k)
+            best = sorted(candidates, key=lambda image_id: -vectors[image_id] @ query)[:args.k]
+            reranked.append(len(set(best) & exact) / args.k)
+
+    p50, p95 = percentiles(single)
+    print(f'{count:>9} {build:>7.1f}s {size / 2 ** 20:>7.1f}MB {p50:>8.2f}ms {p95:>8.2f}ms '
+          f'{batched:>8.2f}ms {statistics.mean(recall):>7.1%} {statistics.mean(reranked):>9.1%}')
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--prompts', default='100000', help='Comma-separated index sizes (default: %(default)s)')
+    parser.add_argument('--dimensions', type=int, default=256, help='Vector length (default: %(default)s)')
+    parser.add_argument('--queries', type=int, default=100, help='Queries per size (default: %(default)s)')
+    parser.add_argument('--k', type=int, default=12, help='Matches per query (default: %(default)s)')
+    parser.add_argument('--seed', type=int, default=42, help='Random seed (default: %(default)s)')
+    args = parser.parse_args()
+
+    rng = random.Random(args.seed)
+    print(f"{'prompts':>9} {'build':>8} {'file':>9} {'p50':>10} {'p95':>10} {'batched':>10} {'recall':>7} {'reranked':>9}")
+    for count in (int(c) for c in args.prompts.split(',')):
+        run(count, args, rng)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,139 @@
+"""
+Search Benchmark for the Image Storage Application.
+
+Measures search latency of the indexed full-text search against the
+original triple ILIKE scan at increasing library sizes. For each size a
+fresh SQLite database is seeded with synthetic images, then every query
+is run repeatedly and the median and p95 latency of fetching one page of
+results are reported.
+
+Usage:
+    python benchmarks/search_benchmark.py --sizes 10000,100000,1000000
+"""
+
+import argparse
+import os
+import random
+import statistics
+import sys
+import tempfile
+import time
+from datetime import datetime, timedelta
+
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
+
+from flask_migrate import upgrade
+from sqlalchemy import or_
+
+from app import create_app
+from app.models import db, Image, Subcategory
+from app.search import apply_text_search, search_backend
+from app.seed import seed_taxonomy
+from config import Config
+
+WORDS = (
+    'sunset mountain forest river portrait neon city cyberpunk castle dragon ocean '
+    'desert galaxy nebula robot samurai garden flower winter autumn studio cinematic '
+    'watercolor oil sketch lighting volumetric golden hour misty ancient futuristic '
+    'abstract minimal vibrant moody pastel detailed intricate surreal dreamy epic'
+).split()
+
+# Long tail of rarer tokens so term selectivity resembles real prompts
+RARE_WORDS = [f'{a}{b}{c}' for a in 'bdgklmprstv' for b in 'aeiou' for c in ('ron', 'lith', 'vex', 'mar', 'dun', 'sil')]
+
+QUERIES = ['sunset', 'sun', 'neon city', 'golden hour portrait', 'bavex', 'kelith mo', 'zzz']
+
+
+def random_text(rng, count):
+    """Return a string of random vocabulary words."""
+    return ' '.join(rng.choice(WORDS if rng.random() < 0.3 else RARE_WORDS) for _ in range(count))
+
+
+def create_schema():
+    """Migrate a fresh database to the latest schema and add the default categories."""
+    upgrade()
+    seed_taxonomy()
+
+
+def seed(size, rng, batch_size=10000):
+    """Create the schema, then insert synthetic image rows in batches."""
+    create_schema()
+    subcategories = [(s.id, s.category_id) for s in Subcategory.query.all()]
+    start = datetime(2024, 1, 1)
+    table = Image.__table__
+    for offset in range(0, size, batch_size):
+        rows = []
+        for i in range(offset, min(offset + batch_size, size)):
+            subcategory_id, category_id = rng.choice(subcategories)
+            rows.append({
+                'name': random_text(rng, 3),
+                'filename': f'bench_{i}.png',
+                'description': random_text(rng, 12),
+                'prompt': random_text(rng, 25),
+                'upload_date': start + timedelta(seconds=i),
+                'category_id': category_id,
+                'subcategory_id': subcategory_id,
+            })
+        db.session.execute(table.insert(), rows)
+        db.session.commit()
+
+
+def ilike_search(text):
+    """The pre-index search: one leading-wildcard ILIKE per column."""
+    pattern = f'%{text}%'
+    return Image.query.filter(or_(
+        Image.name.ilike(pattern),
+        Image.description.ilike(pattern),
+        Image.prompt.ilike(pattern)
+    )), []
+
+
+def measure(search, text, repeat, per_page):
+    """Return (median, p95) latency in milliseconds of one results page."""
+    timings = []
+    for _ in range(repeat):
+        started = time.perf_counter()
+        query, rank_order = search(Image.query, text) if search is apply_text_search else search(text)
+        query.order_by(*rank_order, Image.upload_date.desc()).limit(per_page).all()
+        timings.append((time.perf_counter() - started) * 1000)
+        db.session.rollback()
+    timings.sort()
+    return statistics.median(timings), timings[int(len(timings) * 0.95) - 1]
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--sizes', default='10000,100000,1000000',
+                        help='Comma separated library sizes (default: %(default)s)')
+    parser.add_argument('--repeat', type=int, default=20, help='Runs per query (default: %(default)s)')
+    parser.add_argument('--per-page', type=int, default=12, help='Results fetched per query (default: %(default)s)')
+    args = parser.parse_args()
+
+    rng = random.Random(42)
+    print(f"{'rows':>9}  {'query':<22} {'ilike p50':>10} {'ilike p95':>10} {'index p50':>10} {'index p95':>10}")
+
+    for size in (int(s) for s in args.sizes.split(',')):
+        with tempfile.TemporaryDirectory() as tmp:
+            class BenchmarkConfig(Config):
+                SQLALCHEMY_DATABASE_URI = 'sqlite:///' + os.path.join(tmp, 'bench.db')
+                UPLOAD_FOLDER = os.path.join(tmp, 'uploads')
+                RENDITION_FOLDER = os.path.join(tmp, 'uploads', 'renditions')
+                TRANSFORM_CACHE_FOLDER = os.path.join(tmp, 'uploads', 'transforms')
+
+            app = create_app(BenchmarkConfig)
+            with app.app_context():
+                started = time.perf_counter()
+                seed(size, rng)
+                print(f'# seeded {size} rows in {time.perf_counter() - started:.1f}s '
+                      f'({search_backend()} backend)')
+
+                for text in QUERIES:
+                    ilike = measure(ilike_search, text, args.repeat, args.per_page)
+                    indexed = measure(apply_text_search, text, args.repeat, args.per_page)
+                    print(f'{size:>9}  {text:<22} {ilike[0]:>9.2f}ms {ilike[1]:>9.2f}ms '
+                          f'{indexed[0]:>9.2f}ms {indexed[1]:>9.2f}ms')
+                db.engine.dispose()
+
+
+if __name__ == '__main__':
+    main()
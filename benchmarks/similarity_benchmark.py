@@ -0,0 +1,86 @@
+"""
+Similarity Index Benchmark for the Image Storage Application.
+
+Measures "similar images" lookups in the multi-index hash table used by
+app/similarity.py against a linear scan over every stored hash. Random
+64-bit hashes are generated, with a share of them near-duplicates of
+others (a few bits flipped) so queries have matches at realistic distances.
+Build time and the median and p95 latency per query are reported for each
+search radius, and both methods are checked to return the same matches.
+
+Usage:
+    python benchmarks/similarity_benchmark.py --hashes 100000 --radii 4,8,10,12
+"""
+
+import argparse
+import os
+import random
+import statistics
+import sys
+import time
+
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
+
+from app.similarity import HashIndex, hamming
+
+
+def make_hashes(count, rng, duplicate_share=0.2):
+    """Return `count` random hashes, some of them a few bits away from earlier ones."""
+    hashes = []
+    for _ in range(count):
+        if hashes and rng.random() < duplicate_share:
+            value = rng.choice(hashes)
+            for bit in rng.sample(range(64), rng.randint(1, 8)):
+                value ^= 1 << bit
+        else:
+            value = rng.getrandbits(64)
+        hashes.append(value)
+    return hashes
+
+
+def linear_search(hashes, value, radius):
+    """Compare the query against every hash."""
+    return sorted((distance, image_id) for image_id, other in enumerate(hashes, 1)
+                  if (distance := hamming(value, other)) <= radius)
+
+
+def timed(func, queries):
+    """Run func on every query and return the latencies in milliseconds."""
+    latencies = []
+    for query in queries:
+        started = time.perf_counter()
+        func(query)
+        latencies.append((time.perf_counter() - started) * 1000)
+    return latencies
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--hashes', type=int, default=100000, help='Hashes to index (default: %(default)s)')
+    parser.add_argument('--radii', default='4,8,10,12', help='Comma-separated search radii (default: %(default)s)')
+    parser.add_argument('--queries', type=int, default=50, help='Queries per radius (default: %(default)s)')
+    parser.add_argument('--seed', type=int, default=42, help='Random seed (default: %(default)s)')
+    args = parser.parse_args()
+
+    rng = random.Random(args.seed)
+    hashes = make_hashes(args.hashes, rng)
+    queries = rng.sample(hashes, min(args.queries, len(hashes)))
+
+    started = time.perf_counter()
+    index = HashIndex(enumerate(hashes, 1))
+    print(f'Indexed {len(index)} hashes in {time.perf_counter() - started:.2f}s')
+
+    print(f"{'radius':>6} {'method':<7} {'p50':>10} {'p95':>10} {'matches':>8}")
+    for radius in (int(r) for r in args.radii.split(',')):
+        for query in queries[:5]:
+            assert index.search(query, radius) == linear_search(hashes, query, radius)
+        matches = statistics.mean(len(index.search(q, radius)) for q in queries)
+        for method, func in (('index', lambda q: index.search(q, radius)),
+                             ('linear', lambda q: linear_search(hashes, q, radius))):
+            latencies = sorted(timed(func, queries))
+            print(f'{radius:>6} {method:<7} {statistics.median(latencies):>8.2f}ms '
+                  f'{latencies[int(len(latencies) * 0.95) - 1]:>8.2f}ms {matches:>8.1f}')
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,95 @@
+"""
+Startup Benchmark for the Image Storage Application.
+
+Measures how long a fresh worker process takes to become ready: importing
+the application package, running create_app and answering its first
+request. Every run starts a new Python interpreter against a throwaway
+SQLite database that was migrated and seeded once beforehand, the way a
+deployment prepares the database before starting its workers. The SQL
+statements executed by create_app are counted as well; the factory is
+expected to run none.
+
+Usage:
+    python benchmarks/startup_benchmark.py --runs 20
+"""
+
+import argparse
+import json
+import os
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+
+ROOT = os.path.abspath(os.path.join(os.path.dirname(__file__), '..'))
+
+# Runs inside each child interpreter and prints its measurements as JSON
+CHILD = """
+import json, sys, time
+started = time.perf_counter()
+from sqlalchemy import event
+from sqlalchemy.engine import Engine
+statements = []
+event.listen(Engine, 'before_cursor_execute', lambda *args: statements.append(args[2]))
+import app
+imported = time.perf_counter()
+application = app.create_app()
+created = time.perf_counter()
+factory_statements = len(statements)
+response = application.test_client().get(sys.argv[1])
+answered = time.perf_counter()
+print(json.dumps({
+    'import': imported - started,
+    'create_app': created - imported,
+    'first_request': answered - created,
+    'create_app_sql': factory_statements,
+    'status': response.status_code,
+}))
+"""
+
+
+def prepare_database(env):
+    """Migrate and seed the throwaway database in a separate process."""
+    for command in (['db', 'upgrade'], ['seed']):
+        subprocess.run([sys.executable, '-m', 'flask', *command], cwd=ROOT, env=env,
+                       check=True, capture_output=True)
+
+
+def run_once(env, path):
+    """Start one interpreter and return its measurements and total wall time."""
+    started = time.perf_counter()
+    output = subprocess.run([sys.executable, '-c', CHILD, path], cwd=ROOT, env=env,
+                            check=True, capture_output=True, text=True).stdout
+    result = json.loads(output.strip().splitlines()[-1])
+    result['process'] = time.perf_counter() - started
+    return result
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--runs', type=int, default=20, help='Processes to start (default: %(default)s)')
+    parser.add_argument('--path', default='/', help='URL of the first request (default: %(default)s)')
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as tmp:
+        env = dict(os.environ,
+                   FLASK_APP='run.py',
+                   DATABASE_URL='sqlite:///' + os.path.join(tmp, 'startup.db'),
+                   UPLOAD_FOLDER=os.path.join(tmp, 'uploads'),
+                   JOB_RUN_IN_APP='false')
+        prepare_database(env)
+        results = [run_once(env, args.path) for _ in range(args.runs)]
+
+    statuses = {result['status'] for result in results}
+    print(f'# {args.runs} processes, first request GET {args.path} -> {", ".join(map(str, sorted(statuses)))}')
+    print(f"{'phase':<15} {'p50':>9} {'p95':>9} {'max':>9}")
+    for phase in ('import', 'create_app', 'first_request', 'process'):
+        values = sorted(result[phase] * 1000 for result in results)
+        p95 = values[min(len(values) - 1, int(len(values) * 0.95))]
+        print(f'{phase:<15} {statistics.median(values):>8.1f}ms {p95:>8.1f}ms {values[-1]:>8.1f}ms')
+    print(f"SQL statements in create_app: {max(result['create_app_sql'] for result in results)}")
+
+
+if __name__ == '__main__':
+    main()
@@ -3,9 +3,16 @@ Configuration settings for the Image Storage Application.
 
 This module contains all the configuration settings for the application, including:
 - Security settings
-- Database configuration
+- Database configuration and engine tuning
 - File upload settings
+- Rendition (thumbnail/preview) settings
+- On-the-fly transform settings
+- Media caching settings
 - Pagination settings
+- Taxonomy cache settings
+- JSON API settings
+- Background job settings
+- Production server settings
 """
 
 import os
@@ -18,10 +25,50 @@ class Config:
         SECRET_KEY (str): Key for session security and CSRF protection
         SQLALCHEMY_DATABASE_URI (str): Database connection string
         SQLALCHEMY_TRACK_MODIFICATIONS (bool): SQLAlchemy event tracking flag
+        DATABASE_POOL_SIZE (int): Connections kept open per worker process
+        DATABASE_MAX_OVERFLOW (int): Extra connections opened under load beyond the pool size
+        DATABASE_POOL_TIMEOUT (int): Seconds to wait for a free connection before failing
+        DATABASE_POOL_RECYCLE (int): Seconds after which server database connections are replaced
+        SQLITE_PRAGMAS (dict): Pragmas applied to every new SQLite connection
         UPLOAD_FOLDER (str): Path where uploaded images are stored
-        MAX_CONTENT_LENGTH (int): Maximum allowed file size (16MB)
+        MAX_CONTENT_LENGTH (int): Maximum allowed request body size (16MB)
+        MAX_UPLOAD_SIZE (int): Maximum size of a file sent through the chunked upload API
+        UPLOAD_CHUNK_SIZE (int): Chunk size handed out to chunked upload clients
+        UPLOAD_SESSION_TTL (int): Seconds before an unfinished chunked upload may be purged
+        MAX_UPLOAD_SESSIONS (int): Most chunked uploads that may be in progress at once
+        MAX_UPLOAD_RESERVED_BYTES (int): Most bytes the chunked uploads in progress may add up to
         ALLOWED_EXTENSIONS (set): Allowed image file extensions
+        MAX_IMAGE_PIXELS (int): Most pixels (width x height) an uploaded image may have
+        MAX_IMAGE_DIMENSION (int): Largest width or height of an uploaded image in pixels
+        MAX_SVG_SIZE (int): Largest SVG file accepted, in bytes
+        RENDITION_FOLDER (str): Path where generated renditions are stored
+        RENDITION_SIZES (dict): Rendition kind mapped to its fixed width in pixels
+        RENDITION_QUALITY (int): WebP quality used when encoding renditions
+        TRANSFORM_CACHE_FOLDER (str): Path where on-the-fly transforms are cached
+        TRANSFORM_CACHE_MAX_BYTES (int): Size budget of the transform cache
+        TRANSFORM_WIDTHS (tuple): Widths the transform endpoint may produce
+        TRANSFORM_FORMATS (tuple): Output formats the transform endpoint may produce
+        TRANSFORM_QUALITIES (tuple): Encoder qualities the transform endpoint accepts
+        TRANSFORM_DEFAULT_QUALITY (int): Quality used when a request does not give one
+        MEDIA_CACHE_MAX_AGE (int): Seconds browsers may cache versioned image URLs
         IMAGES_PER_PAGE (int): Number of images to display per page
+        TAXONOMY_CACHE_REDIS_URL (str): Redis URL sharing taxonomy cache invalidations between workers
+        TAXONOMY_CACHE_TTL (int): Seconds a cached taxonomy is served before it is reloaded anyway
+        API_MAX_PAGE_SIZE (int): Largest `limit` accepted by the JSON API
+        API_MAX_BATCH_SIZE (int): Most image IDs accepted by one JSON API batch request
+        JOB_RUN_IN_APP (bool): Run job worker threads inside each web process
+        JOB_WORKER_THREADS (int): Worker threads per process running jobs
+        JOB_POLL_INTERVAL (float): Seconds an idle worker waits before checking for due jobs
+        JOB_MAX_ATTEMPTS (int): Attempts before a job is marked failed
+        JOB_RETRY_BACKOFF (int): Seconds before the first retry, doubled for each further one
+        JOB_HEARTBEAT_INTERVAL (float): Seconds between the heartbeats of a worker running a job
+        JOB_TIMEOUT (int): Seconds without a heartbeat after which a running job is considered abandoned
+        JOB_RETENTION (int): Seconds succeeded jobs are kept before 'flask jobs purge' deletes them
+        SERVER_BIND (str): host:port the production server listens on
+        SERVER_WORKERS (int): Worker processes of the production server
+        SERVER_THREADS (int): Threads per worker process
+        SERVER_GRACEFUL_TIMEOUT (int): Seconds in-flight requests get to finish on shutdown
+        SERVER_PIDFILE (str): File recording the PID of the running production server
     """
     # Secret key for form protection
     SECRET_KEY = os.environ.get('SECRET_KEY') or 'your-hard-to-guess-secret-key'
@@ -31,11 +78,141 @@ class Config:
     SQLALCHEMY_DATABASE_URI = os.environ.get('DATABASE_URL') or \
         'sqlite:///' + os.path.join(basedir, 'app.db')
     SQLALCHEMY_TRACK_MODIFICATIONS = False
+
+    # Engine tuning (app/database.py); keep the pool at least as large as
+    # SERVER_THREADS so request threads never queue for a connection
+    DATABASE_POOL_SIZE = int(os.environ.get('DATABASE_POOL_SIZE') or 10)
+    DATABASE_MAX_OVERFLOW = int(os.environ.get('DATABASE_MAX_OVERFLOW') or 20)
+    DATABASE_POOL_TIMEOUT = 30
+    DATABASE_POOL_RECYCLE = 1800  # Below common server-side idle timeouts
+    SQLITE_PRAGMAS = {
+        'journal_mode': 'WAL',           # Readers and the writer no longer block each other
+        'synchronous': 'NORMAL',         # Durable with WAL; fsync only at checkpoints
+        'busy_timeout': 30000,           # Milliseconds to wait for the write lock
+        'mmap_size': 256 * 1024 * 1024,  # Read pages through the OS page cache
+    }
     
     # Upload Configuration
-    UPLOAD_FOLDER = os.path.join(basedir, 'app', 'static', 'uploads')
-    MAX_CONTENT_LENGTH = 16 * 1024 * 1024  # 16 MB max file size
+    UPLOAD_FOLDER = os.environ.get('UPLOAD_FOLDER') or os.path.join(basedir, 'app', 'static', 'uploads')
+    MAX_CONTENT_LENGTH = 16 * 1024 * 1024  # 16 MB max request body
+    
+    # Chunked uploads stream each chunk straight to disk, so the total file
+    # size is limited separately from the request body size
+    MAX_UPLOAD_SIZE = int(os.environ.get('MAX_UPLOAD_SIZE') or 512 * 1024 * 1024)  # 512 MB
+    UPLOAD_CHUNK_SIZE = 8 * 1024 * 1024  # Must not exceed MAX_CONTENT_LENGTH
+    UPLOAD_SESSION_TTL = 24 * 60 * 60
+    # Bound the disk space unfinished uploads can claim; new uploads are
+    # refused with 429 until others complete or go stale
+    MAX_UPLOAD_SESSIONS = int(os.environ.get('MAX_UPLOAD_SESSIONS') or 100)
+    MAX_UPLOAD_RESERVED_BYTES = int(os.environ.get('MAX_UPLOAD_RESERVED_BYTES') or 4 * 1024 * 1024 * 1024)  # 4 GB
     ALLOWED_EXTENSIONS = {'png', 'jpg', 'jpeg', 'gif', 'webp', 'svg'}
 
+    # Uploads are validated from their bytes while they are stored: the size
+    # limits are checked against the image header before anything decodes
+    # the pixels, and SVGs are parsed whole to be sanitized
+    MAX_IMAGE_PIXELS = int(os.environ.get('MAX_IMAGE_PIXELS') or 50 * 1000 * 1000)
+    MAX_IMAGE_DIMENSION = int(os.environ.get('MAX_IMAGE_DIMENSION') or 16384)
+    MAX_SVG_SIZE = 2 * 1024 * 1024  # 2 MB
+
+    # Storage Backend for originals and renditions: 'local' keeps them in
+    # UPLOAD_FOLDER and RENDITION_FOLDER; 's3' keeps them in an S3-compatible
+    # bucket shared by all app nodes (requires the boto3 package). Browsers
+    # fetch stored files from S3_PUBLIC_URL (e.g. a CDN) when set, otherwise
+    # from presigned URLs, which must outlive PAGE_CACHE_TTL
+    STORAGE_BACKEND = os.environ.get('STORAGE_BACKEND') or 'local'
+    S3_BUCKET = os.environ.get('S3_BUCKET')
+    S3_PREFIX = os.environ.get('S3_PREFIX') or ''
+    S3_ENDPOINT_URL = os.environ.get('S3_ENDPOINT_URL')  # e.g. MinIO at http://localhost:9000
+    S3_REGION = os.environ.get('S3_REGION')
+    S3_ACCESS_KEY_ID = os.environ.get('S3_ACCESS_KEY_ID')
+    S3_SECRET_ACCESS_KEY = os.environ.get('S3_SECRET_ACCESS_KEY')
+    S3_PUBLIC_URL = os.environ.get('S3_PUBLIC_URL')
+    S3_PRESIGN_EXPIRES = int(os.environ.get('S3_PRESIGN_EXPIRES') or 3600)
+    S3_MAX_POOL_CONNECTIONS = int(os.environ.get('S3_MAX_POOL_CONNECTIONS') or 50)
+    S3_MULTIPART_THRESHOLD = 8 * 1024 * 1024
+    S3_MULTIPART_CHUNKSIZE = 8 * 1024 * 1024
+    S3_MAX_CONCURRENCY = 4  # Parallel part transfers per file
+
+    # Rendition Configuration
+    RENDITION_FOLDER = os.path.join(UPLOAD_FOLDER, 'renditions')
+    RENDITION_SIZES = {
+        'thumb': 400,     # Gallery and search grid cards
+        'preview': 1200   # Image details page
+    }
+    RENDITION_QUALITY = 80
+
+    # On-the-fly transforms (/img/<id>/w<width>.<fmt>); only whitelisted
+    # parameters are accepted so the cache cannot be filled with variants
+    TRANSFORM_CACHE_FOLDER = os.path.join(UPLOAD_FOLDER, 'transforms')
+    TRANSFORM_CACHE_MAX_BYTES = int(os.environ.get('TRANSFORM_CACHE_MAX_BYTES') or 1024 * 1024 * 1024)  # 1 GB
+    TRANSFORM_WIDTHS = (160, 320, 480, 640, 800, 1024, 1280, 1600, 1920)
+    TRANSFORM_FORMATS = ('webp', 'avif', 'jpg', 'png')  # avif needs pillow-avif-plugin
+    TRANSFORM_QUALITIES = (50, 65, 75, 85, 95)
+    TRANSFORM_DEFAULT_QUALITY = 75
+
+    # Media URLs embed a content hash or version, so they can be cached forever
+    MEDIA_CACHE_MAX_AGE = 365 * 24 * 60 * 60  # One year
+
     # Pagination
     IMAGES_PER_PAGE = 12
+
+    # Taxonomy Cache: without a shared Redis version, each worker only sees
+    # other workers' category changes once its cached copy expires
+    TAXONOMY_CACHE_REDIS_URL = os.environ.get('TAXONOMY_CACHE_REDIS_URL')
+    TAXONOMY_CACHE_TTL = int(os.environ.get('TAXONOMY_CACHE_TTL') or 300)
+
+    # Page Cache: rendered gallery, details and category pages, dropped on
+    # every commit that changes images or categories. Share the generation
+    # through Redis so all workers drop their pages at once; otherwise other
+    # workers serve a page for at most PAGE_CACHE_TTL seconds
+    PAGE_CACHE_ENABLED = (os.environ.get('PAGE_CACHE_ENABLED') or 'true').lower() in ('1', 'true', 'yes')
+    PAGE_CACHE_MAX_BYTES = int(os.environ.get('PAGE_CACHE_MAX_BYTES') or 64 * 1024 * 1024)  # 64 MB
+    PAGE_CACHE_TTL = int(os.environ.get('PAGE_CACHE_TTL') or 60)
+    PAGE_CACHE_REDIS_URL = os.environ.get('PAGE_CACHE_REDIS_URL') or TAXONOMY_CACHE_REDIS_URL
+
+    # JSON API
+    API_MAX_PAGE_SIZE = 100
+    API_MAX_BATCH_SIZE = 500
+
+    # Background Jobs: with JOB_RUN_IN_APP disabled, run 'flask jobs work'
+    # in separate processes instead
+    JOB_RUN_IN_APP = (os.environ.get('JOB_RUN_IN_APP') or 'true').lower() in ('1', 'true', 'yes')
+    JOB_WORKER_THREADS = int(os.environ.get('JOB_WORKER_THREADS') or 2)
+    JOB_POLL_INTERVAL = 1.0
+    JOB_MAX_ATTEMPTS = 3
+    JOB_RETRY_BACKOFF = 10
+    # A running job is only requeued once its worker missed several
+    # heartbeats, however long the job itself takes
+    JOB_HEARTBEAT_INTERVAL = 30.0
+    JOB_TIMEOUT = 3 * 60
+    JOB_RETENTION = 7 * 24 * 60 * 60
+
+    # Similar Images: Hamming distances between 64-bit perceptual hashes.
+    # Each process reloads its hash index when the library changed, checking
+    # at most once every SIMILARITY_INDEX_TTL seconds
+    SIMILARITY_MAX_DISTANCE = 10
+    DUPLICATE_MAX_DISTANCE = 4
+    SIMILARITY_INDEX_TTL = 60
+
+    # Similar Prompts: hashed n-gram vectors of every prompt, kept in a
+    # memory-mapped matrix shared by the processes of one host. Outside the
+    # static folder, since it is not meant to be downloaded
+    PROMPT_INDEX_FOLDER = os.environ.get('PROMPT_INDEX_FOLDER') or os.path.join(basedir, 'instance', 'prompt_index')
+    PROMPT_INDEX_DIMENSIONS = int(os.environ.get('PROMPT_INDEX_DIMENSIONS') or 256)
+    PROMPT_SIMILARITY_MIN_SCORE = 0.35
+
+    # Metrics: Prometheus text format at /metrics, kept per worker process
+    METRICS_ENABLED = (os.environ.get('METRICS_ENABLED') or 'true').lower() in ('1', 'true', 'yes')
+
+    # Slow-Request Log (opt-in): requests taking at least SLOW_REQUEST_THRESHOLD
+    # seconds are logged with their SQL statements. With SLOW_REQUEST_PROFILE_DIR
+    # set, requests are also profiled and the profiles of slow ones saved there
+    SLOW_REQUEST_THRESHOLD = float(os.environ.get('SLOW_REQUEST_THRESHOLD') or 0) or None
+    SLOW_REQUEST_PROFILE_DIR = os.environ.get('SLOW_REQUEST_PROFILE_DIR')
+
+    # Production Server (serve.py)
+    SERVER_BIND = os.environ.get('SERVER_BIND') or '0.0.0.0:5000'
+    SERVER_WORKERS = int(os.environ.get('SERVER_WORKERS') or (os.cpu_count() or 1) * 2 + 1)
+    SERVER_THREADS = int(os.environ.get('SERVER_THREADS') or 4)
+    SERVER_GRACEFUL_TIMEOUT = int(os.environ.get('SERVER_GRACEFUL_TIMEOUT') or 30)
+    SERVER_PIDFILE = os.environ.get('SERVER_PIDFILE') or os.path.join(basedir, 'server.pid')
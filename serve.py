@@ -0,0 +1,218 @@
+"""
+Production Server for the Image Storage Application.
+
+Runs the application with a production WSGI server instead of the Flask
+development server in run.py:
+- gunicorn (Linux/macOS): SERVER_WORKERS processes with SERVER_THREADS
+  threads each; the app is loaded once in the master and every worker
+  disposes of the inherited database connections after the fork
+- waitress (Windows, or --server waitress): one process with SERVER_THREADS threads
+
+Both stop gracefully: they stop accepting connections, let in-flight
+requests finish for up to SERVER_GRACEFUL_TIMEOUT seconds and then exit.
+
+Usage:
+    python serve.py [--bind 0.0.0.0:5000] [--workers 4] [--threads 4] [--server auto]
+    python serve.py stop
+"""
+
+import argparse
+import os
+import signal
+import sys
+import threading
+import time
+
+from config import Config
+
+
+def stop_file(pidfile):
+    """Return the path whose creation asks a waitress server to stop."""
+    return pidfile + '.stop'
+
+
+def read_pid(pidfile):
+    """Return the PID recorded in a pidfile, or None if there is none."""
+    try:
+        with open(pidfile) as f:
+            return int(f.read().strip())
+    except (OSError, ValueError):
+        return None
+
+
+def serve_gunicorn(options):
+    """
+    Run the application under gunicorn.
+
+    Args:
+        options (argparse.Namespace): Parsed command line options
+    """
+    from gunicorn.app.base import BaseApplication
+
+    def post_fork(server, worker):
+        # Connections opened in the master must not be shared with workers
+        from app.models import db
+
+        app = server.app.wsgi()
+        with app.app_context():
+            db.engine.dispose(close=False)
+
+    class Server(BaseApplication):
+        def load_config(self):
+            settings = {
+                'bind': options.bind,
+                'workers': options.workers,
+                'threads': options.threads,
+                'worker_class': 'gthread' if options.threads > 1 else 'sync',
+                'preload_app': True,
+                'graceful_timeout': options.graceful_timeout,
+                'timeout': max(60, options.graceful_timeout),
+                'pidfile': options.pidfile,
+                'post_fork': post_fork,
+            }
+            for key, value in settings.items():
+                self.cfg.set(key, value)
+
+        def load(self):
+            from wsgi import app
+            return app
+
+    Server().run()
+
+
+def serve_waitress(options):
+    """
+    Run the application under waitress.
+
+    Args:
+        options (argparse.Namespace): Parsed command line options
+    """
+    from waitress import create_server, wasyncore
+    from wsgi import app
+
+    host, _, port = options.bind.rpartition(':')
+    server = create_server(app, host=host or '0.0.0.0', port=int(port), threads=options.threads)
+
+    def shutdown():
+        # Close the listening socket from the server loop, wait for the
+        # request threads to drain, then close the remaining connections so
+        # the loop runs out of sockets and server.run() returns
+        server.trigger.pull_trigger(lambda: wasyncore.dispatcher.close(server))
+        deadline = time.monotonic() + options.graceful_timeout
+        dispatcher = server.task_dispatcher
+        while (dispatcher.active_count or dispatcher.queue) and time.monotonic() < deadline:
+            time.sleep(0.1)
+        time.sleep(0.5)  # Let the loop flush the last responses
+        server.trigger.pull_trigger(lambda: wasyncore.close_all(server._map))
+
+    stopping = threading.Event()
+
+    def request_stop(*_):
+        if not stopping.is_set():
+            stopping.set()
+            print('Stopping gracefully...', flush=True)
+            threading.Thread(target=shutdown, daemon=True).start()
+
+    def watch_stop_file():
+        while not stopping.is_set():
+            if os.path.exists(stop_file(options.pidfile)):
+                request_stop()
+            time.sleep(0.5)
+
+    if os.path.exists(stop_file(options.pidfile)):
+        os.remove(stop_file(options.pidfile))
+    if hasattr(signal, 'SIGTERM'):
+        signal.signal(signal.SIGTERM, request_stop)
+    threading.Thread(target=watch_stop_file, daemon=True).start()
+
+    with open(options.pidfile, 'w') as f:
+        f.write(str(os.getpid()))
+    print(f'Serving on http://{options.bind} with {options.threads} threads', flush=True)
+    try:
+        server.run()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.task_dispatcher.shutdown(timeout=1)
+        for path in (options.pidfile, stop_file(options.pidfile)):
+            if os.path.exists(path):
+                os.remove(path)
+
+
+def stop(options):
+    """
+    Ask a running server to stop gracefully and wait for it to exit.
+
+    Args:
+        options (argparse.Namespace): Parsed command line options
+
+    Returns:
+        int: Process exit code
+    """
+    pid = read_pid(options.pidfile)
+    if pid is None:
+        print('No server is running (no pidfile found).')
+        return 1
+
+    open(stop_file(options.pidfile), 'w').close()
+    if hasattr(signal, 'SIGTERM') and os.name == 'posix':
+        try:
+            os.kill(pid, signal.SIGTERM)
+        except ProcessLookupError:
+            print(f'Process {pid} is not running; removing stale pidfile.')
+            os.remove(options.pidfile)
+            os.remove(stop_file(options.pidfile))
+            return 1
+
+    deadline = time.monotonic() + options.graceful_timeout + 5
+    while os.path.exists(options.pidfile) and time.monotonic() < deadline:
+        time.sleep(0.2)
+    if os.path.exists(options.pidfile):
+        print(f'Server {pid} did not stop within {options.graceful_timeout}s.')
+        return 1
+
+    if os.path.exists(stop_file(options.pidfile)):
+        os.remove(stop_file(options.pidfile))
+    print(f'Server {pid} stopped.')
+    return 0
+
+
+def parse_args(argv=None):
+    """Parse command line options, defaulting to the Config server settings."""
+    parser = argparse.ArgumentParser(description='Run the Image Storage Application in production mode.')
+    parser.add_argument('command', nargs='?', choices=('start', 'stop'), default='start')
+    parser.add_argument('--bind', default=Config.SERVER_BIND, help='host:port to listen on')
+    parser.add_argument('--workers', type=int, default=Config.SERVER_WORKERS, help='worker processes (gunicorn)')
+    parser.add_argument('--threads', type=int, default=Config.SERVER_THREADS, help='threads per worker')
+    parser.add_argument('--server', choices=('auto', 'gunicorn', 'waitress'), default='auto')
+    parser.add_argument('--pidfile', default=Config.SERVER_PIDFILE)
+    parser.add_argument('--graceful-timeout', type=int, default=Config.SERVER_GRACEFUL_TIMEOUT)
+    return parser.parse_args(argv)
+
+
+def main(argv=None):
+    """Start or stop the production server."""
+    options = parse_args(argv)
+    options.pidfile = os.path.abspath(options.pidfile)
+    if options.command == 'stop':
+        return stop(options)
+
+    if read_pid(options.pidfile) is not None:
+        print(f'A server may already be running ({options.pidfile} exists); '
+              'run "python serve.py stop" first.')
+        return 1
+
+    server = options.server
+    if server == 'auto':
+        server = 'gunicorn' if os.name == 'posix' else 'waitress'
+    if server == 'gunicorn':
+        serve_gunicorn(options)
+    else:
+        if options.workers > 1:
+            print('waitress runs a single process; use --threads to scale it.', flush=True)
+        serve_waitress(options)
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
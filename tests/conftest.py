@@ -0,0 +1,157 @@
+"""
+Shared fixtures for the Image Storage Application tests.
+
+Every test gets an application with its own SQLite database and upload
+folder, migrated to the latest schema and seeded with the default
+categories. Page caching and in-process job workers are disabled so each
+request really reaches the database.
+"""
+
+import pytest
+
+from config import Config
+
+
+@pytest.fixture
+def app(tmp_path):
+    """Application configured for tests, with the schema and categories in place."""
+    from flask_migrate import upgrade
+
+    from app import create_app
+    from app.seed import seed_taxonomy
+
+    class TestConfig(Config):
+        TESTING = True
+        WTF_CSRF_ENABLED = False
+        SQLALCHEMY_DATABASE_URI = f"sqlite:///{tmp_path / 'test.db'}"
+        UPLOAD_FOLDER = str(tmp_path / 'uploads')
+        RENDITION_FOLDER = str(tmp_path / 'uploads' / 'renditions')
+        TRANSFORM_CACHE_FOLDER = str(tmp_path / 'uploads' / 'transforms')
+        PROMPT_INDEX_FOLDER = str(tmp_path / 'prompt_index')
+        PAGE_CACHE_ENABLED = False
+        JOB_RUN_IN_APP = False
+
+    app = create_app(TestConfig)
+    with app.app_context():
+        upgrade()
+        seed_taxonomy()
+    return app
+
+
+@pytest.fixture
+def client(app):
+    """Test client for the application."""
+    return app.test_client()
+
+
+@pytest.fixture
+def make_image(app):
+    """Factory adding an image row without a file; returns the image ID."""
+    from app.models import db, Image, Subcategory
+
+    def make_image(name='Sunset over the sea', subcategory_id=1, **fields):
+        with app.app_context():
+            subcategory = db.session.get(Subcategory, subcategory_id)
+            fields.setdefault('filename', f"{name.replace(' ', '_')}.png")
+            fields.setdefault('description', '')
+            fields.setdefault('prompt', '')
+            image = Image(name=name, category_id=subcategory.category_id,
+                          subcategory_id=subcategory.id, **fields)
+            db.session.add(image)
+            db.session.commit()
+            return image.id
+
+    return make_image
+
+
+@pytest.fixture
+def image_count(app):
+    """Return a function counting the images in the database."""
+    from app.models import Image
+
+    def image_count():
+        with app.app_context():
+            return Image.query.count()
+
+    return image_count
+
+
+@pytest.fixture
+def image_bytes():
+    """
+    Factory encoding an image in memory.
+
+    Noisy images do not compress, which makes large files from few pixels.
+    """
+    import io
+    import os
+
+    from PIL import Image as PILImage
+
+    def image_bytes(fmt='PNG', size=(64, 48), color=(200, 30, 30), noise=False, **options):
+        if noise:
+            image = PILImage.frombytes('RGB', size, os.urandom(size[0] * size[1] * 3))
+        else:
+            image = PILImage.new('RGB', size, color)
+        buffer = io.BytesIO()
+        image.save(buffer, fmt, **options)
+        return buffer.getvalue()
+
+    return image_bytes
+
+
+@pytest.fixture
+def upload(client):
+    """Post a file through the upload form; returns the response after redirects."""
+    import io
+
+    def upload(data, filename='image.png', name='Test image', **fields):
+        form = {'name': name, 'description': '', 'prompt': '', 'category': 1, 'subcategory': 1,
+                'image': (io.BytesIO(data), filename)}
+        form.update(fields)
+        return client.post('/upload', data=form, content_type='multipart/form-data', follow_redirects=True)
+
+    return upload
+
+
+@pytest.fixture
+def chunked_upload(app, client):
+    """
+    Send a file through the chunked upload API.
+
+    Returns the response of the last request made: the completion, or the
+    first one that failed.
+    """
+    import hashlib
+
+    def chunked_upload(data, filename='image.png', name='Test image', complete=True):
+        response = client.post('/api/uploads', json={
+            'filename': filename, 'size': len(data), 'name': name, 'category_id': 1, 'subcategory_id': 1})
+        if response.status_code != 201:
+            return response
+        upload_id, chunk_size = response.json['id'], response.json['chunk_size']
+        for index, offset in enumerate(range(0, len(data), chunk_size)):
+            chunk = data[offset:offset + chunk_size]
+            response = client.put(f'/api/uploads/{upload_id}/chunks/{index}', data=chunk,
+                                  headers={'X-Chunk-SHA256': hashlib.sha256(chunk).hexdigest()})
+            if response.status_code != 200:
+                return response
+        if not complete:
+            return response
+        return client.post(f'/api/uploads/{upload_id}/complete')
+
+    return chunked_upload
+
+
+@pytest.fixture
+def run_jobs(app):
+    """Run the due background jobs to completion; returns how many ran."""
+    from app.jobs import WorkerPool
+
+    def run_jobs():
+        pool = WorkerPool(app, 1, burst=True)
+        pool.start()
+        pool.join()
+        return pool.processed
+
+    return run_jobs
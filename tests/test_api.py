@@ -0,0 +1,152 @@
+"""
+Tests for the JSON API: field selection, cursor pagination, search and the
+all-or-nothing batch operations.
+"""
+
+import pytest
+
+from app.models import db, Image, Subcategory
+
+
+def other_category_subcategory(app):
+    """Return the ID of a subcategory outside subcategory 1's category."""
+    with app.app_context():
+        category_id = db.session.get(Subcategory, 1).category_id
+        return Subcategory.query.filter(Subcategory.category_id != category_id).first().id
+
+
+def test_cursor_pages_list_every_image_once(client, make_image):
+    ids = [make_image(f'Image {number}') for number in range(7)]
+
+    seen, cursor = [], None
+    while True:
+        response = client.get('/api/v1/images', query_string={'limit': 3, 'fields': 'id', 'cursor': cursor or ''})
+        assert response.status_code == 200
+        seen += [item['id'] for item in response.json['items']]
+        cursor = response.json['next_cursor']
+        if cursor is None:
+            break
+
+    assert sorted(seen) == sorted(ids)
+    assert len(seen) == len(ids)
+
+
+def test_only_the_requested_fields_are_returned(client, make_image):
+    image_id = make_image('Sunset over the sea', prompt='a red sky')
+
+    response = client.get(f'/api/v1/images/{image_id}', query_string={'fields': 'name,prompt'})
+
+    assert response.json == {'name': 'Sunset over the sea', 'prompt': 'a red sky'}
+
+
+@pytest.mark.parametrize('url', [
+    '/api/v1/images?fields=name,password',
+    '/api/v1/images?limit=0',
+    '/api/v1/images?limit=100000',
+    '/api/v1/images?cursor=garbage',
+    '/api/v1/images?min_width=wide',
+    '/api/v1/images/search?page=0',
+])
+def test_invalid_arguments_are_json_errors(client, url):
+    response = client.get(url)
+
+    assert response.status_code == 400
+    assert 'error' in response.json
+
+
+def test_missing_image_is_a_json_404(client):
+    response = client.get('/api/v1/images/999')
+
+    assert response.status_code == 404
+    assert response.json == {'error': 'Image not found'}
+
+
+def test_search_returns_matches_only(client, make_image):
+    make_image('Sunset over the sea')
+    make_image('Forest at dawn')
+
+    response = client.get('/api/v1/images/search', query_string={'q': 'sunset', 'fields': 'name'})
+    assert [item['name'] for item in response.json['items']] == ['Sunset over the sea']
+    assert response.json['next_page'] is None
+
+    response = client.get('/api/v1/images/search', query_string={'q': '!!!'})
+    assert response.json['items'] == []
+
+
+def test_patch_updates_and_validates(app, client, make_image):
+    image_id = make_image('Sunset over the sea')
+
+    response = client.patch(f'/api/v1/images/{image_id}?fields=name', json={'name': 'Red sunset'})
+    assert response.json == {'name': 'Red sunset'}
+
+    for changes in ({'name': 'x'}, {'category_id': 1}, {'filename': 'evil.png'}, {'subcategory_id': 9999},
+                    {'category_id': 9999, 'subcategory_id': 1}):
+        response = client.patch(f'/api/v1/images/{image_id}', json=changes)
+        assert response.status_code == 400, changes
+    with app.app_context():
+        assert db.session.get(Image, image_id).name == 'Red sunset'
+
+
+def test_changing_the_subcategory_moves_the_category(app, client, make_image):
+    image_id = make_image()
+    subcategory_id = other_category_subcategory(app)
+
+    response = client.patch(f'/api/v1/images/{image_id}?fields=category_id,subcategory_id',
+                            json={'subcategory_id': subcategory_id})
+
+    with app.app_context():
+        category_id = db.session.get(Subcategory, subcategory_id).category_id
+    assert response.json == {'category_id': category_id, 'subcategory_id': subcategory_id}
+
+
+def test_batch_get_keeps_request_order_and_reports_missing(client, make_image):
+    first, second = make_image('First image'), make_image('Second image')
+
+    response = client.post('/api/v1/images/batch/get', json={'ids': [second, 999, first], 'fields': ['name']})
+
+    assert response.json == {'items': [{'name': 'Second image'}, {'name': 'First image'}], 'missing': [999]}
+
+
+def test_batch_update_changes_nothing_if_an_id_is_missing(app, client, make_image):
+    ids = [make_image('First image'), make_image('Second image')]
+
+    response = client.post('/api/v1/images/batch/update', json={'ids': ids + [999], 'changes': {'prompt': 'new'}})
+    assert response.status_code == 404
+    assert response.json['missing'] == [999]
+    with app.app_context():
+        assert [db.session.get(Image, i).prompt for i in ids] == ['', '']
+
+    response = client.post('/api/v1/images/batch/update', json={'ids': ids, 'changes': {'prompt': 'new'}})
+    assert response.json == {'updated': 2}
+    with app.app_context():
+        assert [db.session.get(Image, i).prompt for i in ids] == ['new', 'new']
+
+
+def test_batch_delete_is_all_or_nothing(app, client, make_image, image_count):
+    ids = [make_image('First image'), make_image('Second image')]
+
+    response = client.post('/api/v1/images/batch/delete', json={'ids': ids + [999]})
+    assert response.status_code == 404
+    assert image_count() == 2
+
+    response = client.post('/api/v1/images/batch/delete', json={'ids': ids})
+    assert response.json == {'deleted': 2}
+    assert image_count() == 0
+
+
+@pytest.mark.parametrize('body', [{}, {'ids': []}, {'ids': ['1']}, {'ids': list(range(1, 502))}])
+def test_batch_ids_are_validated(client, body):
+    response = client.post('/api/v1/images/batch/delete', json=body)
+
+    assert response.status_code == 400
+
+
+def test_categories_list_their_subcategories(app, client):
+    response = client.get('/api/v1/categories')
+
+    with app.app_context():
+        subcategory = db.session.get(Subcategory, 1)
+        expected = {'id': subcategory.id, 'name': subcategory.name}
+        category_id = subcategory.category_id
+    category = next(item for item in response.json if item['id'] == category_id)
+    assert expected in category['subcategories']
@@ -0,0 +1,79 @@
+"""
+Tests for the bulk move, edit and delete actions of the gallery and search pages.
+"""
+
+import pytest
+
+from app.models import db, Image, Subcategory
+
+
+def bulk(client, **data):
+    data.setdefault('next', '/')
+    return client.post('/images/bulk', data=data, follow_redirects=True)
+
+
+@pytest.mark.parametrize('filters', [
+    '',
+    'search_query=',
+    'search_query=!!!',
+    'search_query=+++&orientation=sideways',
+    'category=0&subcategory=0',
+    'min_width=-5',
+    'category=9999',
+    'min_size=lots',
+])
+def test_scope_all_without_valid_filter_is_refused(client, make_image, image_count, filters):
+    for name in ('Sunset one', 'Sunset two', 'Forest three'):
+        make_image(name)
+
+    response = bulk(client, scope='all', filters=filters, action='delete')
+
+    assert b'need a valid filter' in response.data
+    assert image_count() == 3
+
+
+def test_scope_all_with_filter_selecting_nothing_deletes_nothing(client, make_image, image_count):
+    make_image('Sunset one')
+
+    response = bulk(client, scope='all', filters='search_query=zebra', action='delete')
+
+    assert b'Select at least one image' in response.data
+    assert image_count() == 1
+
+
+def test_scope_all_deletes_only_matching_images(app, client, make_image):
+    make_image('Sunset one')
+    make_image('Sunset two')
+    forest = make_image('Forest three')
+
+    response = bulk(client, scope='all', filters='search_query=sunset', action='delete')
+
+    assert b'Deleted 2 images' in response.data
+    with app.app_context():
+        assert [image.id for image in Image.query] == [forest]
+
+
+def test_move_and_edit_selected_images(app, client, make_image):
+    first, second, untouched = make_image('Sunset one'), make_image('Sunset two'), make_image('Forest')
+    with app.app_context():
+        target = Subcategory.query.filter(Subcategory.category_id != 1).first()
+        target_id, target_category = target.id, target.category_id
+
+    bulk(client, ids=[first, second], action='move', subcategory_id=target_id)
+    bulk(client, ids=[first, second], action='edit', description='Evening', prompt='')
+
+    with app.app_context():
+        for image_id in (first, second):
+            image = db.session.get(Image, image_id)
+            assert (image.category_id, image.subcategory_id) == (target_category, target_id)
+            assert image.description == 'Evening'
+        assert db.session.get(Image, untouched).subcategory_id == 1
+
+
+def test_unknown_action_changes_nothing(client, make_image, image_count):
+    image_id = make_image('Sunset one')
+
+    response = bulk(client, ids=[image_id], action='explode')
+
+    assert b'Unknown bulk action' in response.data
+    assert image_count() == 1
@@ -0,0 +1,85 @@
+"""
+Tests for the streamed ZIP and tar exports and their manifests.
+"""
+
+import csv
+import io
+import json
+import os
+import tarfile
+import zipfile
+
+import pytest
+
+from app import export
+
+
+@pytest.fixture
+def exported(app, upload, make_image, image_bytes):
+    """Two uploaded images, a legacy one and one whose file is gone; returns name -> bytes."""
+    files = {'Red image': image_bytes('PNG', color=(200, 30, 30)),
+             'Blue image': image_bytes('JPEG', color=(30, 30, 200))}
+    upload(files['Red image'], 'red.png', name='Red image', prompt='a red square')
+    upload(files['Blue image'], 'blue.jpg', name='Blue image')
+
+    files['Legacy image'] = image_bytes('GIF')
+    with open(os.path.join(app.config['UPLOAD_FOLDER'], 'legacy.gif'), 'wb') as f:
+        f.write(files['Legacy image'])
+    make_image('Legacy image', filename='legacy.gif')
+    make_image('Missing image', filename='missing.png')
+    return files
+
+
+def read_zip(data):
+    with zipfile.ZipFile(io.BytesIO(data)) as archive:
+        assert archive.testzip() is None
+        return {info.filename: archive.read(info) for info in archive.infolist()}
+
+
+def read_tar(data):
+    with tarfile.open(fileobj=io.BytesIO(data)) as archive:
+        return {member.name: archive.extractfile(member).read() for member in archive.getmembers()}
+
+
+def manifest_rows(entries, kind):
+    data = entries.pop(f'manifest.{kind}').decode('utf-8')
+    return list(csv.DictReader(io.StringIO(data))) if kind == 'csv' else json.loads(data)
+
+
+@pytest.mark.parametrize('archive, manifest', [('zip', 'csv'), ('tar', 'json')])
+def test_archive_holds_every_file_and_its_manifest(client, exported, monkeypatch, archive, manifest):
+    # Several batches of rows
+    monkeypatch.setattr(export, 'BATCH_SIZE', 1)
+
+    response = client.get('/export', query_string={'archive': archive, 'manifest': manifest})
+
+    assert response.status_code == 200
+    assert response.headers['Content-Disposition'].endswith(f'.{archive}"')
+    entries = (read_zip if archive == 'zip' else read_tar)(response.data)
+    rows = manifest_rows(entries, manifest)
+    assert sorted(row['name'] for row in rows) == ['Blue image', 'Legacy image', 'Red image']
+    for row in rows:
+        assert entries.pop(row['file']) == exported[row['name']]
+    assert entries == {}
+    assert next(row for row in rows if row['name'] == 'Red image')['prompt'] == 'a red square'
+
+
+def test_compressed_formats_are_stored(client, exported):
+    response = client.get('/export')
+
+    with zipfile.ZipFile(io.BytesIO(response.data)) as archive:
+        methods = {info.filename.rsplit('.', 1)[-1]: info.compress_type for info in archive.infolist()}
+    assert methods['png'] == methods['jpg'] == zipfile.ZIP_STORED
+    assert methods['csv'] == zipfile.ZIP_DEFLATED
+
+
+def test_filters_select_the_exported_images(client, exported):
+    response = client.get('/export', query_string={'search_query': 'blue'})
+
+    rows = manifest_rows(read_zip(response.data), 'csv')
+    assert [row['name'] for row in rows] == ['Blue image']
+
+
+@pytest.mark.parametrize('query', ['archive=rar', 'manifest=xml'])
+def test_unknown_formats_are_rejected(client, query):
+    assert client.get(f'/export?{query}').status_code == 400
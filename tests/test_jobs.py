@@ -0,0 +1,148 @@
+"""
+Tests for the background job queue: claiming, retries, heartbeats and
+requeueing jobs whose worker stopped.
+"""
+
+import time
+from datetime import datetime, timedelta
+
+import pytest
+
+from app.jobs import (HANDLERS, claim_job, enqueue, job_handler, purge_finished_jobs,
+                      requeue_stale_jobs, retry_failed_jobs, run_job)
+from app.models import db, Image, Job
+
+
+@pytest.fixture
+def handlers():
+    """Register test handlers and remove them afterwards."""
+    registered = dict(HANDLERS)
+    yield job_handler
+    HANDLERS.clear()
+    HANDLERS.update(registered)
+
+
+def add_job(kind='test', **payload):
+    job = enqueue(kind, **payload)
+    db.session.commit()
+    return job.id
+
+
+def test_a_job_is_claimed_once(app):
+    with app.app_context():
+        job_id = add_job()
+
+        job = claim_job('worker-a')
+        assert (job.id, job.status, job.locked_by, job.attempts) == (job_id, 'running', 'worker-a', 1)
+        assert claim_job('worker-b') is None
+
+
+def test_failed_jobs_are_retried_with_backoff_then_failed(app, handlers):
+    calls = []
+
+    @handlers('test')
+    def fail(job):
+        calls.append(job.data['value'])
+        raise ValueError('boom')
+
+    with app.app_context():
+        job_id = add_job(value=7)
+        assert run_job(claim_job('worker')) is False
+
+        job = db.session.get(Job, job_id)
+        assert job.status == 'queued'
+        assert job.error == 'ValueError: boom'
+        assert job.run_after > datetime.utcnow() + timedelta(seconds=app.config['JOB_RETRY_BACKOFF'] - 1)
+        assert claim_job('worker') is None
+
+        for _ in range(app.config['JOB_MAX_ATTEMPTS'] - 1):
+            Job.query.update({'run_after': datetime.utcnow()})
+            db.session.commit()
+            run_job(claim_job('worker'))
+
+        assert db.session.get(Job, job_id).status == 'failed'
+        assert calls == [7] * app.config['JOB_MAX_ATTEMPTS']
+
+        assert retry_failed_jobs() == 1
+        job = db.session.get(Job, job_id)
+        assert (job.status, job.attempts) == ('queued', 0)
+
+
+def test_handler_changes_roll_back_with_a_failed_job(app, handlers, make_image):
+    image_id = make_image()
+
+    @handlers('test')
+    def rename_then_fail(job):
+        db.session.get(Image, job.image_id).name = 'Renamed'
+        raise RuntimeError('late failure')
+
+    with app.app_context():
+        enqueue('test', image_id=image_id)
+        db.session.commit()
+        run_job(claim_job('worker'))
+
+        assert db.session.get(Image, image_id).name == 'Sunset over the sea'
+
+
+def test_running_jobs_send_heartbeats(app, handlers):
+    app.config['JOB_HEARTBEAT_INTERVAL'] = 0.05
+
+    @handlers('test')
+    def slow(job):
+        time.sleep(0.3)
+
+    with app.app_context():
+        job_id = add_job()
+        job = claim_job('worker')
+        claimed_at = job.locked_at
+        assert run_job(job) is True
+
+        job = db.session.get(Job, job_id)
+        assert job.status == 'succeeded'
+        assert job.heartbeat_at > claimed_at + timedelta(seconds=0.1)
+
+
+def test_long_running_jobs_with_a_heartbeat_are_not_requeued(app):
+    with app.app_context():
+        alive, dead = add_job(), add_job()
+        claim_job('worker-a')
+        claim_job('worker-b')
+        long_ago = datetime.utcnow() - timedelta(hours=1)
+        Job.query.update({'locked_at': long_ago, 'heartbeat_at': long_ago})
+        Job.query.filter_by(id=alive).update({'heartbeat_at': datetime.utcnow()})
+        db.session.commit()
+
+        assert requeue_stale_jobs() == 1
+
+        assert db.session.get(Job, alive).status == 'running'
+        dead_job = db.session.get(Job, dead)
+        assert (dead_job.status, dead_job.locked_by) == ('queued', None)
+
+
+def test_abandoned_jobs_without_attempts_left_fail(app):
+    with app.app_context():
+        job_id = add_job()
+        Job.query.update({'attempts': app.config['JOB_MAX_ATTEMPTS'] - 1})
+        db.session.commit()
+        claim_job('worker')
+        Job.query.update({'heartbeat_at': datetime.utcnow() - timedelta(hours=1)})
+        db.session.commit()
+
+        assert requeue_stale_jobs() == 1
+
+        job = db.session.get(Job, job_id)
+        assert (job.status, job.error) == ('failed', 'Worker stopped while running the job')
+
+
+def test_purge_keeps_failed_and_recent_jobs(app):
+    with app.app_context():
+        old, recent, failed = add_job(), add_job(), add_job()
+        long_ago = datetime.utcnow() - timedelta(days=30)
+        Job.query.filter(Job.id.in_([old, recent])).update({'status': 'succeeded'})
+        Job.query.filter_by(id=old).update({'finished_at': long_ago})
+        Job.query.filter_by(id=recent).update({'finished_at': datetime.utcnow()})
+        Job.query.filter_by(id=failed).update({'status': 'failed', 'finished_at': long_ago})
+        db.session.commit()
+
+        assert purge_finished_jobs() == 1
+        assert {job.id for job in Job.query} == {recent, failed}
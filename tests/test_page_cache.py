@@ -0,0 +1,69 @@
+"""
+Tests for the rendered page cache.
+"""
+
+import pytest
+
+from app.jobs import enqueue
+from app.models import db, Image, Job
+from app.page_cache import init_page_cache
+
+
+@pytest.fixture
+def cached_app(app):
+    app.config['PAGE_CACHE_ENABLED'] = True
+    init_page_cache(app)
+    return app
+
+
+def test_pages_are_served_from_the_cache_until_a_commit(cached_app, client, make_image):
+    make_image('Sunset one')
+
+    assert client.get('/').headers['X-Cache'] == 'MISS'
+    assert client.get('/').headers['X-Cache'] == 'HIT'
+
+    make_image('Sunset two')
+    response = client.get('/')
+
+    assert response.headers['X-Cache'] == 'MISS'
+    assert b'Sunset two' in response.data
+
+
+def test_query_strings_are_cached_separately(cached_app, client, make_image):
+    make_image('Sunset one')
+    client.get('/')
+
+    assert client.get('/?page=2').headers['X-Cache'] == 'MISS'
+
+
+def test_details_of_images_being_processed_are_not_cached(cached_app, client, make_image):
+    image_id = make_image('Sunset one')
+    with cached_app.app_context():
+        enqueue('process_image', image_id=image_id)
+        db.session.commit()
+
+    for _ in range(2):
+        response = client.get(f'/image/{image_id}')
+        assert response.status_code == 200
+        assert 'X-Cache' not in response.headers
+
+    with cached_app.app_context():
+        Job.query.filter_by(image_id=image_id).update({'status': 'succeeded'})
+        db.session.commit()
+
+    assert client.get(f'/image/{image_id}').headers['X-Cache'] == 'MISS'
+    assert client.get(f'/image/{image_id}').headers['X-Cache'] == 'HIT'
+
+
+def test_pages_with_pending_flashes_bypass_the_cache(cached_app, client, make_image):
+    image_id = make_image('Sunset one')
+    client.get('/')
+
+    # Deleting flashes a message that the next page has to show
+    client.post(f'/image/{image_id}/delete')
+    response = client.get('/')
+
+    assert 'X-Cache' not in response.headers
+    assert b'Image deleted successfully' in response.data
+    with cached_app.app_context():
+        assert Image.query.count() == 0
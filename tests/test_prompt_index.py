@@ -0,0 +1,53 @@
+"""
+Tests for the similar prompts section of the details page.
+"""
+
+import threading
+
+import app.prompt_index as prompt_index
+
+
+def wait_for_builder(app):
+    builder = app.extensions.get('prompt_index_builder')
+    if builder is not None:
+        builder.join(timeout=30)
+
+
+def test_missing_index_is_built_outside_the_request(app, client, make_image, monkeypatch):
+    image_id = make_image('Sunset one', prompt='a red sunset over the sea')
+    builds = []
+    rebuild = prompt_index.rebuild_prompt_index
+    monkeypatch.setattr(prompt_index, 'rebuild_prompt_index',
+                        lambda **kwargs: builds.append(threading.current_thread().name) or rebuild(**kwargs))
+
+    response = client.get(f'/image/{image_id}')
+    wait_for_builder(app)
+
+    assert response.status_code == 200
+    assert b'Similar Prompts' not in response.data
+    assert builds == ['prompt-index-builder']
+    with app.app_context():
+        assert prompt_index.get_prompt_index().exists()
+
+
+def test_similar_prompts_are_listed_once_the_index_exists(app, client, make_image):
+    image_id = make_image('Sunset one', prompt='a red sunset over the calm sea')
+    make_image('Sunset two', prompt='a red sunset over the stormy sea')
+    make_image('Forest', prompt='pine trees in the fog')
+    with app.app_context():
+        prompt_index.rebuild_prompt_index()
+
+    response = client.get(f'/image/{image_id}')
+
+    assert b'Similar Prompts' in response.data
+    assert b'Sunset two' in response.data
+    assert b'Forest' not in response.data
+
+
+def test_committed_prompt_changes_update_the_index(app, client, make_image):
+    image_id = make_image('Sunset one', prompt='a red sunset over the calm sea')
+    with app.app_context():
+        prompt_index.rebuild_prompt_index()
+    make_image('Sunset two', prompt='a red sunset over the stormy sea')
+
+    assert b'Sunset two' in client.get(f'/image/{image_id}').data
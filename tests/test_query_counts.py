@@ -0,0 +1,56 @@
+"""
+Query count regression tests for the listing pages.
+
+Each page is rendered with one image and again with a full page of images
+spread over several categories. The number of SQL statements must not
+change, so a relationship lazily loaded per image or per category fails
+the test with the list of statements that were executed.
+"""
+
+import hashlib
+
+import pytest
+
+from app.models import db, Blob, Image, Rendition, Subcategory
+from app.testing import assert_max_queries, count_queries
+
+PAGES = ['/', '/search?search_query=sunset', '/categories']
+
+
+def add_images(count, start=0):
+    """Add `count` images with blobs and renditions, cycling through the subcategories."""
+    subcategories = Subcategory.query.order_by(Subcategory.id).all()
+    for number in range(start, start + count):
+        subcategory = subcategories[number % len(subcategories)]
+        sha256 = hashlib.sha256(str(number).encode()).hexdigest()
+        blob = Blob(sha256=sha256, extension='png', size=1000 + number, refcount=1)
+        for kind, size in (('thumb', 300), ('preview', 1200)):
+            blob.renditions.append(Rendition(kind=kind, filename=f'{sha256}.png.{kind}.webp',
+                                             width=size, height=size))
+        db.session.add(Image(name=f'Sunset {number}', filename=f'sunset-{number}.png', description='Evening sky',
+                             prompt='a sunset over the sea', category_id=subcategory.category_id,
+                             subcategory_id=subcategory.id, blob=blob, width=1600, height=900,
+                             format='PNG', file_size=1000 + number, color_mode='RGB'))
+    db.session.commit()
+
+
+def page_queries(client, url):
+    """Return the SQL statements executed while rendering a page."""
+    with count_queries() as counter:
+        response = client.get(url)
+    assert response.status_code == 200
+    return counter.statements
+
+
+@pytest.mark.parametrize('url', PAGES)
+def test_query_count_does_not_grow_with_images(app, client, url):
+    with app.app_context():
+        add_images(1)
+        client.get(url)  # loads the taxonomy cache
+        single = page_queries(client, url)
+
+        add_images(app.config['IMAGES_PER_PAGE'] - 1, start=1)
+        with assert_max_queries(len(single)):
+            many = page_queries(client, url)
+
+    assert len(many) == len(single), '\n'.join(many)
@@ -0,0 +1,43 @@
+"""
+Tests for the full-text search filters shared by the search page and the API.
+"""
+
+import pytest
+
+from app.models import Image
+from app.search import filter_images
+
+
+def search(app, **filters):
+    with app.app_context():
+        query, _ = filter_images(Image.query, **filters)
+        return sorted(image.name for image in query)
+
+
+def test_terms_match_as_prefixes_of_every_word(app, make_image):
+    make_image('Sunset over the landscape')
+    make_image('Sunrise in the city')
+
+    assert search(app, text='sun land') == ['Sunset over the landscape']
+    assert search(app, text='SUN') == ['Sunrise in the city', 'Sunset over the landscape']
+
+
+@pytest.mark.parametrize('text', ['!!!', '-- *', '"'])
+def test_text_without_terms_matches_nothing(app, make_image, text):
+    make_image('Sunset over the sea')
+
+    assert search(app, text=text) == []
+
+
+@pytest.mark.parametrize('text', [None, '', '   '])
+def test_blank_text_does_not_filter(app, make_image, text):
+    make_image('Sunset over the sea')
+
+    assert search(app, text=text) == ['Sunset over the sea']
+
+
+def test_search_page_lists_nothing_for_punctuation(client, make_image):
+    make_image('Sunset over the sea')
+
+    assert b'Sunset over the sea' in client.get('/search?search_query=sun').data
+    assert b'Sunset over the sea' not in client.get('/search?search_query=!!!').data
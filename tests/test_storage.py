@@ -0,0 +1,151 @@
+"""
+Tests for content-addressed storage: deduplication, reference counts and
+removing files only once nothing refers to them.
+"""
+
+import hashlib
+import os
+
+import pytest
+
+from app.models import db, Blob, Image
+from app.storage import discard_new_blob, migrate_legacy_images, store_file
+
+
+def blob_path(app, blob_id):
+    with app.app_context():
+        blob = db.session.get(Blob, blob_id)
+        return os.path.join(app.config['UPLOAD_FOLDER'], blob.storage_key)
+
+
+def image_ids(app):
+    with app.app_context():
+        return [image.id for image in Image.query.order_by(Image.id)]
+
+
+def only_blob(app):
+    with app.app_context():
+        blob = Blob.query.one()
+        return blob.id, blob.refcount
+
+
+def test_identical_uploads_share_one_blob(app, upload, image_bytes):
+    data = image_bytes('PNG')
+
+    upload(data, 'first.png')
+    response = upload(data, 'second.png')
+
+    assert b'identical file was already stored' in response.data
+    blob_id, refcount = only_blob(app)
+    assert refcount == 2
+    with open(blob_path(app, blob_id), 'rb') as f:
+        assert f.read() == data
+
+
+def test_files_are_removed_after_the_last_reference(app, client, upload, image_bytes, run_jobs):
+    data = image_bytes('PNG')
+    upload(data, 'first.png')
+    upload(data, 'second.png')
+    run_jobs()
+    first, second = image_ids(app)
+    blob_id, _ = only_blob(app)
+    path = blob_path(app, blob_id)
+
+    client.post(f'/image/{first}/delete')
+    run_jobs()
+    assert only_blob(app) == (blob_id, 1)
+    assert os.path.exists(path)
+
+    client.post(f'/image/{second}/delete')
+    # The row stays without references until the job removes it after the commit
+    assert only_blob(app) == (blob_id, 0)
+    assert os.path.exists(path)
+    run_jobs()
+
+    with app.app_context():
+        assert Blob.query.count() == 0
+    assert os.listdir(os.path.dirname(path)) == []
+
+
+def test_upload_before_the_delete_job_revives_the_blob(app, client, upload, image_bytes, run_jobs):
+    data = image_bytes('PNG')
+    upload(data, 'first.png')
+    client.post(f'/image/{image_ids(app)[0]}/delete')
+
+    upload(data, 'again.png')
+    run_jobs()
+
+    blob_id, refcount = only_blob(app)
+    assert refcount == 1
+    with open(blob_path(app, blob_id), 'rb') as f:
+        assert f.read() == data
+
+
+def test_losing_a_race_keeps_the_winners_file(app, tmp_path):
+    data = b'same bytes'
+    sha256 = hashlib.sha256(data).hexdigest()
+    with app.app_context():
+        (tmp_path / 'loser').write_bytes(data)
+        loser = store_file(str(tmp_path / 'loser'), sha256, len(data), 'png')
+        db.session.rollback()
+        # Another request committed a blob with the same contents meanwhile
+        db.session.add(Blob(sha256=sha256, extension='png', size=len(data), refcount=1))
+        db.session.commit()
+
+        discard_new_blob(loser)
+
+        assert Blob.query.one().refcount == 1
+        assert os.path.exists(os.path.join(app.config['UPLOAD_FOLDER'], loser.storage_key))
+
+
+def test_failed_upload_files_are_removed(app, tmp_path, run_jobs):
+    data = b'lonely bytes'
+    with app.app_context():
+        (tmp_path / 'upload').write_bytes(data)
+        blob = store_file(str(tmp_path / 'upload'), hashlib.sha256(data).hexdigest(), len(data), 'png')
+        path = os.path.join(app.config['UPLOAD_FOLDER'], blob.storage_key)
+        db.session.rollback()
+
+        discard_new_blob(blob)
+    run_jobs()
+
+    assert not os.path.exists(path)
+    with app.app_context():
+        assert Blob.query.count() == 0
+
+
+@pytest.fixture
+def legacy_image(app, make_image, image_bytes):
+    data = image_bytes('PNG')
+    with open(os.path.join(app.config['UPLOAD_FOLDER'], 'legacy.png'), 'wb') as f:
+        f.write(data)
+    return make_image('Legacy upload', filename='legacy.png'), data
+
+
+def test_legacy_files_are_removed_after_the_migration_commits(app, legacy_image, run_jobs):
+    image_id, data = legacy_image
+    legacy_path = os.path.join(app.config['UPLOAD_FOLDER'], 'legacy.png')
+    with app.app_context():
+        assert migrate_legacy_images(echo=lambda message: None) == (1, 0)
+        blob = db.session.get(Image, image_id).blob
+        assert os.path.exists(legacy_path)
+
+    run_jobs()
+
+    assert not os.path.exists(legacy_path)
+    with open(blob_path(app, blob.id), 'rb') as f:
+        assert f.read() == data
+
+
+def test_failed_migration_keeps_the_legacy_files(app, legacy_image, run_jobs, monkeypatch):
+    image_id, _ = legacy_image
+    with app.app_context():
+        monkeypatch.setattr(db.session, 'commit', lambda: (_ for _ in ()).throw(RuntimeError('disk full')))
+        with pytest.raises(RuntimeError):
+            migrate_legacy_images(echo=lambda message: None)
+        monkeypatch.undo()
+    run_jobs()
+
+    assert os.path.exists(os.path.join(app.config['UPLOAD_FOLDER'], 'legacy.png'))
+    with app.app_context():
+        assert db.session.get(Image, image_id).blob_id is None
@@ -0,0 +1,72 @@
+"""
+Tests for the taxonomy cache: snapshots are served without queries and
+reloaded once a taxonomy change is committed, by this process or another.
+"""
+
+import time
+
+from app.models import db, Category
+from app.taxonomy import get_taxonomy
+from app.testing import count_queries
+
+
+def category_names(taxonomy):
+    return [name for _, name in taxonomy.categories]
+
+
+def test_snapshot_is_served_without_queries(app):
+    with app.app_context():
+        first = get_taxonomy()
+        with count_queries() as counter:
+            second = get_taxonomy()
+
+    assert second is first
+    assert counter.count == 0
+
+
+def test_committed_changes_reload_the_snapshot(app):
+    with app.app_context():
+        get_taxonomy()
+        db.session.add(Category(name='Aardvarks'))
+        db.session.commit()
+
+        assert category_names(get_taxonomy())[0] == 'Aardvarks'
+
+
+def test_rolled_back_changes_keep_the_snapshot(app):
+    with app.app_context():
+        snapshot = get_taxonomy()
+        db.session.add(Category(name='Aardvarks'))
+        db.session.flush()
+        db.session.rollback()
+
+        assert get_taxonomy() is snapshot
+
+
+def test_another_process_bumping_the_version_reloads(app):
+    with app.app_context():
+        snapshot = get_taxonomy()
+        # A change committed by another worker only shows in the shared version
+        db.session.execute(db.insert(Category).values(name='Aardvarks'))
+        db.session.commit()
+        assert get_taxonomy() is snapshot
+
+        app.extensions['taxonomy_cache'].store.bump()
+
+        assert 'Aardvarks' in category_names(get_taxonomy())
+
+
+def test_expired_snapshot_is_reloaded(app):
+    with app.app_context():
+        cache = app.extensions['taxonomy_cache']
+        snapshot = get_taxonomy()
+        snapshot.loaded_at = time.monotonic() - cache.ttl - 1
+
+        assert get_taxonomy() is not snapshot
+
+
+def test_new_category_appears_in_the_upload_form(client):
+    client.get('/upload')
+    client.post('/categories/new', data={'name': 'Aardvarks'})
+
+    assert b'Aardvarks' in client.get('/upload').data
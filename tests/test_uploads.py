@@ -0,0 +1,139 @@
+"""
+Tests for the resumable chunked upload API.
+"""
+
+import hashlib
+import os
+from datetime import datetime, timedelta
+
+import pytest
+
+from app.models import db, Image, UploadSession
+
+
+@pytest.fixture
+def small_chunks(app):
+    app.config['UPLOAD_CHUNK_SIZE'] = 64 * 1024
+    return app
+
+
+def start(client, data, **fields):
+    body = {'filename': 'photo.png', 'size': len(data), 'name': 'Test image',
+            'category_id': 1, 'subcategory_id': 1, **fields}
+    return client.post('/api/uploads', json=body)
+
+
+def put(client, upload_id, index, chunk, digest=None):
+    return client.put(f'/api/uploads/{upload_id}/chunks/{index}', data=chunk,
+                      headers={'X-Chunk-SHA256': digest or hashlib.sha256(chunk).hexdigest()})
+
+
+def chunks(data, size):
+    return [data[offset:offset + size] for offset in range(0, len(data), size)]
+
+
+def test_chunks_can_arrive_in_any_order_and_be_resumed(small_chunks, client, image_bytes):
+    data = image_bytes('PNG', (300, 300), noise=True)
+    upload = start(client, data, sha256=hashlib.sha256(data).hexdigest()).json
+    parts = chunks(data, upload['chunk_size'])
+    assert upload['chunk_count'] == len(parts) > 2
+
+    for index in reversed(range(1, len(parts))):
+        assert put(client, upload['id'], index, parts[index]).status_code == 200
+    incomplete = client.post(f"/api/uploads/{upload['id']}/complete")
+    assert incomplete.status_code == 409
+    assert incomplete.json['missing'] == [0]
+
+    # A client resuming the upload asks which chunks are still missing
+    status = client.get(f"/api/uploads/{upload['id']}").json
+    assert sorted(status['received']) == list(range(1, len(parts)))
+    put(client, upload['id'], 0, parts[0])
+    response = client.post(f"/api/uploads/{upload['id']}/complete")
+
+    assert response.status_code == 201
+    with small_chunks.app_context():
+        image = db.session.get(Image, response.json['image_id'])
+        assert image.blob.sha256 == hashlib.sha256(data).hexdigest()
+        assert UploadSession.query.count() == 0
+
+
+def test_chunk_with_wrong_checksum_is_not_recorded(small_chunks, client, image_bytes):
+    data = image_bytes('PNG', (300, 300), noise=True)
+    upload = start(client, data).json
+    first = chunks(data, upload['chunk_size'])[0]
+
+    response = put(client, upload['id'], 0, first, digest='0' * 64)
+
+    assert response.status_code == 422
+    assert client.get(f"/api/uploads/{upload['id']}").json['received'] == []
+
+
+def test_chunk_of_wrong_length_is_refused(small_chunks, client, image_bytes):
+    data = image_bytes('PNG', (300, 300), noise=True)
+    upload = start(client, data).json
+
+    assert put(client, upload['id'], 0, data[:100]).status_code == 400
+
+
+def test_whole_file_checksum_is_verified(client, image_bytes):
+    data = image_bytes('PNG')
+    upload = start(client, data, sha256='0' * 64).json
+    put(client, upload['id'], 0, data)
+
+    assert client.post(f"/api/uploads/{upload['id']}/complete").status_code == 422
+
+
+@pytest.mark.parametrize('size', [True, 0, -5, 1.5, '100', None])
+def test_size_must_be_a_positive_integer(client, size):
+    response = client.post('/api/uploads', json={'filename': 'photo.png', 'size': size, 'name': 'Test image',
+                                                 'category_id': 1, 'subcategory_id': 1})
+
+    assert response.status_code == 400
+
+
+def test_size_over_the_limit_is_refused(app, client):
+    response = start(client, b'', size=app.config['MAX_UPLOAD_SIZE'] + 1)
+
+    assert response.status_code == 413
+
+
+def test_number_of_open_uploads_is_limited(app, client):
+    app.config['MAX_UPLOAD_SESSIONS'] = 2
+
+    assert [start(client, b'x' * 10).status_code for _ in range(3)] == [201, 201, 429]
+
+
+def test_reserved_bytes_are_limited(app, client):
+    app.config['MAX_UPLOAD_RESERVED_BYTES'] = 1000
+
+    assert start(client, b'x' * 600).status_code == 201
+    assert start(client, b'x' * 600).status_code == 429
+    assert start(client, b'x' * 400).status_code == 201
+
+
+def test_stale_uploads_are_purged_to_make_room(app, client):
+    app.config['MAX_UPLOAD_SESSIONS'] = 1
+    stale = start(client, b'x' * 10).json['id']
+    with app.app_context():
+        db.session.get(UploadSession, stale).updated_at = datetime.utcnow() - timedelta(days=2)
+        db.session.commit()
+
+    assert start(client, b'x' * 10).status_code == 201
+    assert client.get(f'/api/uploads/{stale}').status_code == 404
+
+
+def test_uploads_are_not_preallocated(app, client):
+    upload_id = start(client, b'x' * 10_000_000).json['id']
+
+    with app.app_context():
+        assert os.path.getsize(db.session.get(UploadSession, upload_id).get_filepath()) == 0
+
+
+def test_aborted_upload_is_discarded(app, client):
+    upload_id = start(client, b'x' * 10).json['id']
+    with app.app_context():
+        path = db.session.get(UploadSession, upload_id).get_filepath()
+
+    assert client.delete(f'/api/uploads/{upload_id}').status_code in (200, 204)
+    assert client.get(f'/api/uploads/{upload_id}').status_code == 404
+    assert not os.path.exists(path)
@@ -0,0 +1,134 @@
+"""
+Tests for upload validation, through the upload form, the chunked upload
+API and UploadValidator itself.
+"""
+
+import pytest
+
+from app.validation import ImageTooLarge, InvalidImage, UnsupportedImage, UploadValidator, sanitize_svg
+
+LARGE_FILES = [
+    ('WEBP', 'photo.webp', {'quality': 100}),
+    ('WEBP', 'photo.webp', {'lossless': True}),
+    ('JPEG', 'photo.jpg', {'quality': 100}),
+    ('PNG', 'photo.png', {}),
+]
+
+SVG = b'''<?xml version="1.0"?>
+<svg xmlns="http://www.w3.org/2000/svg" xmlns:xlink="http://www.w3.org/1999/xlink" width="10" height="10">
+  <script>alert(1)</script>
+  <rect width="10" height="10" onclick="alert(2)" fill="red"/>
+  <a xlink:href="javascript:alert(3)"><circle r="2"/></a>
+  <use href="#shape"/>
+</svg>'''
+
+
+def validate(data, extension, limits=None, chunk_size=64 * 1024):
+    """Feed a file to an UploadValidator in chunks and finish it."""
+    with_limits = limits or {'max_pixels': 50_000_000, 'max_dimension': 10000,
+                             'max_svg_size': 1024 * 1024,
+                             'allowed_extensions': {'png', 'jpg', 'jpeg', 'gif', 'webp', 'svg'}}
+    validator = UploadValidator(extension, with_limits)
+    for offset in range(0, len(data), chunk_size):
+        validator.feed(data[offset:offset + chunk_size])
+    return validator.finish()
+
+
+@pytest.mark.parametrize('fmt, filename, options', LARGE_FILES)
+def test_large_images_are_accepted_by_the_form(upload, image_bytes, fmt, filename, options):
+    data = image_bytes(fmt, (1200, 1000), noise=True, **options)
+    assert len(data) > 1024 * 1024
+
+    response = upload(data, filename)
+
+    assert b'uploaded successfully' in response.data
+
+
+@pytest.mark.parametrize('fmt, filename, options', LARGE_FILES)
+def test_large_images_are_accepted_by_chunked_uploads(app, chunked_upload, image_bytes, fmt, filename, options):
+    app.config['UPLOAD_CHUNK_SIZE'] = 256 * 1024
+    data = image_bytes(fmt, (1200, 1000), noise=True, **options)
+
+    response = chunked_upload(data, filename)
+
+    assert response.status_code == 201, response.json
+
+
+@pytest.mark.parametrize('options', [{}, {'lossless': True}, {'exif': b'Exif\0\0MM\0*\0\0\0\x08\0\0'}])
+def test_webp_dimensions_are_read_from_the_header(image_bytes, options):
+    info = validate(image_bytes('WEBP', (333, 17), **options), 'webp')
+
+    assert (info.format, info.width, info.height) == ('webp', 333, 17)
+
+
+def test_animated_webp_is_accepted(image_bytes):
+    from io import BytesIO
+
+    from PIL import Image as PILImage
+
+    buffer = BytesIO()
+    PILImage.new('RGB', (50, 40)).save(buffer, 'WEBP', save_all=True,
+                                       append_images=[PILImage.new('RGB', (50, 40), (9, 9, 9))])
+    info = validate(buffer.getvalue(), 'webp')
+
+    assert (info.width, info.height) == (50, 40)
+
+
+@pytest.mark.parametrize('fmt', ['PNG', 'JPEG', 'GIF', 'WEBP'])
+def test_truncated_files_are_refused(image_bytes, fmt):
+    data = image_bytes(fmt, (200, 200), noise=True)
+
+    with pytest.raises(InvalidImage, match='truncated'):
+        validate(data[:len(data) * 3 // 4], fmt.lower())
+
+
+@pytest.mark.parametrize('fmt', ['PNG', 'JPEG', 'WEBP'])
+def test_dimensions_over_the_limit_are_refused(image_bytes, fmt):
+    limits = {'max_pixels': 50_000_000, 'max_dimension': 100, 'max_svg_size': 1024,
+              'allowed_extensions': {'png', 'jpg', 'jpeg', 'webp'}}
+
+    with pytest.raises(ImageTooLarge):
+        validate(image_bytes(fmt, (101, 10)), fmt.lower(), limits)
+
+
+def test_stored_under_the_sniffed_extension(image_bytes):
+    assert validate(image_bytes('JPEG'), 'png').extension == 'jpg'
+
+
+def test_non_images_are_refused_by_the_form(upload):
+    response = upload(b'GIF? no, just text ' * 1000, 'notes.png')
+
+    assert b'not a PNG, JPEG, GIF, WebP or SVG image' in response.data
+
+
+def test_non_images_are_refused_with_the_first_chunk(chunked_upload):
+    response = chunked_upload(b'\0' * 100_000, 'empty.png', complete=False)
+
+    assert response.status_code == UnsupportedImage.status
+
+
+def test_svg_is_sanitized():
+    info = validate(SVG, 'svg')
+
+    assert info.format == 'svg'
+    assert b'<rect' in info.document and b'<use' in info.document
+    for unsafe in (b'script', b'onclick', b'javascript:'):
+        assert unsafe not in info.document
+
+
+def test_svg_with_entities_is_refused():
+    document = b'<!DOCTYPE svg [<!ENTITY x "boom">]><svg xmlns="http://www.w3.org/2000/svg">&x;</svg>'
+
+    with pytest.raises(InvalidImage):
+        sanitize_svg(document)
+
+
+def test_svg_upload_stores_the_sanitized_document(app, upload):
+    from app.models import Image
+
+    response = upload(SVG, 'drawing.svg')
+
+    assert b'uploaded successfully' in response.data
+    with app.app_context():
+        with Image.query.one().blob.local_path() as path, open(path, 'rb') as f:
+            assert b'script' not in f.read()
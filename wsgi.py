@@ -0,0 +1,11 @@
+"""
+WSGI Entry Point for the Image Storage Application.
+
+Production servers import the application from here, e.g.
+`gunicorn wsgi:app` or `waitress-serve wsgi:app`. See serve.py for the
+supported way to run multiple workers.
+"""
+
+from app import create_app
+
+app = create_app()